@@ -0,0 +1,63 @@
+"""
+Parse throughput of ExchangeMessage, before and after the __slots__/integer
+timestamp rewrite
+
+The "before" class is a copy of the original ExchangeMessage, which ran
+datetime.strptime on every match and kept everything in __dict__.
+
+Usage:
+    python benchmarks/exchange_message_parse.py [--messages N] [--repeat R]
+"""
+from argparse import ArgumentParser
+import datetime as dt
+import timeit, tracemalloc
+
+from pygotrader.pygo_order_book import ExchangeMessage
+
+
+class LegacyExchangeMessage(object):
+    def __init__(self, msg):
+        self.sequence = msg["sequence"] if 'sequence' in msg else ""
+        self.time = dt.datetime.strptime(msg["timestamp"], '%Y-%m-%dT%H:%M:%S.%fZ') \
+            if 'timestamp' in msg else dt.datetime.strptime(msg["time"], '%Y-%m-%dT%H:%M:%S.%fZ')
+        self.type = msg["type"]
+        self.product_id = msg["product_id"]
+        self.order_id = msg["order_id"] if 'order_id' in msg else None
+        self.price = float(msg["price"]) if 'price' in msg else None
+        self.side = msg["side"] if 'side' in msg else ""
+        self.remaining_size = msg["remaining_size"] if 'remaining_size' in msg else None
+        self.size = msg["size"] if 'size' in msg else None
+
+
+def make_matches(n):
+    start = dt.datetime(2019, 8, 14, 20, 42, 27)
+    return [{'type': 'match', 'trade_id': i, 'sequence': 1000 + i,
+             'maker_order_id': 'ac928c66-ca53-498f-9c13-a110027a60e8',
+             'taker_order_id': '132fb6ae-456b-4654-b4e0-d681ac05cea1',
+             'time': (start + dt.timedelta(milliseconds=7 * i)).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+             'product_id': 'BTC-USD', 'size': '0.01234567', 'price': f"{10000 + i % 100 / 100:.2f}",
+             'side': 'sell' if i % 2 else 'buy'} for i in range(n)]
+
+def allocated_bytes(cls, messages):
+    tracemalloc.start()
+    parsed = [cls(m) for m in messages]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / len(parsed)
+
+def main():
+    parser = ArgumentParser(description="ExchangeMessage parse throughput")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    messages = make_matches(args.messages)
+
+    print(f"{'implementation':<16}{'msgs/s':>14}{'us/msg':>10}{'bytes/msg':>12}")
+    for name, cls in (('before', LegacyExchangeMessage), ('after', ExchangeMessage)):
+        best = min(timeit.repeat(lambda: [cls(m) for m in messages], number=1, repeat=args.repeat))
+        print(f"{name:<16}{len(messages) / best:>14,.0f}{best / len(messages) * 1e6:>10.2f}"
+              f"{allocated_bytes(cls, messages):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
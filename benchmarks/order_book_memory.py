@@ -0,0 +1,117 @@
+"""
+Resident memory per resting order for the order book engines and order stores
+
+Replays a recorded feed into each book configuration with tracemalloc
+running and reports the memory held by the book after the replay, divided
+by the number of resting orders.  The resting orders are then loaded into
+each order store on its own, without the price levels, to compare the two
+stores directly.
+
+Usage:
+    python benchmarks/order_book_memory.py FEED_FILE
+    python benchmarks/order_book_memory.py --synthetic 50000
+
+FEED_FILE is newline-delimited JSON: the first line is a level-3 snapshot 
+(the response of GET /products/<product>/book?level=3) and every following
+line is a full channel websocket message.  A recording made with --record
+works too, its first snapshot and all of its frames are used.
+"""
+from argparse import ArgumentParser
+import gc, json, random, time, tracemalloc, types, uuid
+
+from pygotrader import feed_recorder, order_store, pygo_order_book
+
+CONFIGURATIONS = [
+    ('sorted', {'book_engine': 'sorted'}),
+    ('tick + dict store', {'book_engine': 'tick', 'order_store': 'dict'}),
+    ('tick + compact store', {'book_engine': 'tick', 'order_store': 'compact'}),
+]
+
+
+def load_feed(path):
+    with open(path, 'rb') as f:
+        recorded = f.read(2) == b'\x1f\x8b'   #gzip magic
+    if recorded:
+        snapshot, messages = None, []
+        for record in feed_recorder.read_feed(path):
+            if record.kind == feed_recorder.FRAME:
+                messages.append(json.loads(record.payload))
+            elif record.kind == feed_recorder.SNAPSHOT and snapshot is None:
+                snapshot = json.loads(record.payload)
+        return snapshot, messages
+    with open(path) as f:
+        snapshot = json.loads(f.readline())
+        messages = [json.loads(line) for line in f if line.strip()]
+    return snapshot, messages
+
+def synthetic_feed(orders, seed=1):
+    """A snapshot of resting orders spread around 10000.00 and no messages"""
+    rng = random.Random(seed)
+    bids, asks = [], []
+    for _ in range(orders):
+        side = bids if rng.random() < 0.5 else asks
+        offset = int(rng.expovariate(1 / 2000.0)) + 1
+        price = 1000000 - offset if side is bids else 1000000 + offset
+        side.append([f"{price / 100:.2f}", f"{rng.randint(1, 10**9) / 10**8:.8f}",
+                     str(uuid.UUID(int=rng.getrandbits(128), version=4))])
+    return {'sequence': 1, 'bids': bids, 'asks': asks}, []
+
+def measure(snapshot, messages, options, quote_increment):
+    ns = types.SimpleNamespace(highest_bid=0.00, last_match=0.00, my_orders={})
+    gc.collect()
+    tracemalloc.start()
+    book = pygo_order_book.PygoOrderBook(ns, quote_increment=quote_increment, **options)
+    book._client.get_product_order_book = lambda product_id, level: snapshot
+    start = time.perf_counter()
+    book.on_message({'type': 'heartbeat', 'sequence': snapshot['sequence']})
+    for message in messages:
+        book.on_message(message)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    resting = len(book.tick_book.orders) if book.tick_book is not None else \
+        sum(len(level) for level in book._asks.values()) + sum(len(level) for level in book._bids.values())
+    return memory, resting, elapsed, book
+
+def measure_store(kind, resting_orders):
+    gc.collect()
+    tracemalloc.start()
+    store = order_store.create_order_store(kind)
+    for order_id, is_bid, tick, size in resting_orders:
+        #a fresh id string per order, like the ones decoded off the feed
+        store.insert(''.join(order_id), is_bid, tick, size)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return memory
+
+def main():
+    parser = ArgumentParser(description="Compare order book memory per resting order")
+    parser.add_argument("feed", nargs='?', help="Recorded feed file")
+    parser.add_argument("--synthetic", type=int, default=0,
+        help="Use a generated snapshot with this many resting orders instead of a feed file")
+    parser.add_argument("--quote_increment", default='0.01')
+    args = parser.parse_args()
+    if args.feed:
+        snapshot, messages = load_feed(args.feed)
+    else:
+        snapshot, messages = synthetic_feed(args.synthetic or 50000)
+
+    print(f"{'configuration':<24}{'resting':>10}{'MiB':>10}{'bytes/order':>14}{'replay s':>10}")
+    resting_orders = None
+    for name, options in CONFIGURATIONS:
+        memory, resting, elapsed, book = measure(snapshot, messages, options, args.quote_increment)
+        print(f"{name:<24}{resting:>10}{memory / 2**20:>10.2f}{memory / max(resting, 1):>14.0f}{elapsed:>10.2f}")
+        if book.tick_book is not None and resting_orders is None:
+            resting_orders = list(book.tick_book.orders.items())
+
+    print()
+    print(f"{'order store only':<24}{'resting':>10}{'MiB':>10}{'bytes/order':>14}")
+    for kind in ('dict', 'compact'):
+        memory = measure_store(kind, resting_orders)
+        print(f"{kind:<24}{len(resting_orders):>10}{memory / 2**20:>10.2f}{memory / max(len(resting_orders), 1):>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
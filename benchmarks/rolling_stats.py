@@ -0,0 +1,89 @@
+"""
+Per-tick cost of the rolling estimators against refitting the whole window
+
+A window of N (time, price) points slides along a random walk one point at
+a time.  Each tick adds the new point and removes the oldest one from the
+rolling_stats estimators, which is compared with refitting the window from
+scratch with scipy.stats.linregress (numpy.polyfit if scipy isn't installed)
+and numpy's mean/var/max/min, which is what an algorithm without the 
+rolling estimators would do on every run.
+
+Usage:
+    python benchmarks/rolling_stats.py
+    python benchmarks/rolling_stats.py --windows 100 10000 1000000 --ticks 2000
+"""
+from argparse import ArgumentParser
+import time
+
+import numpy as np
+
+from pygotrader import rolling_stats
+
+try:
+    from scipy.stats import linregress
+    def refit(x, y):
+        return linregress(x, y).slope
+except ImportError:
+    def refit(x, y):
+        return np.polyfit(x, y, 1)[0]
+
+
+def walk(count, seed=1):
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.exponential(0.3, count))
+    y = 10000 + np.cumsum(rng.normal(0, 2.5, count))
+    return x, y
+
+def rolling_per_tick(window, ticks):
+    x, y = walk(window + ticks)
+    xs, ys = x.tolist(), y.tolist()
+    ols = rolling_stats.RollingOLS()
+    moments = rolling_stats.RollingMoments()
+    high, low = rolling_stats.RollingMax(), rolling_stats.RollingMin()
+    for i in range(window):
+        ols.add(xs[i], ys[i])
+        moments.add(ys[i])
+        high.add(i, ys[i])
+        low.add(i, ys[i])
+    start = time.perf_counter()
+    for i in range(window, window + ticks):
+        old = i - window
+        ols.remove(xs[old], ys[old])
+        moments.remove(ys[old])
+        ols.add(xs[i], ys[i])
+        moments.add(ys[i])
+        high.add(i, ys[i])
+        low.add(i, ys[i])
+        high.evict(old + 1)
+        low.evict(old + 1)
+        ols.slope, moments.std(), high.value, low.value
+    elapsed = time.perf_counter() - start
+    #how far the incremental fit drifted from a fresh one by the end
+    error = abs(ols.slope - refit(x[-window:], y[-window:]))
+    return elapsed / ticks, error
+
+def refit_per_tick(window, ticks):
+    x, y = walk(window + ticks)
+    start = time.perf_counter()
+    for i in range(window, window + ticks):
+        wx, wy = x[i - window + 1:i + 1], y[i - window + 1:i + 1]
+        refit(wx, wy), wy.std(ddof=1), wy.max(), wy.min()
+    return (time.perf_counter() - start) / ticks
+
+def main():
+    parser = ArgumentParser(description="Compare per-tick cost of rolling statistics with refitting the window")
+    parser.add_argument("--windows", type=int, nargs='+', default=[100, 1000, 10000, 100000, 1000000])
+    parser.add_argument("--ticks", type=int, default=2000, help="Ticks to time per window size")
+    parser.add_argument("--refit_ticks", type=int, default=50,
+        help="Ticks to time the refit with, it gets slow for big windows")
+    args = parser.parse_args()
+
+    print(f"{'window':>10}{'rolling us/tick':>18}{'refit us/tick':>16}{'speedup':>10}{'slope error':>14}")
+    for window in args.windows:
+        rolling, error = rolling_per_tick(window, args.ticks)
+        refitted = refit_per_tick(window, args.refit_ticks)
+        print(f"{window:>10}{rolling * 1e6:>18.2f}{refitted * 1e6:>16.1f}{refitted / rolling:>10.0f}x{error:>14.2e}")
+
+
+if __name__ == "__main__":
+    main()
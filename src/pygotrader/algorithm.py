@@ -24,7 +24,6 @@ For more info on the Coinbase Pro API: https://docs.pro.coinbase.com/
 The shared namespace, as denoted by the "ns" object passed into the function, contains the 
 following variables and data structures:
 
-    ns.exchange_order_matches = my_manager.list()
     ns.buy_order_queue = my_manager.list()
     ns.sell_order_queue = my_manager.list()
     ns.cancel_order_queue = my_manager.list()
@@ -32,48 +31,100 @@ following variables and data structures:
     ns.last_match = 0.00
     ns.highest_bid = 0.00
     ns.lowest_ask = 0.00
+    ns.spread = 0.00
+    ns.message_rate = 0.0
     ns.message = ''
-    ns.ui_asks = my_manager.list()
-    ns.ui_bids = my_manager.list()
+
+The market values (last_match, highest_bid, lowest_ask, spread, message_rate) are 
+published by the feed every 0.1 seconds, or sooner when a price moves by 0.1% or more.
+    
+Trade matches are passed in as "matches", a shared_state.MatchRingBuffer.  Its read 
+methods return a MatchColumns tuple of NumPy arrays (sequence, ts_ns, price, size, side),
+oldest match first:
+
+    matches.last(seconds)       #matches from the last N seconds
+    matches.since(sequence)     #matches after an exchange sequence number
+    
+"windows" gives the matches of the last 10, 60 and 300 seconds, kept up to date 
+between calls so the cost doesn't grow with the window length (see windows.py):
+
+    w = windows.window(10)
+    w.time, w.price, w.size, w.side     #NumPy arrays, oldest first
+    
+Features of the book and recent trades are computed by the feed and passed in as 
+"features", a shared_state.SharedRecord.  features.read() returns a dict of floats 
+(NaN until known), see features.py for the full list:
+
+    f = features.read()
+    f['microprice'], f['spread'], f['imbalance']  #top of book
+    f['ofi_10s']                                  #order flow imbalance, last 10 seconds
+    f['vwap_60s'], f['volume_60s']                #trades in the last minute
+    
+When more than one product is watched (--product BTC-USD ETH-USD), add a "products" 
+argument to get every product's feed.ProductState, keyed by product id:
+
+    products['ETH-USD'].ns.highest_bid
+    products['ETH-USD'].depth_ladder.read()
+    products['ETH-USD'].match_buffer.last(seconds)
+    products['ETH-USD'].features.read()
+
+Everything above is read while the feed keeps updating, so the depth ladder, the 
+features and ns can each be from a slightly different moment.  To see the market as of 
+one feed update, take a "snapshot" argument, a shared_state.MarketSnapshot that's read
+in one go right before every call and can't change while you look at it:
+
+    snapshot.bid, snapshot.ask, snapshot.last_price   #top of book and last trade
+    snapshot.asks, snapshot.bids                      #(n, 2) arrays of (price, size)
+    snapshot.matches                                  #MatchColumns of the last 10 seconds
+    snapshot.sequence, snapshot.version               #exchange sequence, feed publish count
+
+"asks" and "bids" on their own are the same arrays as snapshot.asks and snapshot.bids.
+
+Keep statistics between calls instead of recomputing them on every tick with 
+the estimators in rolling_stats.py (mean/variance, z-score, OLS, min/max, EWMA).
+rolling_stats.RollingMatchStats keeps them up to date over the last N seconds of
+matches, only looking at the matches that came or went since the last call.
+
+Only the arguments trading_algorithm() lists are passed in, so leave out any it doesn't use.
+
+To try an algorithm on a recorded feed (see --record) instead of the live market:
+
+    python -m pygotrader.backtest FEED_FILE algorithm.py
+
+which calls trading_algorithm() with a simulated order_handler that fills against the 
+recorded book.  Add a "params" argument to get the values of --param NAME=VALUE.  
+vectorized_algorithm() below is the same idea written against NumPy arrays, for 
+backtesting with --vectorized: it gets every recorded trade at once and returns the 
+position to hold after each one, which takes seconds for a whole day of trades.
     
 """
 
 
-from scipy import stats
-from pygotrader import order_handler
-import datetime
+import numpy as np
+from pygotrader import order_handler, rolling_stats
+
+#Module-level state survives between calls (until the file is reloaded)
+price_stats = None
 
 
-def trading_algorithm(ns, order_handler, asks=None, bids=None, matches=None):
+def trading_algorithm(ns, order_handler, matches=None):
+    global price_stats
     def display_message(text):
         ns.message = text
         
     #This is a rolling window to allow the algorithm to only view the matches that happened
-    #in the last 10 seconds
-    rolling_window = 10
-    length = len(matches)
-    now = datetime.datetime.utcnow()
-    i=0
-    while i <= (length -1): #TODO speed this while loop up.  Currently averaging around 0.004s
-        start = matches[i].time
-        if start < (now - datetime.timedelta(seconds=rolling_window)):
-             del matches[i]
-             i=-1
-             length = len(matches)  #New matches may be added while this loop is executing
-        else:
-            break
-        i+=1
-    current_matches = matches    
+    #in the last 10 seconds.  The regression is on the match's position in the feed, 
+    #so the slope is in dollars per trade
+    if price_stats is None:
+        price_stats = rolling_stats.RollingMatchStats(matches, seconds=10, regress_on='index')
+    price_stats.update()
     
     #Run a linear regression on the matches' price and then based on the slope, buy or sell
     #Note that this doesn't turn a profit.  This will lose you money.  But its an example
     #of what you can do.
-    list_size = len(current_matches)
-    if (list_size <= 2):
+    if (price_stats.count <= 2):
         return 0
-    x = list(range(0,list_size))
-    y = [current_matches[i].price for i in x]
-    slope, intercept, r_value, p_value, std_err = stats.linregress(x,y)
+    slope = price_stats.ols.slope
 
     if(slope > 0.1): 
         display_message(f"Slope: {slope} - Buy")
@@ -81,4 +132,26 @@ def trading_algorithm(ns, order_handler, asks=None, bids=None, matches=None):
     elif(slope < -0.1):
         display_message(f"Slope: {slope} - Sell")
         # order_handler.create_sell_order(size=0.01,price=0.00,product_id='BTC-USD',type='market')
-        
\ No newline at end of file
+        
+
+
+def vectorized_algorithm(matches, window=50, threshold=0.1, size=0.01):
+    #Same regression as above, but over the last `window` trades at every trade, using
+    #running sums so it's a handful of array operations for the whole recording
+    price = matches.price
+    n = len(price)
+    if n <= window:
+        return np.zeros(n)
+    index = np.arange(n, dtype=float)
+    sum_y = np.cumsum(price)
+    sum_iy = np.cumsum(index * price)
+    window_y = sum_y[window - 1:] - np.concatenate(([0.0], sum_y[:-window]))
+    window_iy = sum_iy[window - 1:] - np.concatenate(([0.0], sum_iy[:-window]))
+    first = index[:n - window + 1]
+    #x runs 0..window-1 inside each window
+    sum_xy = window_iy - first * window_y
+    sum_x = window * (window - 1) / 2
+    sum_xx = (window - 1) * window * (2 * window - 1) / 6
+    slope = (window * sum_xy - sum_x * window_y) / (window * sum_xx - sum_x ** 2)
+    position = np.where(slope > threshold, size, np.where(slope < -threshold, -size, 0.0))
+    return np.concatenate((np.zeros(window - 1), position))
@@ -1,40 +1,135 @@
 from cbpro.order_book import OrderBook
 from sortedcontainers import SortedDict
 from decimal import Decimal
-import datetime, json, os, time, traceback
+import datetime, inspect, json, os, time, traceback
 from threading import Thread
 import multiprocessing
-from scipy import stats
-from importlib import reload
-from pygotrader import algorithm
+from pygotrader.metrics import SchedulerStats
+from pygotrader.reloader import AlgorithmReloader
+from pygotrader.tick_profiler import TickProfiler
+from pygotrader.windows import RollingWindows
+
+
+def algorithm_arguments(function, available):
+    """Pick the keyword arguments out of available that function accepts
+    
+    All of them are passed if it takes **kwargs.  This way new arguments can be 
+    offered without breaking algorithm files written before they existed.
+    """
+    parameters = inspect.signature(function).parameters
+    if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values()):
+        return dict(available)
+    return {name: value for name, value in available.items() if name in parameters}
 
 class AlgorithmHandler(object):
     """
     This class handles user-created algorithms used for trading.  It will reload
-    the algorithm file (which is named algorithm.py by default) in real-time 
-    (well, after a slight lag of 10 seconds or less by default) by checking on a change 
-    in the modified time of the file. If there is an error, it will sleep for 30 seconds
-    to allow the user to fix the error, and then it will attempt to reload it again.
+    the algorithm file (which is named algorithm.py by default) in real-time, as
+    soon as it's saved (see reloader.py).  Each new version is compiled and 
+    checked on a background thread and swapped in between two runs only if it
+    loads, otherwise the previous version keeps running and the error is written
+    to algorithm_error.txt.  If the algorithm raises an error while running, it 
+    isn't run again for 30 seconds, or until a new version has been saved.
     
     The algorithm file needs to have a function called trading_algorithm(), which 
     is called below by the main_loop() function.  The user is allowed to code 
     anything with any library, but they are only given the asks, bids, and matches 
-    from the order book and websocket feed.
+    from the order book and websocket feed.  matches is the shared 
+    shared_state.MatchRingBuffer that the order book writes trades into.
+    windows is a windows.RollingWindows over matches with window_lengths 
+    seconds, moved up to the current time right before every call.
+    features is the shared_state.SharedRecord the order book publishes its
+    features.FeatureEngine values to, so they're computed once in the feed.
+    products maps each watched product id to its feed.ProductState, for 
+    algorithms that look at more than one product.
+    snapshot is a shared_state.MarketSnapshot read from the feed's 
+    market_snapshot right before every call: depth, top of book, last trade,
+    sequence number and the last snapshot_window seconds of matches, all as
+    of the same feed update and copied out of shared memory in one go, so 
+    they can't change while the algorithm looks at them.  asks and bids are
+    its depth arrays.  Only the arguments that
+    trading_algorithm() declares are passed (see algorithm_arguments).
     
     Notable arguments:
-    run_rate: This is how often the algorithm is called, in seconds
+    schedule: 'poll' calls the algorithm every run_rate seconds (plus 0.1 
+    seconds).  'event' waits on the feed's update_signal (a 
+    shared_state.UpdateSignal) and calls it as soon as something new has been
+    published, after waiting debounce seconds to let a burst of updates 
+    settle, and at most max_rate times a second.
+    run_rate: This is how often the algorithm is called in poll mode, in seconds
+    tick_budget: how long one call may take before it counts as an overrun.
+    Defaults to run_rate in poll mode and 1/max_rate in event mode
+    profile_dir: if set, a sample of calls is run under cProfile and the 
+    slowest are saved here (see tick_profiler.py), one in every profile_every
+    
+    Every call is timed (algorithm_stats['tick_time'], with p50/p90/p99/max)
+    and checked against the budget (algorithm_stats['overruns']), profiled
+    calls too, with the profiler's overhead.
+    With an update_signal, both modes measure how long after the feed 
+    published an update the algorithm started and finished (see 
+    metrics.SchedulerStats), published to ns.algorithm_stats once a second.
+    algorithm_stats['reload'] has how long versions took to load and how long
+    trading paused while swapping them (metrics.ReloadStats).
+    
+    A handler given a name (one of several run by a strategy_pool.StrategyPool)
+    publishes to ns.algorithm_stats_<name> and writes algorithm_error_<name>.txt
+    instead, so the strategies don't overwrite each other's, and keeps its 
+    profiles in a profile_dir/<name> directory.
     """
     
-    def __init__(self,ns, authenticated_client, order_handler, algorithm_file='./algorithm.py', debug = False, run_rate = 0.1):
+    def __init__(self,ns, authenticated_client, order_handler, algorithm_file='./algorithm.py', debug = False, run_rate = 0.1,
+        match_buffer=None, products=None, features=None, schedule='poll', update_signal=None, debounce=0.0,
+        max_rate=20.0, window_lengths=(10, 60, 300), name=None, tick_budget=None, profile_dir=None,
+        profile_every=100, market_snapshot=None, snapshot_window=10):
         self.ns = ns
+        self.name = name
+        self.stats_attribute = 'algorithm_stats' if name is None else f'algorithm_stats_{name}'
+        self.error_file = 'algorithm_error.txt' if name is None else f'algorithm_error_{name}.txt'
+        self.match_buffer = match_buffer
+        self.features = features
+        self.market_snapshot = market_snapshot
+        self.snapshot_window = snapshot_window
+        self.products = products or {}
         self.authenticated_client = authenticated_client
         self.order_handler = order_handler
         self.debug = debug 
         self.shutdown_event = multiprocessing.Event()       
         self.event = multiprocessing.Event()
         self.algorithm_file = algorithm_file
-        self.algorithm_reload_time = 10
+        self.algorithm_reload_time = 1   #how often to check the file where inotify isn't available
+        self.algorithm = None
+        self.kwargs = {}
+        self.reloader = None
         self.algorithm_run_rate = run_rate  #how often the algorithm runs
+        if schedule not in ('poll', 'event'):
+            raise ValueError(f"Unknown schedule: {schedule}")
+        if schedule == 'event' and update_signal is None:
+            raise ValueError("Event scheduling needs the feed's update_signal")
+        self.schedule = schedule
+        self.update_signal = update_signal
+        #our own reader, so every strategy waiting on the signal wakes on every update
+        self.update_reader = update_signal.reader() if update_signal is not None else None
+        self.debounce = debounce
+        self.max_rate = max_rate
+        self.window_lengths = window_lengths
+        self.windows = None
+        if tick_budget is None:
+            if schedule == 'poll':
+                tick_budget = run_rate or None
+            else:
+                tick_budget = 1.0 / max_rate if max_rate else None
+        self.stats = SchedulerStats(budget=tick_budget)
+        if profile_dir is not None and name is not None:
+            profile_dir = os.path.join(profile_dir, name)
+        self.profile_dir = profile_dir
+        self.profile_every = profile_every
+        self.profiler = None
+        self.stats_interval = 1.0
+        self._last_run = 0.0
+        self._last_updates = None
+        self._last_stats_publish = 0.0
+        self._last_run_end = None
+        self._swapped_at = None
 
     def start(self):
         self.process = multiprocessing.Process(target=self.main_loop, args=(self.ns,self.shutdown_event))
@@ -45,28 +140,134 @@ class AlgorithmHandler(object):
         self.process.join()
 
     def main_loop(self, ns, event):
-        algo_last_modified = os.stat(self.algorithm_file).st_mtime
-        now = datetime.datetime.utcnow()
-        timer = now
+        if self.profile_dir is not None:
+            self.profiler = TickProfiler(self.profile_dir, every=self.profile_every)
+        if self.match_buffer is not None:
+            self.windows = RollingWindows(self.match_buffer, self.window_lengths)
+        available = {'windows': self.windows, 'ns': self.ns, 'order_handler': self.order_handler, 'matches': self.match_buffer,
+                     'products': self.products, 'features': self.features, 'snapshot': None, 'asks': None, 'bids': None}
+        self.reloader = AlgorithmReloader(self.algorithm_file, available, poll_interval=self.algorithm_reload_time)
+        self.swap_algorithm(self.reloader.load())
+        self.reloader.start()
         
-        while not self.shutdown_event.is_set():
-            now = datetime.datetime.utcnow()
-            if ((now - timer) > datetime.timedelta(seconds=self.algorithm_reload_time)):
-                timer = now
-                algo_current_modified = os.stat(self.algorithm_file).st_mtime
-                if algo_current_modified != algo_last_modified:
-                    reload(algorithm)
-                    algo_last_modified = algo_current_modified
-                    reload_time = datetime.datetime.utcnow() - now
-                    self.ns.message = f"Algorithm reloaded in {reload_time.total_seconds()} seconds"
+        try:
+            while not self.shutdown_event.is_set():
+                loaded = self.reloader.take()
+                if loaded is not None:
+                    self.swap_algorithm(loaded)
+                if self.algorithm is None:
+                    #nothing that loads yet, wait for the next save
+                    self.reloader.ready.wait(1.0)
+                    continue
+
+                if self.schedule == 'event' and not self.wait_for_update():
+                    continue
+
+                try:
+                    self.run_algorithm()
+                    if self.schedule == 'poll':
+                        time.sleep(self.algorithm_run_rate)
+                except Exception as e:
+                    self.ns.message = f"Error in {self.algorithm_file}.  Please see {self.error_file} for more details."
+                    self.write_error(traceback.format_exc())
+                    self.reloader.ready.wait(30)
+                self.publish_stats()
+                
+                if self.schedule == 'poll':
+                    time.sleep(0.1)
+        finally:
+            self.reloader.close()
+
+    def swap_algorithm(self, loaded):
+        """Switch to a version of the algorithm loaded by the reloader, unless it failed to load"""
+        if loaded.error is not None:
+            if self.algorithm is None:
+                self.ns.message = f"Error loading {self.algorithm_file}.  Please see {self.error_file} for more details."
+            else:
+                self.ns.message = f"Error loading {self.algorithm_file}, still running the previous version.  Please see {self.error_file} for more details."
+            self.write_error(loaded.error)
+            return False
+        if self.algorithm is not None:
+            self.reloader.stats.reloads += 1
+            self.ns.message = f"Algorithm reloaded in {loaded.seconds:.4f} seconds"
+            self._swapped_at = self._last_run_end
+        self.algorithm = loaded.module
+        self.kwargs = loaded.kwargs
+        return True
+
+    def write_error(self, text):
+        with open(self.error_file,"w") as f:
+            f.write(text)
+
+    def wait_for_update(self):
+        """Wait for the feed to publish something, then for the debounce and 
+        the max rate.  Returns False if nothing came within a second, so the
+        main loop still gets to check for a new algorithm file."""
+        if not self.update_reader.wait(1.0):
+            return False
+        if self.debounce:
+            time.sleep(self.debounce)
+        if self.max_rate:
+            wait = self._last_run + 1.0 / self.max_rate - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        self.stats.wakeups += 1
+        return True
+
+    def run_algorithm(self):
+        """Call trading_algorithm once, timing it against the feed updates it saw"""
+        oldest_ns = 0
+        if self.update_reader is not None:
+            updates, oldest_ns = self.update_reader.consume()
+            if self._last_updates is not None and updates - self._last_updates > 1:
+                self.stats.coalesced += updates - self._last_updates - 1
+            self._last_updates = updates
+        if self.windows is not None:
+            self.windows.update()
+        if self.market_snapshot is not None:
+            self.read_snapshot()
+        start_ns = time.time_ns()
+        self._last_run = time.monotonic()
+        if self._swapped_at is not None:
+            self.reloader.stats.swap_gap.record(self._last_run - self._swapped_at)
+            self._swapped_at = None
+        profiling = self.profiler is not None and self.profiler.should_profile()
+        if profiling:
+            self.profiler.start()
+        tick_start = time.perf_counter()
+        try:
+            self.algorithm.trading_algorithm(**self.kwargs)  #user made algorithm
+        finally:
+            tick_time = time.perf_counter() - tick_start
+            self._last_run_end = time.monotonic()
+            overran = self.stats.record_tick(tick_time)
+            if profiling:
+                self.profiler.stop(tick_time)
+                self.stats.profiled += 1
+            elif overran and self.profiler is not None:
+                self.profiler.overran()
+        if oldest_ns:
+            self.stats.feed_to_start.record((start_ns - oldest_ns) / 1e9)
+            self.stats.feed_to_decision.record((time.time_ns() - oldest_ns) / 1e9)
+        self.stats.runs.mark()
+
+    def read_snapshot(self):
+        """Fill in the snapshot arguments, if the algorithm takes any"""
+        kwargs = self.kwargs
+        if 'snapshot' not in kwargs and 'asks' not in kwargs and 'bids' not in kwargs:
+            return
+        snapshot = self.market_snapshot.read(self.match_buffer, window=self.snapshot_window)
+        for name, value in (('snapshot', snapshot), ('asks', snapshot.asks), ('bids', snapshot.bids)):
+            if name in kwargs:
+                kwargs[name] = value
 
-            try:
-                algorithm.trading_algorithm(ns=self.ns,order_handler=self.order_handler,matches=self.ns.exchange_order_matches)  #user made algorithm
-                time.sleep(self.algorithm_run_rate)
-            except Exception as e:
-                self.ns.message = f"Error in {self.algorithm_file}.  Please see algorithm_error.txt for more details."
-                with open("algorithm_error.txt","w") as f:
-                    f.write(traceback.format_exc())
-                time.sleep(30)
-            
-            time.sleep(0.1)
+    def publish_stats(self):
+        now = time.monotonic()
+        if now - self._last_stats_publish >= self.stats_interval:
+            stats = self.stats.snapshot()
+            if self.reloader is not None:
+                stats['reload'] = self.reloader.stats.snapshot()
+            if self.profiler is not None:
+                stats['profiles'] = self.profiler.snapshot()
+            setattr(self.ns, self.stats_attribute, stats)
+            self._last_stats_publish = now
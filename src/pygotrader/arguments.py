@@ -13,7 +13,8 @@ TODO:
 - Move exchanges and currencies to a config file
 """
 from argparse import Action, ArgumentParser
-import os
+import os, re
+from pygotrader.strategy_pool import parse_strategy
 
 exchanges = ['coinbase']
 products = ['BTC-USD','ETH-USD','LTC-USD','XRP-USD']
@@ -37,18 +38,49 @@ class ConfigArgumentAction(Action):
 
 class ProductArgumentAction(Action):
     def __call__(self, parser, namespace, values, option_string=None):
-        product = values
-        if product.upper() not in products:
-            parser.error("Unknown product")
-        namespace.product = product.upper()
+        chosen = []
+        for product in values:
+            product = product.upper()
+            if not re.fullmatch(r'[A-Z0-9]+-[A-Z0-9]+', product):
+                parser.error(f"Unknown product {product}, expected something like {products[0]}")
+            if product not in chosen:
+                chosen.append(product)
+        namespace.product = chosen
         
 class AlgoArgumentAction(Action):
+    """Each use adds a strategy_pool.StrategySpec to the list of strategies"""
     def __call__(self, parser, namespace, values, option_string=None):
-        algorithm_file = values
-        if not os.path.exists(algorithm_file):
-            parser.error(f"{algorithm_file} not found.  Run this program again without this argument to create a sample file in the local directory.")
+        try:
+            strategy = parse_strategy(values)
+        except ValueError as e:
+            parser.error(str(e))
+        if not os.path.exists(strategy.algorithm_file):
+            parser.error(f"{strategy.algorithm_file} not found.  Run this program again without this argument to create a sample file in the local directory.")
         else:
-            namespace.algorithm_file = algorithm_file
+            if namespace.algorithm_file is self.default:
+                namespace.algorithm_file = []
+            namespace.algorithm_file = namespace.algorithm_file + [strategy]
+
+class WorkersArgumentAction(Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        workers = values
+        if workers < 0:
+            parser.error("Number of feed workers can't be negative")
+        namespace.feed_workers = workers
+
+class DepthArgumentAction(Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        depth = values
+        if depth < 1:
+            parser.error("Depth must be at least 1 price level")
+        namespace.depth = depth
+
+class ReplayArgumentAction(Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        feed_file = values
+        if not os.path.isfile(feed_file):
+            parser.error("Feed file to replay does not exist")
+        namespace.replay = feed_file
 
 def create_parser():
     """Helper function to parse command-line arguments
@@ -68,15 +100,113 @@ def create_parser():
         action=ConfigArgumentAction,
         required=False)  
     parser.add_argument("--product", 
-        help=f"Coin pairing to trade with.  Currently supported products: {products}",
+        help=f"One or more coin pairings to watch, all over one connection, e.g. {' '.join(products)}.  Orders and the algorithm default to the first one",
         metavar=("PRODUCT"),
+        nargs='+',
         action=ProductArgumentAction,
         required=False,
-        default=products[0])
+        default=products[:1])
+    parser.add_argument("--feed_workers", 
+        help="Number of worker processes to spread the products' order books across.  Default is 0, which keeps every book in the main process",
+        metavar=("WORKERS"),
+        action=WorkersArgumentAction,
+        type=int,
+        required=False,
+        default=0)
     parser.add_argument("--algorithm_file", 
-        help=f"File that holds the user's trading algorithm. Default is ./algorithm.py",
-        metavar=("PRODUCT"),
+        help=f"File that holds the user's trading algorithm. Default is ./algorithm.py.  Give it more than once to run several algorithms in parallel, each in its own process.  Add @SECONDS to set how often one runs, e.g. trend.py@0.5",
+        metavar=("PATH[@SECONDS]"),
         action=AlgoArgumentAction,
         required=False,
-        default='./algorithm.py')         
+        default=[parse_strategy('./algorithm.py')])         
+    parser.add_argument("--algorithm_schedule", 
+        help="When the algorithm runs: 'poll' (every 0.2 seconds) or 'event' (as soon as the feed has something new).  Default is poll",
+        metavar=("SCHEDULE"),
+        choices=['poll','event'],
+        required=False,
+        default='poll')
+    parser.add_argument("--algorithm_debounce", 
+        help="With --algorithm_schedule event, seconds to wait after an update for more to arrive before running the algorithm. Default is 0",
+        metavar=("SECONDS"),
+        type=float,
+        required=False,
+        default=0.0)
+    parser.add_argument("--algorithm_max_rate", 
+        help="With --algorithm_schedule event, the most times per second the algorithm is run. Default is 20",
+        metavar=("RUNS"),
+        type=float,
+        required=False,
+        default=20.0)
+    parser.add_argument("--algorithm_tick_budget", 
+        help="Seconds one run of the algorithm may take before it counts as an overrun in algorithm_stats. Default is the time between runs",
+        metavar=("SECONDS"),
+        type=float,
+        required=False,
+        default=None)
+    parser.add_argument("--algorithm_profile", 
+        help="Directory to save cProfile captures of the algorithm's slowest runs to.  Only a sample of runs is profiled",
+        metavar=("DIR"),
+        required=False,
+        default=None)
+    parser.add_argument("--algorithm_profile_every", 
+        help="With --algorithm_profile, profile one run in every N (and the run after an overrun). Default is 100",
+        metavar=("N"),
+        type=int,
+        required=False,
+        default=100)
+    parser.add_argument("--order_gateway", 
+        help="Send orders from an asyncio order gateway instead of the order handler's threads: several at once, over kept-alive connections (see order_gateway.py)",
+        action='store_true',
+        required=False,
+        default=False)
+    parser.add_argument("--order_max_in_flight", 
+        help="The most orders and cancels sent to the exchange at the same time, by the order handler or the --order_gateway. Default is 8",
+        metavar=("ORDERS"),
+        type=int,
+        required=False,
+        default=8)
+    parser.add_argument("--colocated_algorithm", 
+        help="File with an async trading_algorithm() to run on the feed's own event loop, called with the live order book after every update and placing orders directly (see colocated.py).  Can't be combined with --feed_workers",
+        metavar=("PATH"),
+        required=False,
+        default=None)
+    parser.add_argument("--colocated_budget", 
+        help="Seconds of the feed's event loop one call of the colocated algorithm may use before it's cancelled. Default is 0.001",
+        metavar=("SECONDS"),
+        type=float,
+        required=False,
+        default=0.001)
+    parser.add_argument("--depth", 
+        help="Number of ask/bid price levels to publish from the order book. Default is 10",
+        metavar=("LEVELS"),
+        action=DepthArgumentAction,
+        type=int,
+        required=False,
+        default=10)
+    parser.add_argument("--book_engine", 
+        help="How the order book is stored: 'sorted' (Decimal prices) or 'tick' (integer ticks). Default is sorted",
+        metavar=("ENGINE"),
+        choices=['sorted','tick'],
+        required=False,
+        default='sorted')
+    parser.add_argument("--feed", 
+        help="What to subscribe to: 'full' (every order, needed to track your own orders) or 'level2' (aggregated depth and trades, much less bandwidth and CPU).  Default is full",
+        metavar=("CHANNEL"),
+        choices=['full','level2'],
+        required=False,
+        default='full')
+    parser.add_argument("--record", 
+        help="Append the raw websocket feed and order book snapshots to FEED_FILE (see feed_recorder.py)",
+        metavar=("FEED_FILE"),
+        required=False)
+    parser.add_argument("--replay", 
+        help="Play back a feed recorded with --record instead of connecting to the exchange's feed.  Orders still go to the exchange",
+        metavar=("FEED_FILE"),
+        action=ReplayArgumentAction,
+        required=False)
+    parser.add_argument("--replay_speed", 
+        help="Playback speed for --replay, e.g. 1 for the recorded pace or 10 for ten times faster. Default is as fast as possible",
+        metavar=("SPEED"),
+        type=float,
+        required=False)
     return parser
\ No newline at end of file
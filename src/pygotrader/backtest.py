@@ -0,0 +1,474 @@
+"""
+Backtesting trading algorithms against a recorded feed
+
+A recording made with --record (see feed_recorder.py) holds everything the
+book saw, so an algorithm file can be run against it offline, as fast as
+the machine allows, two ways:
+
+run_backtest: event driven.  The recording is replayed into an offline
+PygoOrderBook, and trading_algorithm() is called every `interval` seconds of
+recorded time with the same arguments it gets live (ns, order_handler,
+matches, windows, features, products, snapshot, asks, bids), plus "params",
+the parameters being tested.  The algorithm itself doesn't change.  Its order_handler is a
+SimulatedOrderHandler, which fills orders against the recorded book after a
+latency and charges fees.  The match buffer's clock is the recorded time,
+so matches.last(), windows and rolling_stats all see the recording's "now".
+
+run_vectorized: for strategies written against NumPy arrays.  The algorithm
+file defines vectorized_algorithm(matches, **params), which gets every
+recorded trade at once (a shared_state.MatchColumns of arrays) and returns
+the position it wants to hold after each trade.  Orders are filled at the
+price of the first trade `latency` seconds later, so a whole day of trades
+takes a few array operations.  Only the trades are decoded, not the book.
+
+sweep: runs either over every combination of a grid of parameters, spread
+across a process pool.
+
+Fills are taker fills walking the book (event driven) or at trade prices
+(vectorized).  Liquidity a taker fill uses up is gone for later orders only
+until the next recorded message, since the recording doesn't know about
+our orders, and the vectorized backtest assumes every trade price has
+unlimited depth.  Resting limit orders are only filled when a trade goes
+through their price, since where they'd be in the queue isn't known.
+
+Running this module backtests an algorithm file:
+    python -m pygotrader.backtest FEED_FILE ALGORITHM_FILE [--vectorized]
+        [--interval S] [--latency S] [--fee F] [--param NAME=V1,V2,...] [--workers N]
+"""
+from argparse import ArgumentParser
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import math
+import time
+import types
+
+import numpy as np
+
+from pygotrader import feed_recorder, features, pygo_order_book, shared_state
+from pygotrader.algorithm_handler import algorithm_arguments
+from pygotrader.feed import ProductState, json_loads
+from pygotrader.reloader import load_module
+from pygotrader.replay import FeedReplay
+from pygotrader.windows import RollingWindows
+
+Fill = namedtuple('Fill', ['ts_ns', 'order_id', 'side', 'price', 'size', 'fee', 'liquidity', 'strategy'])
+
+BacktestResult = namedtuple('BacktestResult', ['params', 'runs', 'fills', 'volume', 'fees', 'position', 'cash',
+                                               'equity', 'max_drawdown', 'seconds', 'elapsed'])
+BacktestResult.__doc__ = """Outcome of a backtest
+
+params: the parameters the algorithm was given
+runs: how many times it was called (event driven) or trades it saw (vectorized)
+fills: list of Fills (event driven) or the number of fills (vectorized)
+volume: total quote currency traded, fees: total fees paid
+position, cash: holdings at the end, starting from none of either
+equity: cash + position at the last trade price, i.e. the profit or loss
+max_drawdown: largest drop in equity from a previous high
+seconds: recorded time covered, elapsed: how long the backtest took
+"""
+
+
+def _parse_value(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+def parse_param(text):
+    """Turn NAME=V1,V2,... into (name, [values])"""
+    name, _, values = text.partition('=')
+    if not name or not values:
+        raise ValueError(f"Expected NAME=VALUE[,VALUE...], got {text}")
+    return name, [_parse_value(v) for v in values.split(',')]
+
+def parameter_grid(grid):
+    """Every combination of the values in {name: [values]}, as dicts"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def _max_drawdown(equity):
+    if not len(equity):
+        return 0.0
+    equity = np.asarray(equity, dtype=float)
+    return float(np.max(np.maximum.accumulate(equity) - equity))
+
+
+class SimulatedOrderHandler(object):
+    """Stands in for order_handler.OrderHandler during a backtest
+
+    Orders take effect `latency` seconds (of recorded time) after they're
+    created.  Market orders then take liquidity from the book as it is at
+    that moment, walking as many levels as they need, and pay taker_fee (a
+    fraction of the traded value).  What they take is used up: later orders
+    only get what's left of each level, until on_book_update() says the
+    recorded book has moved on (the recording never saw our orders, so
+    after that its sizes are all there is to go by).  Limit orders are post only like the live
+    ones: they're rejected if they'd cross the book, otherwise they rest until
+    a trade goes through their price and pay maker_fee when they fill.
+    Resting orders are kept in ns.my_orders like the live handler does.
+
+    The backtest calls advance() with the recorded time before every message,
+    on_book_update() after it and on_match() for every trade.
+    """
+
+    def __init__(self, book, ns, latency=0.05, taker_fee=0.005, maker_fee=0.0, depth=50):
+        self.book = book
+        self.ns = ns
+        self.latency_ns = int(latency * 1e9)
+        self.taker_fee = taker_fee
+        self.maker_fee = maker_fee
+        self.depth = depth
+        self.now_ns = 0
+        self.cash = 0.0
+        self.position = 0.0
+        self.fees = 0.0
+        self.volume = 0.0
+        self.fills = []
+        self.rejected = 0
+        self._pending = deque()   #(takes effect at, order), oldest first
+        self._resting = {}        #order id -> limit order on the book
+        self._taken = {}          #(side, price) -> size taken from that level since the book last changed
+        self._order_ids = itertools.count(1)
+
+    def _queue(self, order):
+        order['id'] = f'backtest-{next(self._order_ids)}'
+        self._pending.append((self.now_ns + self.latency_ns, order))
+        return order['id']
+
+    @staticmethod
+    def _limit_price(type, price):
+        """Only limit orders use their price; a market order's can be anything, None included"""
+        return float(price) if type == 'limit' else price
+
+    def create_buy_order(self,size,price,product_id,type='market',strategy=None):
+        return self._queue({'side': 'buy', 'type': type, 'product_id': product_id, 'size': float(size),
+                            'price': self._limit_price(type, price), 'strategy': strategy})
+
+    def create_sell_order(self,size,price,product_id,type='market',strategy=None):
+        return self._queue({'side': 'sell', 'type': type, 'product_id': product_id, 'size': float(size),
+                            'price': self._limit_price(type, price), 'strategy': strategy})
+
+    def create_cancel_order(self,order_id,strategy=None):
+        self._pending.append((self.now_ns + self.latency_ns, {'type': 'cancel', 'id': order_id}))
+
+    def advance(self, now_ns):
+        """Carry out the orders whose latency has passed by now_ns"""
+        self.now_ns = now_ns
+        pending = self._pending
+        while pending and pending[0][0] <= now_ns:
+            _, order = pending.popleft()
+            if order['type'] == 'market':
+                self._take(order)
+            elif order['type'] == 'limit':
+                self._rest(order)
+            elif order['type'] == 'cancel':
+                if self._resting.pop(order['id'], None) is not None:
+                    self._publish_orders()
+            else:
+                self.rejected += 1
+
+    def _fill(self, order, price, size, fee_rate, liquidity):
+        value = price * size
+        fee = value * fee_rate
+        signed = size if order['side'] == 'buy' else -size
+        self.position += signed
+        self.cash -= signed * price + fee
+        self.fees += fee
+        self.volume += value
+        self.fills.append(Fill(self.now_ns, order['id'], order['side'], price, size, fee, liquidity,
+                               order.get('strategy')))
+
+    def _take(self, order):
+        ask_prices, ask_sizes, bid_prices, bid_sizes = self.book.get_depth(self.depth, self.depth)
+        prices, sizes = (ask_prices, ask_sizes) if order['side'] == 'buy' else (bid_prices, bid_sizes)
+        taken = self._taken
+        remaining = order['size']
+        for price, size in zip(prices, sizes):
+            if remaining <= 0:
+                break
+            key = (order['side'], float(price))
+            size = min(float(size) - taken.get(key, 0.0), remaining)
+            if size <= 1e-12:
+                continue   #we've already taken all of this level
+            self._fill(order, key[1], size, self.taker_fee, 'taker')
+            taken[key] = taken.get(key, 0.0) + size
+            remaining -= size
+        if remaining >= order['size']:
+            self.rejected += 1   #nothing on the other side
+
+    def _rest(self, order):
+        best = self.book.get_ask() if order['side'] == 'buy' else self.book.get_bid()
+        if best is not None:
+            best = float(best)
+            if (order['side'] == 'buy' and order['price'] >= best) or (order['side'] == 'sell' and order['price'] <= best):
+                self.rejected += 1   #post only, it would have taken liquidity
+                return
+        order['remaining'] = order['size']
+        self._resting[order['id']] = order
+        self._publish_orders()
+
+    def on_book_update(self):
+        """The recorded book changed, so its levels are taken as they are again"""
+        if self._taken:
+            self._taken.clear()
+
+    def on_match(self, price, size):
+        """Fill resting orders that a trade at price went through"""
+        if not self._resting:
+            return
+        filled = False
+        for order in list(self._resting.values()):
+            if size <= 0:
+                break
+            if (order['side'] == 'buy' and price < order['price']) or (order['side'] == 'sell' and price > order['price']):
+                amount = min(order['remaining'], size)
+                self._fill(order, order['price'], amount, self.maker_fee, 'maker')
+                order['remaining'] -= amount
+                size -= amount
+                if order['remaining'] <= 1e-12:
+                    del self._resting[order['id']]
+                filled = True
+        if filled:
+            self._publish_orders()
+
+    def _publish_orders(self):
+        self.ns.my_orders = {order_id: {'id': order_id, 'product_id': order['product_id'], 'side': order['side'],
+                                        'type': 'limit', 'price': order['price'], 'size': order['remaining'],
+                                        'status': 'open', 'strategy': order.get('strategy')}
+                             for order_id, order in self._resting.items()}
+
+    def equity(self, mark_price):
+        return self.cash + self.position * mark_price
+
+
+def create_namespace():
+    return types.SimpleNamespace(highest_bid=0.00, last_match=0.00, lowest_ask=0.00, spread=0.00,
+                                 message_rate=0.0, message='', my_orders={}, feed_stats={},
+                                 buy_order_queue=[], sell_order_queue=[], cancel_order_queue=[])
+
+def run_backtest(feed, algorithm_file, params=None, interval=0.2, latency=0.05, taker_fee=0.005, maker_fee=0.0,
+                 product_id='BTC-USD', book_engine='sorted', channel='full', quote_increment=None, levels=10):
+    """Replay a recording through trading_algorithm() and a SimulatedOrderHandler"""
+    started = time.perf_counter()
+    params = dict(params or {})
+    module = load_module(algorithm_file)
+    replay = FeedReplay(feed)
+    ns = create_namespace()
+    match_buffer = shared_state.MatchRingBuffer()
+    feature_record = shared_state.SharedRecord(features.feature_names())
+    market_snapshot = shared_state.SharedMarketSnapshot(levels=levels)
+    try:
+        book = pygo_order_book.PygoOrderBook(ns, product_id=product_id, match_buffer=match_buffer,
+                                             feature_record=feature_record, market_snapshot=market_snapshot,
+                                             book_engine=book_engine,
+                                             channel=channel, quote_increment=quote_increment)
+        book._client = replay
+        clock = [0]
+        match_buffer.clock = lambda: clock[0]
+        windows = RollingWindows(match_buffer)
+        orders = SimulatedOrderHandler(book, ns, latency=latency, taker_fee=taker_fee, maker_fee=maker_fee)
+        state = ProductState(product_id, ns, None, match_buffer, feature_record, snapshot=market_snapshot)
+        available = {'ns': ns, 'order_handler': orders, 'matches': match_buffer, 'windows': windows,
+                     'features': feature_record, 'products': {product_id: state}, 'params': params,
+                     'snapshot': None, 'asks': None, 'bids': None}
+        kwargs = algorithm_arguments(module.trading_algorithm, available)
+        wants_snapshot = [name for name in ('snapshot', 'asks', 'bids') if name in kwargs]
+        interval_ns = int(interval * 1e9)
+
+        runs = 0
+        first_ns = next_run = None
+        equity = []
+        last_price = math.nan
+        for recv_ns, frame in replay.timed_frames():
+            message = json_loads(frame)
+            if message.get('product_id', product_id) != product_id:
+                continue
+            clock[0] = recv_ns
+            if first_ns is None:
+                first_ns = recv_ns
+                next_run = recv_ns + interval_ns
+            orders.advance(recv_ns)
+            book.apply_message(message)
+            orders.on_book_update()
+            if message.get('type') in ('match', 'last_match') and not book.resyncing:
+                last_price = float(message['price'])
+                orders.on_match(last_price, float(message['size']))
+            if recv_ns < next_run or book.resyncing:
+                continue
+            next_run = recv_ns + interval_ns
+            book.publish_state(force=True)
+            if wants_snapshot:
+                snapshot = market_snapshot.read(match_buffer)
+                kwargs.update((name, getattr(snapshot, name) if name != 'snapshot' else snapshot)
+                              for name in wants_snapshot)
+            windows.update()
+            module.trading_algorithm(**kwargs)
+            runs += 1
+            if not math.isnan(last_price):
+                equity.append(orders.equity(last_price))
+        final = orders.equity(last_price) if not math.isnan(last_price) else orders.cash
+        equity.append(final)
+        return BacktestResult(params, runs, orders.fills, orders.volume, orders.fees, orders.position, orders.cash,
+                              final, _max_drawdown(equity), (clock[0] - (first_ns or clock[0])) / 1e9,
+                              time.perf_counter() - started)
+    finally:
+        for shared in (match_buffer, feature_record, market_snapshot):
+            shared.close()
+            shared.unlink()
+
+def load_matches(feed, product_id='BTC-USD'):
+    """Every trade in a recording, as a shared_state.MatchColumns of arrays
+
+    Only frames that mention a match are decoded at all.
+    """
+    columns = ([], [], [], [], [])
+    for record in feed_recorder.read_feed(feed):
+        if record.kind != feed_recorder.FRAME or b'match' not in record.payload:
+            continue
+        message = json_loads(record.payload)
+        if message.get('type') not in ('match', 'last_match') or message.get('product_id', product_id) != product_id:
+            continue
+        columns[0].append(message.get('sequence', 0))
+        columns[1].append(pygo_order_book.parse_timestamp_ns(message['time']))
+        columns[2].append(float(message['price']))
+        columns[3].append(float(message['size']))
+        columns[4].append(shared_state.BUY if message['side'] == 'buy' else shared_state.SELL)
+    dtypes = (np.int64, np.int64, np.float64, np.float64, np.int8)
+    return shared_state.MatchColumns(*(np.array(column, dtype=dtype) for column, dtype in zip(columns, dtypes)))
+
+def run_vectorized(matches, algorithm_file, params=None, latency=0.05, fee=0.005):
+    """Run vectorized_algorithm() over all of matches at once
+
+    The position it asks for after trade i is traded at the price of the
+    first trade at least `latency` seconds later (never at trade i itself),
+    paying fee on the traded value.  Changes that would only take effect
+    after the last trade are never filled.
+    """
+    started = time.perf_counter()
+    params = dict(params or {})
+    if isinstance(algorithm_file, types.ModuleType):
+        module = algorithm_file
+    else:
+        module = load_module(algorithm_file)
+    count = len(matches.price)
+    if not count:
+        return BacktestResult(params, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, time.perf_counter() - started)
+    target = np.asarray(module.vectorized_algorithm(matches, **params), dtype=float)
+    if target.shape != (count,):
+        raise ValueError(f"vectorized_algorithm returned {target.shape} positions for {count} trades")
+    trades = np.diff(np.nan_to_num(target), prepend=0.0)
+    executed_at = np.searchsorted(matches.ts_ns, matches.ts_ns + int(latency * 1e9), side='left')
+    executed_at = np.maximum(executed_at, np.arange(count) + 1)
+    filled = (trades != 0) & (executed_at < count)
+    executed_at = executed_at[filled]
+    trades = trades[filled]
+    prices = matches.price[executed_at]
+    values = np.abs(trades) * prices
+    fees = values * fee
+    bought = np.bincount(executed_at, weights=trades, minlength=count)
+    spent = np.bincount(executed_at, weights=trades * prices + fees, minlength=count)
+    position = np.cumsum(bought)
+    cash = -np.cumsum(spent)
+    equity = cash + position * matches.price
+    return BacktestResult(params, count, int(filled.sum()), float(values.sum()), float(fees.sum()),
+                          float(position[-1]), float(cash[-1]), float(equity[-1]), _max_drawdown(equity),
+                          (int(matches.ts_ns[-1]) - int(matches.ts_ns[0])) / 1e9, time.perf_counter() - started)
+
+
+_worker_matches = None
+
+def _load_worker_matches(feed, product_id):
+    global _worker_matches
+    _worker_matches = load_matches(feed, product_id)
+
+def _run_vectorized_in_worker(args):
+    algorithm_file, params, options = args
+    return run_vectorized(_worker_matches, algorithm_file, params, **options)
+
+def _run_backtest_in_worker(args):
+    feed, algorithm_file, params, options = args
+    result = run_backtest(feed, algorithm_file, params, **options)
+    return result._replace(fills=len(result.fills))
+
+def sweep(feed, algorithm_file, grid, vectorized=False, workers=None, product_id='BTC-USD', **options):
+    """Backtest every combination of grid ({name: [values]}) on a process pool
+
+    Returns the BacktestResults, best equity first.  With vectorized set,
+    every worker decodes the recording's trades once and reuses them;
+    otherwise each combination replays the recording.  fills is the number
+    of fills rather than the list, to keep what comes back from the workers
+    small.
+    """
+    combinations = parameter_grid(grid)
+    if vectorized:
+        with ProcessPoolExecutor(workers, initializer=_load_worker_matches, initargs=(feed, product_id)) as pool:
+            results = list(pool.map(_run_vectorized_in_worker,
+                                    [(algorithm_file, params, options) for params in combinations]))
+    else:
+        options = dict(options, product_id=product_id)
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_run_backtest_in_worker,
+                                    [(feed, algorithm_file, params, options) for params in combinations]))
+    return sorted(results, key=lambda result: result.equity, reverse=True)
+
+
+def main():
+    parser = ArgumentParser(description="Backtest an algorithm file against a recorded feed")
+    parser.add_argument("feed", help="Recording made with --record")
+    parser.add_argument("algorithm_file")
+    parser.add_argument("--product", default='BTC-USD')
+    parser.add_argument("--vectorized", action='store_true',
+        help="Call vectorized_algorithm() on every trade at once instead of replaying the book into trading_algorithm()")
+    parser.add_argument("--interval", type=float, default=0.2,
+        help="Seconds of recorded time between calls to trading_algorithm(). Default is 0.2")
+    parser.add_argument("--latency", type=float, default=0.05,
+        help="Seconds between creating an order and it reaching the book. Default is 0.05")
+    parser.add_argument("--fee", type=float, default=0.005, help="Taker fee, as a fraction of the traded value. Default is 0.005")
+    parser.add_argument("--maker_fee", type=float, default=0.0, help="Maker fee. Default is 0")
+    parser.add_argument("--book_engine", choices=['sorted', 'tick'], default='sorted')
+    parser.add_argument("--feed_channel", choices=['full', 'level2'], default='full',
+        help="Channel the recording was made with. Default is full")
+    parser.add_argument("--quote_increment", default=None)
+    parser.add_argument("--param", action='append', default=[], metavar="NAME=V1,V2,...",
+        help="Parameter to pass the algorithm.  Give several values (or several parameters) to sweep over them")
+    parser.add_argument("--workers", type=int, default=None, help="Processes to sweep with. Default is one per core")
+    args = parser.parse_args()
+
+    try:
+        grid = dict(parse_param(p) for p in args.param)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.vectorized:
+        options = {'latency': args.latency, 'fee': args.fee}
+    else:
+        options = {'interval': args.interval, 'latency': args.latency, 'taker_fee': args.fee,
+                   'maker_fee': args.maker_fee, 'book_engine': args.book_engine, 'channel': args.feed_channel,
+                   'quote_increment': args.quote_increment}
+
+    start = time.perf_counter()
+    if len(parameter_grid(grid)) > 1:
+        results = sweep(args.feed, args.algorithm_file, grid, vectorized=args.vectorized, workers=args.workers,
+                        product_id=args.product, **options)
+    elif args.vectorized:
+        params = parameter_grid(grid)[0]
+        results = [run_vectorized(load_matches(args.feed, args.product), args.algorithm_file, params, **options)]
+    else:
+        params = parameter_grid(grid)[0]
+        result = run_backtest(args.feed, args.algorithm_file, params, product_id=args.product, **options)
+        results = [result._replace(fills=len(result.fills))]
+    elapsed = time.perf_counter() - start
+
+    print(f"{'params':<32}{'runs':>10}{'fills':>8}{'volume':>14}{'fees':>10}{'position':>12}{'equity':>12}{'drawdown':>10}")
+    for result in results:
+        params = ' '.join(f'{k}={v}' for k, v in result.params.items()) or '-'
+        print(f"{params:<32}{result.runs:>10}{result.fills:>8}{result.volume:>14.2f}{result.fees:>10.2f}"
+              f"{result.position:>12.6f}{result.equity:>12.2f}{result.max_drawdown:>10.2f}")
+    covered = results[0].seconds if results else 0.0
+    print(f"{len(results)} backtest(s) of {covered / 3600:.2f} recorded hours in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ import json, os, signal, time, traceback,shutil
 import curses
 import cbpro
 import multiprocessing
-from pygotrader import arguments,config, order_handler, pygo_order_book, tui, algorithm_handler
+from pygotrader import arguments,config, order_handler, pygo_order_book, tui, algorithm_handler, feed, feed_recorder, replay, colocated, order_gateway
 from pkg_resources import Requirement, resource_filename
 
 #from profiling.tracing import TracingProfiler
@@ -30,6 +30,14 @@ def create_namespace(my_manager):
     helper class, not one to do serious work with.  Operations can be expensive.
     And custom classes can't be used.
     
+    The ask/bid depth shown by the TUI and the history of trade matches are 
+    not kept here.  They are published into a shared_state.SharedDepthLadder
+    and a shared_state.MatchRingBuffer instead, see main().
+    
+    This namespace also holds the scalar values (last_match, highest_bid...) 
+    of the first product.  Every other product gets a namespace of its own, 
+    see feed.create_product_state.
+    
     Order format for placement into the buy and sell order queue lists:
     {'order':'buy','type':'market','product':'BTC','size':0.1,'price':1.00}
     
@@ -37,7 +45,6 @@ def create_namespace(my_manager):
     {'order':'cancel','order_id':1111111}    
     """
     ns = my_manager.Namespace()
-    ns.exchange_order_matches = my_manager.list()
     ns.buy_order_queue = my_manager.list()
     ns.sell_order_queue = my_manager.list()
     ns.cancel_order_queue = my_manager.list()
@@ -45,12 +52,10 @@ def create_namespace(my_manager):
     ns.last_match = 0.00
     ns.highest_bid = 0.00
     ns.lowest_ask = 0.00
+    ns.spread = 0.00
+    ns.message_rate = 0.0
     ns.message = ''
-    ns.ui_asks = my_manager.list()
-    ns.ui_bids = my_manager.list()
-    for x in range(0,10):
-        ns.ui_asks.insert(x,{'price':0.00,'depth':0.00})  
-        ns.ui_bids.insert(x,{'price':0.00,'depth':0.00})       
+    ns.feed_stats = {}
     return ns
 
 
@@ -69,8 +74,10 @@ def main():
     Objects of note:
     MyConfig - loads and stores arguments passed in as well as user config 
     information stored in outside files
-    PygoOrderBook - the order book that uses a websocket to pull data from the
-    exchange.  Does not actually place orders.
+    PygoOrderBook - an order book, one per product.  Does not actually place 
+    orders.
+    MultiProductFeed - the one websocket connection that pulls data from the
+    exchange for every product and feeds it to the order books.
     AuthenticatedClient - this has the secrets for the user loaded from the 
     external config files.  This is the class that actually places orders that 
     organized and called by the OrderHandler class.  
@@ -98,9 +105,15 @@ def main():
         and then copy it over to the shared namespace.
     2) Namespaces don't work with deep data structures, i.e. a custom class
         You can do a dict inside a list, or vice-versa, but that's about it
+    Data that changes several times a second (like the ask/bid depth) lives 
+    in shared memory instead, see the shared_state module.
     """
     my_manager = multiprocessing.Manager()
     ns = create_namespace(my_manager)
+    product_states = {}
+    recorder = None
+    replay_server = None
+    colocated_strategy = None
     view_mode = True
     
     try:
@@ -116,38 +129,87 @@ def main():
             view_mode = False
 
 
+        if args.record and args.feed_workers:
+            argument_parser.error("--record can't be combined with --feed_workers")
+        if args.colocated_algorithm and args.feed_workers:
+            argument_parser.error("--colocated_algorithm can't be combined with --feed_workers")
+        if args.colocated_algorithm and not args.config:
+            argument_parser.error("--colocated_algorithm needs --config to place orders")
+
         my_config = config.MyConfig(exchange=args.exchange,product=args.product)
+        for product_id in my_config.products:
+            if not product_states:
+                product_states[product_id] = feed.create_product_state(product_id, ns=ns, depth=args.depth)
+            else:
+                product_states[product_id] = feed.create_product_state(product_id, manager=my_manager, depth=args.depth,
+                                                                       shared_ns=ns)
 
         if not view_mode:
             my_config.load_config(args.config)
             my_authenticated_client = my_config.get_coinbase_authenticated_client()
             
-            if not os.path.exists(args.algorithm_file):
+            if not os.path.exists(args.algorithm_file[0].algorithm_file):
                 filename = resource_filename(Requirement.parse("pygotrader"),"pygotrader/algorithm.py")
                 print(f"Copying sample algorithm file to ./algorithm.py...")
                 shutil.copyfile(filename,"./algorithm.py")
                 time.sleep(2)       
                 
-            my_order_handler = order_handler.OrderHandler(my_authenticated_client,ns)
-            my_order_handler.start()                
+            if args.order_gateway:
+                my_order_handler = order_gateway.OrderGateway(my_authenticated_client, ns,
+                                                              max_in_flight=args.order_max_in_flight)
+            else:
+                my_order_handler = order_handler.OrderHandler(my_authenticated_client,ns,
+                                                              max_workers=args.order_max_in_flight)
         else:
             my_authenticated_client = None
             my_order_handler = None
             ns.message = 'Running in view mode'
 
-        my_order_book = pygo_order_book.PygoOrderBook(ns,product_id=my_config.product, url=my_config.websocket_url)
-        my_order_book.start()
+        websocket_url = my_config.websocket_url
+        api_url = my_config.api_url
+        if args.replay:
+            replay_server = replay.ReplayServer(args.replay, speed=args.replay_speed, hold_open=True).start()
+            websocket_url = replay_server.url
+            api_url = replay_server.api_url
+        if args.record:
+            recorder = feed_recorder.FeedRecorder(args.record)
+
+        books = {}
+        for product_id, state in product_states.items():
+            books[product_id] = pygo_order_book.PygoOrderBook(state.ns, product_id=product_id, url=websocket_url,
+                                                              api_url=api_url, recorder=recorder,
+                                                              depth_ladder=state.depth_ladder, match_buffer=state.match_buffer,
+                                                              feature_record=state.features, update_signal=state.updates,
+                                                              market_snapshot=state.snapshot,
+                                                              book_engine=args.book_engine, channel=args.feed,
+                                                              order_id_channel=my_order_handler.add_order_id_listener() if my_order_handler else None)
+        if args.colocated_algorithm:
+            colocated_strategy = colocated.ColocatedStrategy(args.colocated_algorithm,
+                                                             order_handler.AsyncOrderClient(my_authenticated_client),
+                                                             ns=ns, budget=args.colocated_budget)
+            colocated_strategy.attach(books)
+            colocated_strategy.start()
+        if my_order_handler is not None:
+            #after the books have their channels, so the handler's process has the other ends
+            my_order_handler.start()
+        my_feed = feed.MultiProductFeed(books, url=websocket_url, workers=args.feed_workers, ns=ns, recorder=recorder,
+                                        channels=pygo_order_book.CHANNELS[args.feed])
+        my_feed.start()
         
 
-        while not my_order_book.has_started:
+        while not my_feed.has_started:
             time.sleep(0.1)
 
-        mytui = tui.Menu(ns, my_order_book, my_authenticated_client, my_order_handler, algorithm_file=args.algorithm_file)
+        mytui = tui.Menu(ns, my_feed, my_authenticated_client, my_order_handler, algorithm_file=args.algorithm_file[0].algorithm_file,
+                         products=list(product_states.values()), strategies=args.algorithm_file,
+                         algorithm_options={'schedule': args.algorithm_schedule, 'debounce': args.algorithm_debounce,
+                                            'max_rate': args.algorithm_max_rate, 'tick_budget': args.algorithm_tick_budget,
+                                            'profile_dir': args.algorithm_profile, 'profile_every': args.algorithm_profile_every})
         curses.wrapper(mytui.start)
 
         
     except CustomExit:
-        my_order_book.close()
+        my_feed.close()
         if not view_mode:
             my_order_handler.close()
         # profiler.stop()
@@ -155,6 +217,16 @@ def main():
         
     except Exception as e:
         print(traceback.format_exc())
+
+    finally:
+        if colocated_strategy is not None:
+            colocated_strategy.close()
+        if recorder is not None:
+            recorder.close()
+        if replay_server is not None:
+            replay_server.close()
+        for state in product_states.values():
+            feed.close_product_state(state)
         
         
         
@@ -0,0 +1,246 @@
+"""
+Running a strategy on the feed's own event loop
+
+An algorithm run by an AlgorithmHandler sees the market from another process
+(through shared memory and the namespace), and its orders go through yet
+another one, the OrderHandler, which adds milliseconds between a message
+arriving and an order going out.  A colocated strategy skips both hops: it's
+an `async def trading_algorithm()` that the order book calls right after it
+applies each batch of messages, on the same event loop, with the live book,
+and it places orders with an order_handler.AsyncOrderClient from that loop.
+
+A call starts inline: everything up to the strategy's first await that
+actually waits (usually an order going out) runs before the book moves on to
+the next batch.  The rest continues as a task on the loop, so waiting for the
+exchange doesn't hold up the feed.  While a call is still in flight, new
+updates are skipped and counted as coalesced rather than queued up.
+
+Since everything shares one loop, a strategy that computes for too long
+delays the feed itself.  The guard times every step the strategy runs on the
+loop: a call whose steps add up to more than `budget` seconds is an overrun,
+and is cancelled if it's still in flight.  After max_overruns overruns in a
+row, or an error, the strategy is benched for `cooldown` seconds (or until a
+new version is saved) and the book carries on without it.  A step can't be
+interrupted while it runs, so the budget bounds how long a call gets to keep
+going, not how long one step takes.
+
+trading_algorithm() can take any of these (only the ones it lists are passed):
+book: the PygoOrderBook that was just updated
+messages: the batch of decoded messages that was applied to it
+orders: the AsyncOrderClient, e.g. await orders.buy(0.01, None, 'BTC-USD')
+books: every book the strategy is attached to, by product id
+product_id: the product of book
+ns: the shared namespace
+
+The algorithm file is reloaded when it's saved, like an AlgorithmHandler's
+(see reloader.py).  Stats are published to ns.colocated_stats once a second.
+
+Important classes:
+ColocatedStrategy: attach() it to the books, then start() and close() it
+"""
+import asyncio
+import inspect
+import time
+import traceback
+import types
+
+from pygotrader.metrics import ColocatedStats
+from pygotrader.reloader import AlgorithmReloader
+
+
+class ColocatedStrategy(object):
+    """An async trading_algorithm() called by the order books it's attached to
+
+    Important methods:
+    attach: hook the strategy into some books (product_id -> PygoOrderBook)
+    start, close: load the algorithm file and watch it for changes
+    on_update: called by a book after every batch, from the feed's event loop
+    """
+
+    def __init__(self, algorithm_file, order_client, ns=None, budget=0.001, max_overruns=3, cooldown=30.0,
+        name='colocated'):
+        self.algorithm_file = algorithm_file
+        self.order_client = order_client
+        self.ns = ns
+        self.budget = budget
+        self.max_overruns = max_overruns
+        self.cooldown = cooldown
+        self.name = name
+        self.error_file = f'algorithm_error_{name}.txt'
+        self.stats = ColocatedStats(budget=budget)
+        self.stats_interval = 1.0
+        self.books = {}
+        self.function = None
+        self.kwargs = {}
+        self.reloader = None
+        self.algorithm_reload_time = 1   #how often to check the file where inotify isn't available
+        self._task = None
+        self._run_time = 0.0
+        self._overruns_in_a_row = 0
+        self._benched_until = 0.0
+        self._last_stats_publish = 0.0
+
+    def attach(self, books):
+        for product_id, book in books.items():
+            book.strategy = self
+            self.books[product_id] = book
+        self.order_client.books.update(books)
+
+    def start(self):
+        available = {'book': None, 'messages': None, 'orders': self.order_client, 'books': self.books,
+                     'product_id': None, 'ns': self.ns}
+        self.reloader = AlgorithmReloader(self.algorithm_file, available, poll_interval=self.algorithm_reload_time)
+        self.swap_algorithm(self.reloader.load())
+        self.reloader.start()
+        return self
+
+    def close(self):
+        if self.reloader is not None:
+            self.reloader.close()
+            self.reloader = None
+        self.order_client.close()
+
+    def _message(self, text):
+        if self.ns is not None:
+            self.ns.message = text
+
+    def swap_algorithm(self, loaded):
+        """Switch to a newly loaded version, unless it failed to load or isn't async"""
+        error = loaded.error
+        if error is None and not inspect.iscoroutinefunction(loaded.module.trading_algorithm):
+            error = f"{self.algorithm_file}: a colocated trading_algorithm() has to be an async def\n"
+        if error is not None:
+            self._message(f"Error loading {self.algorithm_file}.  Please see {self.error_file} for more details.")
+            self.write_error(error)
+            return False
+        self.function = loaded.module.trading_algorithm
+        self.kwargs = loaded.kwargs
+        self._benched_until = 0.0
+        self._overruns_in_a_row = 0
+        return True
+
+    def write_error(self, text):
+        with open(self.error_file, "w") as f:
+            f.write(text)
+
+    def on_update(self, book, messages):
+        """Start a call for a book that just applied messages
+
+        The rest of the call is scheduled on the running event loop.  Without
+        one the update is skipped, so the book's update never fails for it.
+        """
+        if self.reloader is not None:
+            loaded = self.reloader.take()
+            if loaded is not None:
+                self.swap_algorithm(loaded)
+        if self.function is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            #updated outside an event loop, e.g. a synchronous replay: nowhere to run
+            self.stats.skipped += 1
+            return
+        if self._task is not None:
+            self.stats.coalesced += 1
+            return
+        if self._benched_until:
+            if time.monotonic() < self._benched_until:
+                self.stats.skipped += 1
+                return
+            self._benched_until = 0.0
+
+        kwargs = self.kwargs
+        for name, value in (('book', book), ('messages', messages), ('product_id', book.product_id)):
+            if name in kwargs:
+                kwargs[name] = value
+        self._run_time = 0.0
+        self.stats.runs.mark()
+        coroutine = self.function(**kwargs)
+        try:
+            awaiting = self._step(coroutine.send, None)
+        except StopIteration:
+            self._finish()
+        except Exception:
+            self._finish(traceback.format_exc())
+        else:
+            if self._over_budget():
+                coroutine.close()
+                self.stats.cancelled += 1
+                self._finish()
+            else:
+                self._task = loop.create_task(self._resume(coroutine, awaiting))
+        self.publish_stats()
+
+    def _step(self, send, value):
+        """Run the strategy until it next waits, adding the time to this call's total"""
+        start = time.perf_counter()
+        try:
+            return send(value)
+        finally:
+            self._run_time += time.perf_counter() - start
+
+    def _over_budget(self):
+        return self.budget and self._run_time > self.budget
+
+    @types.coroutine
+    def _drive(self, coroutine, awaiting):
+        """Hand what the strategy waits on to the task, and time each step after it"""
+        while True:
+            try:
+                value = yield awaiting
+            except BaseException as e:
+                send, value = coroutine.throw, e
+            else:
+                send = coroutine.send
+            try:
+                awaiting = self._step(send, value)
+            except StopIteration as e:
+                return e.value
+            if self._over_budget():
+                coroutine.close()
+                self.stats.cancelled += 1
+                return None
+
+    async def _resume(self, coroutine, awaiting):
+        error = None
+        try:
+            await self._drive(coroutine, awaiting)
+        except asyncio.CancelledError:
+            pass   #the loop is shutting down
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            self._finish(error)
+
+    def _finish(self, error=None):
+        self._task = None
+        self.stats.loop_time.record(self._run_time)
+        if error is not None:
+            self.stats.errors += 1
+            self.write_error(error)
+            self._bench(f"Error in {self.algorithm_file}, see {self.error_file}")
+        elif self._over_budget():
+            self.stats.overruns += 1
+            self._overruns_in_a_row += 1
+            if self._overruns_in_a_row >= self.max_overruns:
+                self._bench(f"{self.algorithm_file} took {self._run_time * 1000:.2f} ms of the feed's loop, "
+                            f"over its {self.budget * 1000:.2f} ms budget {self._overruns_in_a_row} times in a row")
+        else:
+            self._overruns_in_a_row = 0
+
+    def _bench(self, text):
+        self._benched_until = time.monotonic() + self.cooldown
+        self._overruns_in_a_row = 0
+        self.stats.suspensions += 1
+        self._message(f"{text}.  Paused for {self.cooldown:g} seconds")
+
+    def publish_stats(self):
+        now = time.monotonic()
+        if self.ns is not None and now - self._last_stats_publish >= self.stats_interval:
+            stats = self.stats.snapshot()
+            stats['orders'] = self.order_client.snapshot()
+            if self.reloader is not None:
+                stats['reload'] = self.reloader.stats.snapshot()
+            self.ns.colocated_stats = stats
+            self._last_stats_publish = now
@@ -21,7 +21,7 @@ class MyConfig(object):
     def __init__(self,exchange='coinbase',product='BTC-USD',api_url='https://api.pro.coinbase.com',
         websocket_url='wss://ws-feed.pro.coinbase.com'):
         self._exchange = exchange
-        self._product = product
+        self._products = product if isinstance(product, list) else [product]
         self._key = ''
         self._b64secret = ''
         self._passphrase = ''
@@ -34,7 +34,16 @@ class MyConfig(object):
         
     @property
     def product(self):
-        return self._product
+        """The first (main) product"""
+        return self._products[0]
+
+    @property
+    def products(self):
+        return self._products
+
+    @property
+    def api_url(self):
+        return self._api_url
 
     @property
     def websocket_url(self):
@@ -0,0 +1,168 @@
+"""
+Market microstructure features, computed incrementally by the feed
+
+Algorithms tend to want the same handful of numbers on every tick.  Rather
+than each one rebuilding them from the depth ladder and the match buffer,
+the order book feeds a FeatureEngine as it applies messages and publishes
+the latest feature vector to a shared_state.SharedRecord, which algorithms
+get as their "features" argument:
+
+bid, ask, bid_size, ask_size: top of the book
+spread, mid: ask - bid and (ask + bid) / 2
+microprice: mid weighted by the size on the other side,
+    (bid * ask_size + ask * bid_size) / (bid_size + ask_size)
+imbalance: (bid size - ask size) / (bid size + ask size) over the top
+    `levels` levels, between -1 (all asks) and 1 (all bids)
+ofi: order flow imbalance (Cont, Kukanov & Stoikov) summed since the start,
+    and ofi_<N>s over the last N seconds.  Positive means buying pressure
+vwap_<N>s, volume_<N>s: volume weighted trade price and traded size over
+    the last N seconds
+last_price: price of the last trade
+timestamp: exchange time of the last update, in epoch seconds
+
+Each message costs O(1): top of book updates only do work when the best
+price or size actually changed, and the windows are running sums over a
+deque of events, so expiring old events is amortized O(1) too.  Only the
+top-N imbalance walks the book, once per publish.  Anything that isn't
+known yet (e.g. the VWAP of a window without trades) is NaN.
+
+Important classes/functions:
+FeatureEngine: keeps the features up to date
+feature_names: the fields of the vector for a given set of windows
+"""
+from collections import deque
+
+DEFAULT_WINDOWS = (10, 60, 300)   #seconds
+
+_NAN = float('nan')
+
+
+def feature_names(windows=DEFAULT_WINDOWS):
+    names = ['bid', 'ask', 'bid_size', 'ask_size', 'spread', 'mid', 'microprice', 'imbalance', 'ofi']
+    names += [f'ofi_{w}s' for w in windows]
+    for w in windows:
+        names += [f'vwap_{w}s', f'volume_{w}s']
+    names += ['last_price', 'timestamp']
+    return tuple(names)
+
+
+class _WindowSum(object):
+    """Running sums of events from the last `seconds` seconds of exchange time"""
+
+    def __init__(self, seconds, width):
+        self.span_ns = int(seconds * 1e9)
+        self.events = deque()
+        self.sums = [0.0] * width
+
+    def add(self, ts_ns, values):
+        self.events.append((ts_ns, values))
+        sums = self.sums
+        for i, value in enumerate(values):
+            sums[i] += value
+        if self.events[0][0] <= ts_ns - self.span_ns:
+            self.expire(ts_ns)
+
+    def expire(self, now_ns):
+        cutoff = now_ns - self.span_ns
+        events = self.events
+        sums = self.sums
+        while events and events[0][0] <= cutoff:
+            _, values = events.popleft()
+            for i, value in enumerate(values):
+                sums[i] -= value
+        if not events:
+            #don't let rounding errors pile up over a long run
+            self.sums = [0.0] * len(sums)
+
+
+class FeatureEngine(object):
+    """Incrementally updated features of one product's book and trades
+
+    Important methods:
+    on_top_of_book: called after every book update with the new best levels
+    on_trade: called for every match
+    values: the feature vector, in the order of `fields`
+    """
+
+    def __init__(self, levels=5, windows=DEFAULT_WINDOWS):
+        self.levels = levels
+        self.windows = tuple(windows)
+        self.fields = feature_names(self.windows)
+        self._ofi_windows = [_WindowSum(w, 1) for w in self.windows]
+        self._trade_windows = [_WindowSum(w, 2) for w in self.windows]
+        self.ofi = 0.0
+        self.last_price = _NAN
+        self.ts_ns = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the top of the book, e.g. after it was rebuilt from a snapshot,
+        so the jump isn't counted as order flow"""
+        self.top = (None, None, None, None)
+        self.changed = True
+
+    def _stamp(self, ts_ns):
+        if ts_ns > self.ts_ns:
+            self.ts_ns = ts_ns
+
+    def on_top_of_book(self, ts_ns, bid, bid_size, ask, ask_size):
+        self.changed = True   #deeper levels may have changed the imbalance
+        top = (bid, bid_size, ask, ask_size)
+        previous = self.top
+        if top == previous:
+            return
+        self.top = top
+        self._stamp(ts_ns)
+        last_bid, last_bid_size, last_ask, last_ask_size = previous
+        if None in top or None in previous:
+            return
+        flow = 0.0
+        if bid >= last_bid:
+            flow += bid_size
+        if bid <= last_bid:
+            flow -= last_bid_size
+        if ask <= last_ask:
+            flow -= ask_size
+        if ask >= last_ask:
+            flow += last_ask_size
+        if flow:
+            self.ofi += flow
+            event = (flow,)
+            for window in self._ofi_windows:
+                window.add(ts_ns, event)
+
+    def on_trade(self, ts_ns, price, size):
+        self.last_price = price
+        self.changed = True
+        self._stamp(ts_ns)
+        event = (price * size, size)
+        for window in self._trade_windows:
+            window.add(ts_ns, event)
+
+    def values(self, ask_sizes=(), bid_sizes=()):
+        """Return the feature vector as a list of floats
+
+        ask_sizes and bid_sizes are the sizes of the top levels, best first,
+        for the imbalance.
+        """
+        bid, bid_size, ask, ask_size = (_NAN if v is None else v for v in self.top)
+        spread = ask - bid
+        mid = (ask + bid) / 2
+        depth = bid_size + ask_size
+        microprice = (bid * ask_size + ask * bid_size) / depth if depth > 0 else _NAN
+        bids = sum(float(s) for s in bid_sizes[:self.levels])
+        asks = sum(float(s) for s in ask_sizes[:self.levels])
+        imbalance = (bids - asks) / (bids + asks) if bids + asks > 0 else _NAN
+
+        now_ns = self.ts_ns
+        result = [bid, ask, bid_size, ask_size, spread, mid, microprice, imbalance, self.ofi]
+        for window in self._ofi_windows:
+            window.expire(now_ns)
+            result.append(window.sums[0])
+        for window in self._trade_windows:
+            window.expire(now_ns)
+            notional, volume = window.sums
+            result += [notional / volume if volume > 0 else _NAN, volume]
+        result += [self.last_price, now_ns / 1e9 if now_ns else _NAN]
+        self.changed = False
+        return result
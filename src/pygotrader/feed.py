@@ -0,0 +1,323 @@
+"""
+The websocket connection to the exchange's feed
+
+receive_batches is the receive loop: a reader task queues raw frames as
+they arrive and the loop hands everything that has piled up to a callback
+as one batch.  A PygoOrderBook uses it for its own connection, and a
+MultiProductFeed uses it to serve several books from one connection.
+
+MultiProductFeed subscribes to several products on one websocket and routes
+each message to the book for its product.  Every product has its own
+ProductState: a namespace for its scalar values plus its own depth ladder,
+match ring buffer, feature record and market snapshot in shared memory,
+and an update signal that wakes event-scheduled algorithms.  With workers=0 the books are
+updated right on the receive loop.  With workers=N they're split across N
+worker processes, and the receive loop only finds each frame's product and
+forwards the raw frames in one batch per worker, so CPU use grows with
+the message rate and not with the number of products.
+
+Important classes/functions:
+receive_batches: connect, subscribe and hand over batches of raw frames
+MultiProductFeed: one connection, one book per product, optional workers
+ProductState: the shared state the TUI and algorithms read for a product
+create_product_state: builds a ProductState
+"""
+from collections import namedtuple
+from threading import Thread
+import asyncio
+import json
+import multiprocessing
+import time
+import types
+import websockets
+from pygotrader import features, shared_state
+from pygotrader.metrics import FeedStats
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from simdjson import loads as json_loads
+    except ImportError:
+        json_loads = json.loads
+
+
+ProductState = namedtuple('ProductState', ['product_id', 'ns', 'depth_ladder', 'match_buffer', 'features',
+                                           'updates', 'snapshot'], defaults=(None, None, None))
+
+
+def create_product_state(product_id, ns=None, manager=None, depth=10, shared_ns=None):
+    """Create the shared state for one product
+
+    Pass an existing namespace as ns (the main one for the first product),
+    or a Manager to create a new one.  The new namespace shares my_orders
+    with shared_ns so every book updates the same order list.
+    """
+    if ns is None:
+        ns = manager.Namespace() if manager is not None else types.SimpleNamespace()
+        ns.last_match = 0.00
+        ns.highest_bid = 0.00
+        ns.lowest_ask = 0.00
+        ns.spread = 0.00
+        ns.message_rate = 0.0
+        ns.feed_stats = {}
+        ns.my_orders = shared_ns.my_orders if shared_ns is not None else {}
+    return ProductState(product_id, ns, shared_state.SharedDepthLadder(levels=depth),
+                        shared_state.MatchRingBuffer(), shared_state.SharedRecord(features.feature_names()), shared_state.UpdateSignal(),
+                        shared_state.SharedMarketSnapshot(levels=depth))
+
+def close_product_state(state):
+    for shared in (state.depth_ladder, state.match_buffer, state.features, state.snapshot):
+        if shared is None:
+            continue
+        shared.close()
+        shared.unlink()
+
+
+async def _read_frames(websocket, frames, recorder):
+    try:
+        async for data in websocket:
+            if recorder is not None:
+                recorder.record_frame(data)
+            frames.put_nowait(data)
+    except Exception as e:
+        frames.put_nowait(e)
+    else:
+        frames.put_nowait(websockets.exceptions.ConnectionClosedOK(None, None))
+
+async def receive_batches(url, sub_params, shutdown_event, on_batch, on_idle=None, idle_timeout=0.5,
+    max_batch=1000, recorder=None):
+    """Connect to url, subscribe and pass batches of raw frames to on_batch
+
+    Each batch is everything that was already queued when the loop got to it,
+    up to max_batch frames.  If the connection fails or closes, the exception
+    is passed as the last item of a batch.  Runs until shutdown_event is set
+    or on_batch returns False.  on_idle is called when nothing has arrived
+    for idle_timeout seconds.
+    """
+    async with websockets.connect(url) as websocket:
+        await websocket.send(json.dumps(sub_params))
+        frames = asyncio.Queue()
+        reader = asyncio.ensure_future(_read_frames(websocket, frames, recorder))
+        try:
+            while not shutdown_event.is_set():
+                try:
+                    data = await asyncio.wait_for(frames.get(), timeout=idle_timeout)
+                except asyncio.TimeoutError:
+                    if on_idle is not None:
+                        on_idle()
+                    continue
+                batch = [data]
+                while len(batch) < max_batch and not frames.empty():
+                    batch.append(frames.get_nowait())
+                if on_batch(batch) is False:
+                    break
+        finally:
+            reader.cancel()
+
+
+def product_of(frame):
+    """Product id of a raw frame, found without decoding it.  None if it has none"""
+    if isinstance(frame, bytes):
+        frame = frame.decode()
+    key = frame.find('"product_id"')
+    if key < 0:
+        return None
+    start = frame.find('"', frame.find(':', key + 12)) + 1
+    return frame[start:frame.find('"', start)]
+
+def apply_frames(books, frames, on_error=None):
+    """Decode frames and apply them to books (product_id -> PygoOrderBook)
+
+    Each book gets its messages as one batch.  Returns the number of frames
+    that couldn't be decoded or didn't belong to any of the books.
+    """
+    batches = {}
+    dropped = 0
+    for frame in frames:
+        try:
+            message = json_loads(frame)
+        except ValueError as e:
+            dropped += 1
+            if on_error is not None:
+                on_error(e, frame)
+            continue
+        book = books.get(message.get('product_id'))
+        if book is None:
+            dropped += 1
+            continue
+        batches.setdefault(book, []).append(message)
+    for book, messages in batches.items():
+        book.stats.record_batch(len(messages))
+        try:
+            book.on_messages(messages)
+        except Exception as e:
+            book.on_error(e)
+    return dropped
+
+def _worker_main(books, conn, shutdown_event, idle_timeout):
+    """Worker process: apply batches of frames sent by the receive loop"""
+    while not shutdown_event.is_set():
+        if not conn.poll(idle_timeout):
+            for book in books.values():
+                book.publish_state()
+            continue
+        try:
+            frames = conn.recv()
+        except EOFError:
+            break
+        if frames is None:
+            break
+        apply_frames(books, frames)
+    for book in books.values():
+        book.publish_state(force=True)
+
+
+class MultiProductFeed(object):
+    """One websocket connection feeding one PygoOrderBook per product
+
+    books: product_id -> PygoOrderBook.  The books never connect themselves.
+    workers: 0 to update every book on the receive loop, or the number of
+    worker processes to spread the books across.
+
+    Unroutable and undecodable frames are counted in stats.decode_errors,
+    and the connection's message rate and batch sizes are in stats too,
+    published to ns.connection_stats, at most every stats_interval seconds,
+    if an ns is given.
+
+    Important methods:
+    start: runs the connection on a thread, like WebsocketClient.start
+    close: stops everything and waits for it
+    """
+
+    def __init__(self, books, url='wss://ws-feed.pro.coinbase.com', workers=0, ns=None, recorder=None,
+        max_batch=1000, idle_timeout=0.5, channels=('full',)):
+        self.books = books
+        self.url = url
+        self.workers = workers
+        self.ns = ns
+        self.recorder = recorder
+        self.max_batch = max_batch
+        self.idle_timeout = idle_timeout
+        self.channels = list(channels)
+        self.stats = FeedStats()
+        self.stats_interval = 1.0
+        self._last_stats_publish = 0.0
+        self.has_started = False
+        self.error = None
+        self.shutdown_event = multiprocessing.Event()
+        self._thread = None
+        self._processes = []
+        self._routes = {}   #product_id -> pipe to the worker that owns it
+
+    @property
+    def products(self):
+        return list(self.books)
+
+    def _start_workers(self):
+        shards = [{} for _ in range(self.workers)]
+        for i, (product_id, book) in enumerate(self.books.items()):
+            shards[i % self.workers][product_id] = book
+        for shard in shards:
+            if not shard:
+                continue
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_worker_main,
+                                              args=(shard, receiver, self.shutdown_event, self.idle_timeout),
+                                              daemon=True)
+            process.start()
+            receiver.close()
+            for product_id in shard:
+                self._routes[product_id] = sender
+            self._processes.append((process, sender))
+
+    def _route(self, frames):
+        """Send each worker its share of the frames, in one message per worker"""
+        batches = {}
+        dropped = 0
+        for frame in frames:
+            pipe = self._routes.get(product_of(frame))
+            if pipe is None:
+                dropped += 1
+                continue
+            batches.setdefault(pipe, []).append(frame)
+        for pipe, batch in batches.items():
+            pipe.send(batch)
+        return dropped
+
+    def on_batch(self, frames):
+        connected = True
+        if frames and isinstance(frames[-1], Exception):
+            self.error = frames.pop()
+            connected = False
+        self.stats.record_batch(len(frames))
+        if self.workers:
+            self.stats.decode_errors += self._route(frames)
+        else:
+            self.stats.decode_errors += apply_frames(self.books, frames)
+        self.publish_stats()
+        return connected
+
+    def on_idle(self):
+        if not self.workers:
+            for book in self.books.values():
+                book.publish_state()
+        self.publish_stats()
+
+    def publish_stats(self, force=False):
+        """Copy the connection's stats to ns.connection_stats, at most every stats_interval seconds"""
+        now = time.monotonic()
+        if self.ns is not None and (force or now - self._last_stats_publish >= self.stats_interval):
+            self.ns.connection_stats = self.stats.snapshot()
+            self._last_stats_publish = now
+
+    async def run(self):
+        """Run the connection until close() is called or the connection drops"""
+        sub_params = {'type': 'subscribe', 'product_ids': self.products, 'channels': self.channels}
+        if self.workers:
+            self._start_workers()
+        try:
+            await receive_batches(self.url, sub_params, self.shutdown_event, self.on_batch,
+                                  on_idle=self.on_idle, idle_timeout=self.idle_timeout,
+                                  max_batch=self.max_batch, recorder=self.recorder)
+            if not self.workers:
+                #apply what was received before a pending snapshot arrived
+                while any(book.resyncing for book in self.books.values()) and not self.shutdown_event.is_set():
+                    await asyncio.sleep(0.01)
+        finally:
+            self._stop_workers()
+            self.publish_stats(force=True)
+            if not self.workers:
+                for book in self.books.values():
+                    book.publish_state(force=True)
+
+    def _stop_workers(self):
+        for process, sender in self._processes:
+            try:
+                sender.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process, sender in self._processes:
+            process.join(5)
+            sender.close()
+        self._processes = []
+        self._routes = {}
+
+    def start(self):
+        def _go():
+            self.has_started = True
+            try:
+                asyncio.run(self.run())
+            except Exception as e:
+                self.error = e
+            finally:
+                self.has_started = False
+
+        self._thread = Thread(target=_go, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.shutdown_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
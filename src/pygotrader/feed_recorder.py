@@ -0,0 +1,106 @@
+"""
+Recording of the raw exchange feed to disk
+
+A recording is a gzip file holding a stream of length-prefixed records.
+Each record is a little-endian header of (receive time in nanoseconds since
+the epoch as int64, record kind as uint8, payload length as uint32) followed
+by the payload bytes:
+
+FRAME: a websocket frame exactly as it was received
+SNAPSHOT: a level-3 order book snapshot from the REST API, as JSON, with
+    the product it's for added as 'product_id'
+PRODUCTS: the REST API's product list, as JSON (used for quote increments)
+
+Files are only ever appended to.  Every time a recorder opens a file it
+starts a new gzip member, which gzip readers treat as one continuous stream,
+so a feed can be recorded across several runs.  A record cut short by a
+crash is ignored when reading.
+
+Important classes/functions:
+FeedRecorder: appends records, safe to use from more than one thread
+read_feed: iterates over the FeedRecords in a file
+
+See replay.py for playing a recording back.
+"""
+from collections import namedtuple
+import gzip
+import json
+import struct
+import threading
+import time
+import zlib
+
+FRAME = 0
+SNAPSHOT = 1
+PRODUCTS = 2
+
+_HEADER = struct.Struct('<qBI')
+
+FeedRecord = namedtuple('FeedRecord', ['recv_ns', 'kind', 'payload'])
+
+
+class FeedRecorder(object):
+    """Appends feed records to a compressed recording
+
+    Compression level 1 is the default since the recorder runs on the receive
+    path; raw feed JSON still compresses roughly 5-8x at that level.
+    """
+
+    def __init__(self, path, compresslevel=1):
+        self.path = path
+        self._file = gzip.open(path, 'ab', compresslevel=compresslevel)
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def _write(self, kind, payload, recv_ns):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if recv_ns is None:
+            recv_ns = time.time_ns()
+        with self._lock:
+            self._file.write(_HEADER.pack(recv_ns, kind, len(payload)))
+            self._file.write(payload)
+            self.records += 1
+
+    def record_frame(self, data, recv_ns=None):
+        self._write(FRAME, data, recv_ns)
+
+    def record_snapshot(self, snapshot, recv_ns=None, product_id=None):
+        if product_id is not None:
+            snapshot = dict(snapshot, product_id=product_id)
+        self._write(SNAPSHOT, json.dumps(snapshot), recv_ns)
+
+    def record_products(self, products, recv_ns=None):
+        self._write(PRODUCTS, json.dumps(products), recv_ns)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_feed(path):
+    """Yield the FeedRecords in a recording, oldest first"""
+    with gzip.open(path, 'rb') as f:
+        try:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                recv_ns, kind, length = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                yield FeedRecord(recv_ns, kind, payload)
+        except (EOFError, zlib.error):
+            #the recorder was killed in the middle of writing
+            return
@@ -0,0 +1,363 @@
+"""
+Small, low-overhead counters for measuring the program while it runs
+
+Everything here is meant to be updated on hot paths (per message, per batch,
+per algorithm tick), so recording a value is a couple of integer operations
+and nothing is shared between processes directly.  Owners periodically copy
+a snapshot() dict into the shared namespace, which costs one Manager call
+per publish instead of one per event.
+
+Important classes:
+Histogram: log-bucketed histogram with approximate percentiles
+RateMeter: events per second over the last measurement interval
+FeedStats: message rate, batch sizes and resyncs of the websocket feed
+SchedulerStats: how often the algorithm runs and how far behind the feed it is
+ReloadStats: how long new versions of the algorithm file took to load and swap in
+ColocatedStats: how much of the feed's event loop a colocated strategy uses
+OrderQueueStats: how deep the OrderHandler's queues get and how long orders wait
+OrderGatewayStats: how many orders are in flight and how long they take
+"""
+import math
+import time
+
+
+class Histogram(object):
+    """Histogram of non-negative values in logarithmic buckets
+
+    Each power of two, above 1 as well as below it, is split into
+    `resolution` buckets, so a percentile is accurate to within about
+    100/resolution percent of its value (19% with the default of 4), whether
+    it's seconds or microseconds.  Count, sum, min and max are exact.
+    """
+
+    def __init__(self, resolution=4):
+        self.resolution = resolution
+        self.buckets = {}
+        self.zeros = 0   #values of 0 or less, which have no log bucket
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        if value <= 0:
+            self.zeros += 1
+        else:
+            bucket = math.floor(math.log2(value) * self.resolution)
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def _bucket_value(self, bucket):
+        """Upper edge of a bucket"""
+        return 2 ** ((bucket + 1) / self.resolution)
+
+    def percentile(self, p):
+        """Approximate value below which p percent of the recorded values fall"""
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * p / 100.0)
+        seen = self.zeros
+        if seen >= rank:
+            return 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self._bucket_value(bucket), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def distribution(self):
+        """Return [(bucket upper edge, count), ...] in increasing order"""
+        distribution = [(0, self.zeros)] if self.zeros else []
+        return distribution + [(self._bucket_value(b), self.buckets[b]) for b in sorted(self.buckets)]
+
+    def reset(self):
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean': self.mean,
+                'min': self.min,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+class RateMeter(object):
+    """Counts events and reports the rate over the last completed interval"""
+
+    def __init__(self, interval=1.0, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.total = 0
+        self._window_start = clock()
+        self._window_count = 0
+        self.rate = 0.0
+
+    def mark(self, n=1):
+        self.total += n
+        self._window_count += n
+        now = self.clock()
+        elapsed = now - self._window_start
+        if elapsed >= self.interval:
+            self.rate = self._window_count / elapsed
+            self._window_start = now
+            self._window_count = 0
+
+
+class FeedStats(object):
+    """Throughput of the websocket receive loop
+
+    messages: RateMeter of decoded messages
+    batch_sizes: Histogram of how many messages were applied per batch
+    decode_errors: frames that couldn't be decoded
+    gaps, missed_messages: sequence gaps seen and how many messages they skipped
+    resyncs, resync_seconds: completed snapshot resyncs, Histogram of their durations
+    resync_failures: snapshot loads that failed and were retried
+    """
+
+    def __init__(self):
+        self.messages = RateMeter()
+        self.batch_sizes = Histogram(resolution=1)
+        self.decode_errors = 0
+        self.gaps = 0
+        self.missed_messages = 0
+        self.resync_seconds = Histogram()
+        self.resync_failures = 0
+        self.resyncing = False
+
+    @property
+    def resyncs(self):
+        return self.resync_seconds.count
+
+    def record_resync(self, seconds):
+        self.resync_seconds.record(seconds)
+
+    def record_batch(self, size):
+        self.messages.mark(size)
+        self.batch_sizes.record(size)
+
+    def snapshot(self):
+        return {'messages': self.messages.total,
+                'messages_per_second': round(self.messages.rate, 1),
+                'batches': self.batch_sizes.count,
+                'batch_size': self.batch_sizes.snapshot(),
+                'batch_size_distribution': self.batch_sizes.distribution(),
+                'decode_errors': self.decode_errors,
+                'gaps': self.gaps,
+                'missed_messages': self.missed_messages,
+                'resyncs': self.resyncs,
+                'resync_seconds_total': self.resync_seconds.total,
+                'resync_seconds': self.resync_seconds.snapshot(),
+                'resync_failures': self.resync_failures,
+                'resyncing': self.resyncing}
+
+
+class SchedulerStats(object):
+    """How the trading algorithm is being scheduled
+
+    runs: RateMeter of trading_algorithm calls
+    wakeups: calls that were started by a feed update (event scheduling)
+    coalesced: feed updates that were folded into a run instead of getting
+        their own, because of the debounce or the max rate
+    feed_to_start, feed_to_decision: Histograms of seconds from the oldest 
+        feed update a run saw being published, to the run starting and to 
+        trading_algorithm returning
+    tick_time: Histogram of seconds each trading_algorithm call took.  Calls
+        run under the profiler are left out, since it slows them down
+    budget: seconds a call may take, overruns: calls that took longer
+    profiled: calls that were run under the profiler
+    """
+
+    def __init__(self, budget=None):
+        self.runs = RateMeter()
+        self.wakeups = 0
+        self.coalesced = 0
+        self.feed_to_start = Histogram()
+        self.feed_to_decision = Histogram()
+        self.tick_time = Histogram()
+        self.budget = budget
+        self.overruns = 0
+        self.profiled = 0
+
+    def record_tick(self, seconds):
+        """Record how long a call took.  Returns whether it overran the budget"""
+        self.tick_time.record(seconds)
+        if self.budget and seconds > self.budget:
+            self.overruns += 1
+            return True
+        return False
+
+    def snapshot(self):
+        return {'runs': self.runs.total,
+                'runs_per_second': round(self.runs.rate, 1),
+                'wakeups': self.wakeups,
+                'coalesced': self.coalesced,
+                'feed_to_start': self.feed_to_start.snapshot(),
+                'feed_to_decision': self.feed_to_decision.snapshot(),
+                'tick_time': self.tick_time.snapshot(),
+                'budget': self.budget,
+                'overruns': self.overruns,
+                'profiled': self.profiled}
+
+
+class ReloadStats(object):
+    """How reloading the algorithm file is going
+
+    mode: how changes to the file are noticed, 'inotify' or 'poll'
+    reloads: new versions that were swapped in
+    failures: new versions that didn't load, so the old one kept running
+    load_time: Histogram of seconds spent compiling and checking a version,
+        which happens off the trading loop
+    swap_gap: Histogram of seconds between the old version's last run and
+        the new version's first, i.e. how long trading paused for a swap
+    """
+
+    def __init__(self, mode='poll'):
+        self.mode = mode
+        self.reloads = 0
+        self.failures = 0
+        self.load_time = Histogram()
+        self.swap_gap = Histogram()
+
+    def snapshot(self):
+        return {'mode': self.mode,
+                'reloads': self.reloads,
+                'failures': self.failures,
+                'load_time': self.load_time.snapshot(),
+                'swap_gap': self.swap_gap.snapshot()}
+
+
+class ColocatedStats(object):
+    """How a colocated strategy is doing on the feed's event loop
+
+    runs: RateMeter of strategy calls
+    loop_time: Histogram of seconds each call spent running on the event
+        loop, summed over its steps (time spent awaiting isn't counted)
+    budget: seconds of loop time a call may take, overruns: calls that took
+        longer, cancelled: calls that were cancelled for it mid-way
+    coalesced: book updates skipped because the previous call hadn't finished
+    suspensions: times the strategy was benched for overrunning repeatedly,
+        skipped: updates it missed while benched or with no event loop running
+    errors: calls that raised
+    """
+
+    def __init__(self, budget=None):
+        self.runs = RateMeter()
+        self.loop_time = Histogram()
+        self.budget = budget
+        self.overruns = 0
+        self.cancelled = 0
+        self.coalesced = 0
+        self.suspensions = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def snapshot(self):
+        return {'runs': self.runs.total,
+                'runs_per_second': round(self.runs.rate, 1),
+                'loop_time': self.loop_time.snapshot(),
+                'budget': self.budget,
+                'overruns': self.overruns,
+                'cancelled': self.cancelled,
+                'coalesced': self.coalesced,
+                'suspensions': self.suspensions,
+                'skipped': self.skipped,
+                'errors': self.errors}
+
+
+class OrderQueueStats(object):
+    """The OrderHandler's order queues
+
+    depth: Histogram of how many orders were taken off a queue per wake-up
+    queue_time: Histogram of seconds from create_*_order() to being taken
+    submit_time: Histogram of seconds each place or cancel call took
+    sent: orders taken off the queues, by kind ('buy', 'sell', 'cancel')
+    succeeded, failed: orders the exchange did or didn't accept
+    """
+
+    def __init__(self):
+        self.depth = Histogram(resolution=1)
+        self.queue_time = Histogram()
+        self.submit_time = Histogram()
+        self.sent = {}
+        self.succeeded = 0
+        self.failed = 0
+
+    def drained(self, depth, queue_seconds):
+        self.depth.record(depth)
+        for seconds in queue_seconds:
+            self.queue_time.record(seconds)
+
+    def submitted(self, kind, succeeded, failed):
+        self.sent[kind] = self.sent.get(kind, 0) + succeeded + failed
+        self.succeeded += succeeded
+        self.failed += failed
+
+    def snapshot(self):
+        return {'drains': self.depth.count,
+                'depth': self.depth.snapshot(),
+                'depth_distribution': self.depth.distribution(),
+                'queue_time': self.queue_time.snapshot(),
+                'submit_time': self.submit_time.snapshot(),
+                'sent': dict(self.sent),
+                'succeeded': self.succeeded,
+                'failed': self.failed}
+
+
+class OrderGatewayStats(object):
+    """Orders going through an order_gateway.OrderGateway
+
+    sent: requests started, by kind ('buy', 'sell', 'cancel')
+    succeeded, failed: requests that got (or didn't get) what they asked for
+    in_flight, max_in_flight: requests waiting on the exchange now, and the
+        most there have been at once
+    queue_time: Histogram of seconds from create_*_order() to being sent
+    round_trip: Histogram of seconds from being sent to the answer
+    """
+
+    def __init__(self):
+        self.sent = {}
+        self.succeeded = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.queue_time = Histogram()
+        self.round_trip = Histogram()
+
+    def started(self, kind):
+        self.sent[kind] = self.sent.get(kind, 0) + 1
+        self.in_flight += 1
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+
+    def finished(self, ok, seconds):
+        self.in_flight -= 1
+        if ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.round_trip.record(seconds)
+
+    def snapshot(self):
+        return {'sent': dict(self.sent),
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'queue_time': self.queue_time.snapshot(),
+                'round_trip': self.round_trip.snapshot()}
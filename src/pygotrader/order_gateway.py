@@ -0,0 +1,378 @@
+"""
+Placing and cancelling orders concurrently from one asyncio event loop
+
+The OrderHandler has one thread each for buys, sells and cancels, and each
+makes its REST calls one at a time through cbpro's blocking client, so a
+burst of cancels goes out one after the other.  The OrderGateway is a drop-in
+replacement (same create_* methods, same ns.message and ns.my_orders
+updates) that runs an asyncio event loop in its own process instead:
+
+- Orders are put on a multiprocessing.Queue, so they're taken in the order
+  they were created (FIFO), and none are lost however many come at once.
+- Up to max_in_flight requests are sent at the same time, over a pool of
+  keep-alive HTTP connections (ConnectionPool), so a burst costs about one
+  round trip instead of one per order, and no TLS handshake after the first.
+- The outcome of every order is sent as an event, a dict, to each listener
+  added with add_result_listener(), tagged with the request id that
+  create_*_order() returned.
+
+The HTTP client is a small HTTP/1.1 implementation on asyncio streams, just
+enough for the exchange's JSON REST API, so there's nothing extra to install.
+
+Important classes:
+ConnectionPool: keep-alive HTTP/1.1 connections to one host
+OrderGateway: the OrderHandler replacement, run with --order_gateway
+"""
+from collections import namedtuple
+from threading import Thread
+import asyncio
+import json
+import multiprocessing
+import queue
+import ssl
+import threading
+import time
+import urllib.parse
+import uuid
+
+from cbpro.cbpro_auth import get_auth_headers
+
+from pygotrader.metrics import OrderGatewayStats
+from pygotrader.order_handler import OrderHandler
+
+HTTPResponse = namedtuple('HTTPResponse', ['status', 'headers', 'body'])
+
+
+class _StaleConnection(Exception):
+    """An idle connection the server had already closed"""
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP/1.1 connections to the host of base_url
+
+    At most `size` requests are sent at once, each on its own connection.  A
+    connection goes back to the pool after its response unless the server
+    asked to close it, and idle connections the server has since closed are
+    dropped before they're used.  If one is closed anyway while a GET or
+    DELETE is sent on it (nothing at all comes back), the request is sent
+    again on a new connection.  Nothing else is retried, and a POST never
+    is: the exchange might already have acted on the first copy, so the
+    error goes to the caller instead.
+
+    opened counts the connections made, reused the requests sent on a
+    connection that had already been used.
+    """
+
+    RETRY_METHODS = ('GET', 'DELETE')   #safe to send twice
+
+    def __init__(self, base_url, size=8):
+        parts = urllib.parse.urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.host_header = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.size = size
+        self.opened = 0
+        self.reused = 0
+        self._idle = []
+        self._slots = None
+
+    async def request(self, method, path, body=b'', headers=None):
+        """Send a request for prefix + path and return an HTTPResponse"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        async with self._slots:
+            while self._idle:
+                connection = self._idle.pop()
+                if connection[0].at_eof():
+                    connection[1].close()   #closed by the server while idle
+                    continue
+                try:
+                    response = await self._exchange(connection, method, path, body, headers, reused=True)
+                except _StaleConnection:
+                    continue
+                self.reused += 1
+                return response
+            connection = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+            self.opened += 1
+            return await self._exchange(connection, method, path, body, headers, reused=False)
+
+    async def _exchange(self, connection, method, path, body, headers, reused):
+        reader, writer = connection
+        lines = [f'{method} {self.prefix}{path} HTTP/1.1', f'Host: {self.host_header}',
+                 f'Content-Length: {len(body)}', 'Connection: keep-alive']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        try:
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line:
+                if reused and method in self.RETRY_METHODS:
+                    raise _StaleConnection()
+                raise ConnectionError("Connection closed without a response")
+            response, keep_alive = await self._read_response(reader, status_line)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            self._idle.append(connection)
+        else:
+            writer.close()
+        return response
+
+    async def _read_response(self, reader, status_line):
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass   #trailers
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        elif status in (204, 304) or status < 200:
+            body = b''
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return HTTPResponse(status, headers, body), keep_alive
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for reader, writer in idle:
+            writer.close()
+        for reader, writer in idle:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+class OrderGateway(OrderHandler):
+    """An OrderHandler that sends orders concurrently from an asyncio loop
+
+    Credentials and the API url are taken from authenticated_client, which
+    is still used to refresh ns.my_orders every 10 seconds (and shortly
+    after orders were placed, once per burst rather than once per order).
+
+    Orders aren't retried.  Each one is sent once, with order_timeout
+    seconds to get an answer, and the result event says how it went:
+    {'request_id', 'order' ('buy', 'sell' or 'cancel'), 'ok', 'status' (the
+    HTTP status), 'response' (the decoded JSON), 'order_id', 'strategy',
+    'queue_seconds', 'seconds' (the round trip), 'error'}
+
+    Important methods:
+    create_buy_order, create_sell_order, create_cancel_order: like the
+        OrderHandler's, but they return the request's id
+    add_result_listener: a pipe the result events are sent to.  Must be
+        called before start()
+
+    Stats (metrics.OrderGatewayStats) are published to ns.order_gateway_stats.
+    """
+
+    def __init__(self, authenticated_client, multiprocessing_namespace, debug=False, max_in_flight=8):
+        super().__init__(authenticated_client, multiprocessing_namespace, debug=debug)
+        auth = authenticated_client.auth
+        self.api_url = authenticated_client.url
+        self.credentials = (auth.api_key, auth.secret_key, auth.passphrase)
+        self.max_in_flight = max_in_flight
+        self.orders = multiprocessing.Queue()
+        self.stats = OrderGatewayStats()
+        self.stats_interval = 1.0
+        self.pool = None
+        self._result_listeners = []
+        self._last_stats_publish = 0.0
+        self._refresh = None
+
+    def add_result_listener(self):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._result_listeners.append(sender)
+        return receiver
+
+    def _queue(self, order):
+        order['request_id'] = str(uuid.uuid4())
+        order['queued_ns'] = time.time_ns()
+        self.orders.put(order)
+        return order['request_id']
+
+    def create_buy_order(self,size,price,product_id,type='market',strategy=None):
+        if type not in ('market', 'limit'):
+            self.ns.message = "Error in buy order type"
+            return None
+        return self._queue({'order':'buy','type':type,'product':product_id,'size':size,'price':price,'strategy':strategy})
+
+    def create_sell_order(self,size,price,product_id,type='market',strategy=None):
+        if type not in ('market', 'limit'):
+            self.ns.message = "Error in sell order type"
+            return None
+        return self._queue({'order':'sell','type':type,'product':product_id,'size':size,'price':price,'strategy':strategy})
+
+    def create_cancel_order(self,order_id,strategy=None):
+        return self._queue({'order':'cancel','order_id':order_id,'strategy':strategy})
+
+    def main_loop(self):
+        self._refresh = threading.Event()
+        checker = Thread(target=self._order_checker, daemon=True)
+        checker.start()
+        try:
+            asyncio.run(self.run())
+        finally:
+            self.shutdown_event.set()
+            self._refresh.set()
+            checker.join()
+
+    def close(self):
+        self.orders.put(None)
+        super().close()
+
+    def _order_checker(self):
+        while not self.shutdown_event.is_set():
+            try:
+                self.load_my_orders()
+            except Exception as e:
+                if self.debug:
+                    self.ns.message = f"Couldn't load orders: {e}"
+            self._refresh.wait(10)
+            self._refresh.clear()
+            time.sleep(0.2)   #let the rest of a burst get placed first
+
+    def _read_orders(self, loop, pending):
+        """Move orders from the IPC queue onto the event loop, in order
+
+        Everything put on the queue before close()'s None is passed on.  The
+        shutdown event only ends the loop early if the queue has gone quiet
+        without a None ever coming.
+        """
+        while True:
+            try:
+                order = self.orders.get(timeout=0.5)
+            except queue.Empty:
+                if self.shutdown_event.is_set():
+                    break
+                continue
+            loop.call_soon_threadsafe(pending.put_nowait, order)
+            if order is None:
+                return
+        loop.call_soon_threadsafe(pending.put_nowait, None)
+
+    async def run(self):
+        """Send orders until close(), then wait for the ones in flight"""
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+        reader = Thread(target=self._read_orders, args=(loop, pending), daemon=True)
+        reader.start()
+        self.pool = ConnectionPool(self.api_url, size=self.max_in_flight)
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        try:
+            while True:
+                order = await pending.get()
+                if order is None:
+                    break
+                await in_flight.acquire()
+                task = asyncio.ensure_future(self._execute(order, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            await self.pool.close()
+            self.publish_stats(force=True)
+
+    async def _request(self, method, path, body=None):
+        payload = json.dumps(body) if body is not None else ''
+        timestamp = str(time.time())
+        headers = get_auth_headers(timestamp, timestamp + method + self.pool.prefix + path + payload,
+                                   *self.credentials)
+        response = await asyncio.wait_for(self.pool.request(method, path, payload.encode(), headers),
+                                          self.order_timeout)
+        return response.status, json.loads(response.body) if response.body else None
+
+    async def _place(self, order):
+        client_oid = str(uuid.uuid4())
+        #lets the order books recognize the order's messages before we know its id
+        self.announce_order_ids('expect', [client_oid])
+        body = {'product_id': order['product'], 'side': order['order'], 'type': order['type'],
+                'size': str(order['size']), 'client_oid': client_oid}
+        if order['type'] == 'limit':
+            body.update(price=str(order['price']), post_only=True)
+        status, response = await self._request('POST', '/orders', body)
+        side = order['order'].capitalize()
+        if isinstance(response, dict) and 'id' in response:
+            order_id = response['id']
+            self.announce_order_ids('add', [order_id])
+            self.tag_order(order_id, order.get('strategy'))
+            self.ns.message = f"{self.describe(order)}{side} order {order_id}: {response.get('status', '').upper()}"
+            self._refresh.set()
+            return True, status, response, order_id
+        self.ns.message = f"{self.describe(order)}{side} order failed"
+        return False, status, response, None
+
+    async def _cancel(self, order):
+        order_id = order['order_id']
+        status, response = await self._request('DELETE', f'/orders/{order_id}')
+        if status == 200:
+            self.ns.message = f"{self.describe(order)}Order Canceled."
+            self._refresh.set()
+            return True, status, response, order_id
+        self.ns.message = f"Cancel failed: Unable to cancel order: {response}."
+        return False, status, response, order_id
+
+    async def _execute(self, order, in_flight):
+        stats = self.stats
+        queue_seconds = (time.time_ns() - order['queued_ns']) / 1e9
+        stats.queue_time.record(queue_seconds)
+        stats.started(order['order'])
+        start = time.perf_counter()
+        error = None
+        try:
+            if order['order'] == 'cancel':
+                ok, status, response, order_id = await self._cancel(order)
+            else:
+                ok, status, response, order_id = await self._place(order)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            ok, status, response, order_id = False, None, None, order.get('order_id')
+            error = repr(e)
+            self.ns.message = f"{self.describe(order)}{order['order'].capitalize()} order failed: {error}"
+        finally:
+            in_flight.release()
+        seconds = time.perf_counter() - start
+        stats.finished(ok, seconds)
+        self._send_result({'request_id': order['request_id'], 'order': order['order'], 'ok': ok, 'status': status,
+                           'response': response, 'order_id': order_id, 'strategy': order.get('strategy'),
+                           'queue_seconds': queue_seconds, 'seconds': seconds, 'error': error})
+        self.publish_stats()
+
+    def _send_result(self, result):
+        for sender in self._result_listeners:
+            try:
+                sender.send(result)
+            except (BrokenPipeError, OSError):
+                pass
+
+    def publish_stats(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_stats_publish >= self.stats_interval:
+            stats = self.stats.snapshot()
+            if self.pool is not None:
+                stats['connections_opened'] = self.pool.opened
+                stats['requests_reused'] = self.pool.reused
+            self.ns.order_gateway_stats = stats
+            self._last_stats_publish = now
+
@@ -1,10 +1,16 @@
 from cbpro.order_book import OrderBook
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+import asyncio
+import functools
 import time
 from itertools import islice
 from threading import Thread
+import threading
 import json, os
 import multiprocessing
+import uuid
+from pygotrader.metrics import Histogram, OrderQueueStats
 
 def debug_write(text, debug_file='debug.txt'):
     """Helper function to keep code clean"""
@@ -18,7 +24,12 @@ class OrderHandler(object):
     Important methods:
     main_loop: A separate process that launches child threads to handle buy, sell,
     cancel orders, and get lists of existing orders, and waits for a shutdown event.  
-    The child threads each wait for specific events before doing their work.
+    The child threads each wait for specific events before doing their work.  Each
+    time one wakes up it takes everything on its queue, oldest first, and places
+    the whole batch at once on a pool of max_workers threads, so a burst of orders
+    from one algorithm tick takes about as long as one order.  How many orders 
+    each wake-up found (queue depth), how long they waited on the queue and how
+    long the exchange took are published to ns.order_handler_stats.
     
     place_order: Places orders via the authenticated_client. This method is used by various
     buy, sell, cancel child threads to place an order after it is pulled off their queue.
@@ -28,8 +39,16 @@ class OrderHandler(object):
     By default they are market orders, but when specified they can be limit orders.
     
     load_my_orders: Gets all the user's orders from the authenticated_client
+    
+    add_order_id_listener: Returns a channel the order books read our order ids 
+    from, so the feed doesn't have to look every message up in ns.my_orders.
+    Must be called before start().
+    
+    Orders can be tagged with the strategy that made them (see 
+    TaggedOrderHandler).  The tag is shown in the order's message and kept 
+    as 'strategy' in ns.my_orders.
     """
-    def __init__(self, authenticated_client, multiprocessing_namespace,debug=False):
+    def __init__(self, authenticated_client, multiprocessing_namespace,debug=False,max_workers=8):
         self.authenticated_client = authenticated_client
         self.ns = multiprocessing_namespace
         self.shutdown_event = multiprocessing.Event()
@@ -38,80 +57,131 @@ class OrderHandler(object):
         self.sell = multiprocessing.Event()
         self.cancel = multiprocessing.Event()
         self.order_timeout = 5.0
+        self._order_id_listeners = []
+        self._order_id_lock = multiprocessing.Lock()
+        self.order_strategies = {}   #order id -> strategy that placed it
+        self.max_workers = max_workers
+        self.executor = None
+        self.stats = OrderQueueStats()
+        self._stats_lock = threading.Lock()
     
-    def main_loop(self):
-        def _buy_loop():
-            while not self.shutdown_event.is_set():
-                self.buy.wait() 
+    def add_order_id_listener(self):
+        """Return the receiving end of a pipe that gets (action, ids) updates of
+        our order ids, see PygoOrderBook.read_order_id_updates"""
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._order_id_listeners.append(sender)
+        return receiver
+    
+    def announce_order_ids(self, action, ids):
+        with self._order_id_lock:
+            for sender in self._order_id_listeners:
                 try:
-                    buy_order = self.ns.buy_order_queue.pop()
-                    result, order_id, order = self.place_order(size=buy_order['size'],
-                                                               price=buy_order['price'],
-                                                               side=buy_order['order'],
-                                                               product_id=buy_order['product'],
-                                                               type=buy_order['type'])
-                    if result:
-                        self.ns.message = f"Buy order {order_id}: {order['status'].upper()}"
-                        self.load_my_orders()
-                    else:
-                        self.ns.message = f"Buy order failed"
-                except (ValueError,IndexError):
-                    self.ns.message = "No buy order found in the queue..."
+                    sender.send((action, list(ids)))
+                except (BrokenPipeError, OSError):
                     pass
-                self.buy.clear()
+    
+    def main_loop(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='orders')
 
-        def _sell_loop():
+        def _drain_loop(event, queue_name, kind, submit):
             while not self.shutdown_event.is_set():
-                self.sell.wait()                
-                try:
-                    sell_order = self.ns.sell_order_queue.pop()
-                    result, order_id, order = self.place_order(size=sell_order['size'],
-                                                               price=sell_order['price'],
-                                                               side=sell_order['order'],
-                                                               product_id=sell_order['product'],
-                                                               type=sell_order['type'])                    
-                    if result:
-                        self.ns.message = f"Sell order {order_id}: {order['status'].upper()}"
-                        self.load_my_orders()
-                    else:
-                        self.ns.message = f"Sell order failed"
-                except (ValueError,IndexError):
-                    self.ns.message = "No sell order found in the queue..."
-                    pass
-                self.sell.clear()
+                event.wait()
+                #cleared before draining, so anything queued from now on wakes us again
+                event.clear()
+                if self.shutdown_event.is_set():
+                    break
+                batch = self.drain_queue(queue_name)
+                if not batch:
+                    self.ns.message = f"No {kind} order found in the queue..."
+                    continue
+                self.submit_batch(kind, batch, submit)
 
-        def _cancel_loop():
-            while not self.shutdown_event.is_set():
-                self.cancel.wait()                
-                try:
-                    cancel = self.ns.cancel_order_queue.pop()
-                    self.ns.message = f"Cancelling order {cancel['order_id']}"
-                    result, extended_result = self.cancel_order(cancel['order_id'])
-                    if result:
-                        self.ns.message = extended_result
-                        self.load_my_orders()
-                    else:
-                        self.ns.message = f"Cancel failed: {extended_result}"
-                except (ValueError,IndexError):
-                    self.ns.message = "No cancel order found in the queue..."
-                    pass
-                self.cancel.clear()
-                
         def _order_checker():
             while not self.shutdown_event.is_set():
                 self.load_my_orders()
-                time.sleep(10)
+                self.shutdown_event.wait(10)
 
         self.order_checker_thread = Thread(target=_order_checker)
         self.order_checker_thread.start()
-        self.buy_thread = Thread(target=_buy_loop)
+        self.buy_thread = Thread(target=_drain_loop, args=(self.buy, 'buy_order_queue', 'buy', self.place_queued_order))
         self.buy_thread.start()
-        self.sell_thread = Thread(target=_sell_loop)
+        self.sell_thread = Thread(target=_drain_loop, args=(self.sell, 'sell_order_queue', 'sell', self.place_queued_order))
         self.sell_thread.start()
-        self.cancel_thread = Thread(target=_cancel_loop)
+        self.cancel_thread = Thread(target=_drain_loop, args=(self.cancel, 'cancel_order_queue', 'cancel', self.cancel_queued_order))
         self.cancel_thread.start()
         
         self.shutdown_event.wait()
+        for event in (self.buy, self.sell, self.cancel):
+            event.set()
+        #a batch that was already taken off its queue still gets sent
+        for thread in (self.buy_thread, self.sell_thread, self.cancel_thread):
+            thread.join()
+        self.executor.shutdown(wait=True)
+
+    def drain_queue(self, queue_name):
+        """Take everything on one of the ns order queues, oldest first
+        
+        Each queue has a single consumer and producers only ever append, so 
+        copying the front of the list and then deleting just that many items
+        can't lose an order that was added in between.  That's two Manager 
+        calls however many orders are waiting.
+        """
+        pending = getattr(self.ns, queue_name)
+        batch = pending[:]
+        if batch:
+            del pending[:len(batch)]
+            now_ns = time.time_ns()
+            with self._stats_lock:
+                self.stats.drained(len(batch), [(now_ns - q['queued_ns']) / 1e9 for q in batch if 'queued_ns' in q])
+        return batch
+
+    def submit_batch(self, kind, batch, submit):
+        """Send every order of a batch at once on the executor, then report on them in order"""
+        futures = [(queued, self.executor.submit(submit, queued)) for queued in batch]
+        messages = []
+        placed = 0
+        for queued, future in futures:
+            try:
+                ok, message = future.result()
+            except Exception as e:
+                ok, message = False, f"{self.describe(queued)}{kind.capitalize()} order failed: {e}"
+            placed += ok
+            messages.append(message)
+        with self._stats_lock:
+            self.stats.submitted(kind, placed, len(batch) - placed)
+            self.ns.order_handler_stats = self.stats.snapshot()
+        if len(messages) == 1:
+            self.ns.message = messages[0]
+        else:
+            self.ns.message = f"{len(batch)} {kind} orders, {len(batch) - placed} failed.  Last: {messages[-1]}"
+        if placed:
+            self.load_my_orders()
+
+    def place_queued_order(self, queued):
+        """Place a buy or sell order taken off a queue.  Returns (ok, message)"""
+        side = queued['order'].capitalize()
+        start = time.perf_counter()
+        placed = self.place_order(size=queued['size'], price=queued['price'], side=queued['order'],
+                                  product_id=queued['product'], type=queued['type'])
+        self._record_submit(time.perf_counter() - start)
+        if not placed:
+            return False, f"{side} order failed"
+        result, order_id, order = placed
+        self.tag_order(order_id, queued.get('strategy'))
+        return True, f"{self.describe(queued)}{side} order {order_id}: {order['status'].upper()}"
+
+    def cancel_queued_order(self, queued):
+        """Cancel an order taken off the cancel queue.  Returns (ok, message)"""
+        start = time.perf_counter()
+        result, extended_result = self.cancel_order(queued['order_id'])
+        self._record_submit(time.perf_counter() - start)
+        if result:
+            return True, f"{self.describe(queued)}{extended_result}"
+        return False, f"Cancel failed: {extended_result}"
+
+    def _record_submit(self, seconds):
+        with self._stats_lock:
+            self.stats.submit_time.record(seconds)
         
     def load_my_orders(self):
         my_orders = self.authenticated_client.get_orders()
@@ -123,8 +193,10 @@ class OrderHandler(object):
                                             'type':order['type'],
                                             'price':order['price'],
                                             'size':order['size'],
-                                            'status':order['status']}
+                                            'status':order['status'],
+                                            'strategy':self.order_strategies.get(order['id'])}
         self.ns.my_orders = temp_dict
+        self.announce_order_ids('replace', temp_dict)
             
     # def track_my_orders(self):
     #     # temp_dict = {}
@@ -146,31 +218,40 @@ class OrderHandler(object):
         self.shutdown_event.set()
         self.process.join()        
         
-    def create_buy_order(self,size,price,product_id,type='market'):
+    def tag_order(self, order_id, strategy):
+        if strategy is not None:
+            self.order_strategies[order_id] = strategy
+            
+    def describe(self, queued):
+        """Prefix for messages about a queued order, naming its strategy if it has one"""
+        strategy = queued.get('strategy')
+        return f"[{strategy}] " if strategy is not None else ''
+        
+    def create_buy_order(self,size,price,product_id,type='market',strategy=None):
         """Place an order on the queue for the _buy_loop thread in the main loop to consume"""
         if type == 'market':
-            self.ns.buy_order_queue.append({'order':'buy','type':'market','product':product_id,'size':size,'price':price})
+            self.ns.buy_order_queue.append({'order':'buy','type':'market','product':product_id,'size':size,'price':price,'strategy':strategy,'queued_ns':time.time_ns()})
         elif type == 'limit':
-            self.ns.buy_order_queue.append({'order':'buy','type':'limit','product':product_id,'size':size,'price':price})
+            self.ns.buy_order_queue.append({'order':'buy','type':'limit','product':product_id,'size':size,'price':price,'strategy':strategy,'queued_ns':time.time_ns()})
         else:
             self.ns.message = "Error in buy order type"
             return
         self.buy.set()
 
-    def create_sell_order(self,size,price,product_id,type='market'):
+    def create_sell_order(self,size,price,product_id,type='market',strategy=None):
         """Place an order on the queue for the _sell_loop thread in the main loop to consume"""
         if type == 'market':
-            self.ns.sell_order_queue.append({'order':'sell','type':'market','product':product_id,'size':size,'price':price})
+            self.ns.sell_order_queue.append({'order':'sell','type':'market','product':product_id,'size':size,'price':price,'strategy':strategy,'queued_ns':time.time_ns()})
         elif type == 'limit':
-            self.ns.sell_order_queue.append({'order':'sell','type':'limit','product':product_id,'size':size,'price':price})
+            self.ns.sell_order_queue.append({'order':'sell','type':'limit','product':product_id,'size':size,'price':price,'strategy':strategy,'queued_ns':time.time_ns()})
         else:
             self.ns.message = "Error in sell order type"
             return
         self.sell.set()
                 
-    def create_cancel_order(self,order_id):
+    def create_cancel_order(self,order_id,strategy=None):
         """Place an order on the queue for the _cancel_loop thread in the main loop to consume"""
-        self.ns.cancel_order_queue.append({'order':'cancel','order_id':order_id})
+        self.ns.cancel_order_queue.append({'order':'cancel','order_id':order_id,'strategy':strategy,'queued_ns':time.time_ns()})
         self.cancel.set()       
 
     def place_order(self,size,price,side,product_id,type='market'):
@@ -179,21 +260,25 @@ class OrderHandler(object):
         Will timeout if the order doesn't happen
         """
         start_time = time.time()
+        #lets the order books recognize the order's messages before we know its id
+        client_oid = str(uuid.uuid4())
+        self.announce_order_ids('expect', [client_oid])
         while True:
             now = time.time()
             if((now - start_time) > self.order_timeout):
                 return False
                 
             if type == 'market':                
-                my_order = self.authenticated_client.place_order(product_id=product_id,side=side,order_type=type,size=size)
+                my_order = self.authenticated_client.place_order(product_id=product_id,side=side,order_type=type,size=size,client_oid=client_oid)
             elif type == 'limit':
-                my_order = self.authenticated_client.place_order(product_id=product_id,side=side,order_type=type,size=size,post_only=True,price=price)
+                my_order = self.authenticated_client.place_order(product_id=product_id,side=side,order_type=type,size=size,post_only=True,price=price,client_oid=client_oid)
             else:
                 self.ns.message = f"Order type unknown: {type}"
                 return False
             
             if('id' in my_order):
                 order_id = my_order['id']
+                self.announce_order_ids('add', [order_id])
                 return True, order_id, my_order
             else:
                 if self.debug:
@@ -221,4 +306,104 @@ class OrderHandler(object):
     #             # time.sleep(1)
     #             # continue
                 
-    #     # raise ValueError("(OrderHandler.get_order) Unknown error: Order ID not being returned.")
\ No newline at end of file
+    #     # raise ValueError("(OrderHandler.get_order) Unknown error: Order ID not being returned.")
+
+
+class TaggedOrderHandler(object):
+    """An OrderHandler as seen by one strategy: the orders it creates are 
+    tagged with the strategy's name, everything else is the shared handler's.
+    Handed to each algorithm run by a strategy_pool.StrategyPool."""
+    
+    def __init__(self, order_handler, strategy):
+        self.order_handler = order_handler
+        self.strategy = strategy
+        
+    def create_buy_order(self,size,price,product_id,type='market'):
+        self.order_handler.create_buy_order(size,price,product_id,type=type,strategy=self.strategy)
+        
+    def create_sell_order(self,size,price,product_id,type='market'):
+        self.order_handler.create_sell_order(size,price,product_id,type=type,strategy=self.strategy)
+        
+    def create_cancel_order(self,order_id):
+        self.order_handler.create_cancel_order(order_id,strategy=self.strategy)
+        
+    def __getattr__(self, name):
+        return getattr(self.order_handler, name)
+
+
+class AsyncOrderClient(object):
+    """Places orders from the feed's own event loop, for colocated strategies
+
+    There's no queue and no other process in between: the REST call is made
+    right away on a thread of a small pool, so the event loop keeps applying
+    the feed while the exchange answers, and the coroutine that placed the
+    order gets the exchange's response.  The order books in this process 
+    (books, product_id -> PygoOrderBook) are told the order's client_oid
+    before it's placed and its id once it's known, without a pipe.
+
+    Unlike OrderHandler.place_order, failed orders aren't retried: the 
+    response is returned as it is, with an 'id' if the order was placed and 
+    a 'message' if it wasn't, and the strategy decides what to do.
+    
+    Important methods:
+    buy, sell: place a market order, or a post-only limit order with a price
+    cancel: cancel an order by id
+    snapshot: orders placed/failed and a Histogram of REST round trips
+    """
+
+    def __init__(self, authenticated_client, books=None, max_workers=4):
+        self.authenticated_client = authenticated_client
+        self.books = books if books is not None else {}
+        self.max_workers = max_workers
+        self.placed = 0
+        self.failed = 0
+        self.round_trip = Histogram()
+        self._executor = None
+
+    async def _call(self, function, *args, **kwargs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='order-client')
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor,
+                                                                    functools.partial(function, *args, **kwargs))
+        finally:
+            self.round_trip.record(time.perf_counter() - start)
+
+    def _announce(self, action, ids):
+        for book in self.books.values():
+            book.update_my_order_ids(action, ids)
+
+    async def place(self, side, size, price, product_id, type='market'):
+        if type not in ('market', 'limit'):
+            raise ValueError(f"Order type unknown: {type}")
+        client_oid = str(uuid.uuid4())
+        self._announce('expect', [client_oid])
+        options = {'price': price, 'post_only': True} if type == 'limit' else {}
+        order = await self._call(self.authenticated_client.place_order, product_id=product_id, side=side,
+                                 order_type=type, size=size, client_oid=client_oid, **options)
+        if 'id' in order:
+            self.placed += 1
+            self._announce('add', [order['id']])
+        else:
+            self.failed += 1
+        return order
+
+    async def buy(self, size, price, product_id, type='market'):
+        return await self.place('buy', size, price, product_id, type=type)
+
+    async def sell(self, size, price, product_id, type='market'):
+        return await self.place('sell', size, price, product_id, type=type)
+
+    async def cancel(self, order_id):
+        return await self._call(self.authenticated_client.cancel_order, order_id)
+
+    def snapshot(self):
+        return {'placed': self.placed,
+                'failed': self.failed,
+                'round_trip': self.round_trip.snapshot()}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
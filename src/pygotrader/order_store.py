@@ -0,0 +1,231 @@
+"""
+Storage for the resting orders of a tick_book.TickBook
+
+Every resting order is (side, price tick, scaled size) keyed by its order id.
+Two stores share the same small interface so the book doesn't care which
+one it has:
+
+DictOrderStore: a dict of order_id string -> [is_bid, tick, size].  Simple,
+but every order costs a dict entry, a 36 character string and a list.
+
+CompactOrderStore: a struct-of-arrays store.  Order ids are packed into two
+unsigned 64-bit halves of the UUID, sizes and ticks are plain 64-bit ints,
+freed slots go onto a free-list for reuse, and an open-addressing hash
+table of slot numbers maps ids to slots.  Lookups stay O(1), but every
+access goes through array elements instead of a dict, so it's slower.
+
+benchmarks/order_book_memory.py --synthetic 50000 measures, per resting
+order: 203 bytes for the dict store and 62 for the compact one (about 3.3x
+less), and 463 bytes for the whole sorted book against 94 for a tick book
+with the compact store (about 4.9x less).  Replaying into the tick book
+takes about 2.3x as long with the compact store as with the dict store.
+
+Store interface:
+insert(order_id, is_bid, tick, size)
+pop(order_id) -> (is_bid, tick, size) or None
+reduce(order_id, amount) -> (is_bid, tick) or None
+set_size(order_id, size) -> (is_bid, tick, size_delta) or None
+items() -> iterator of (order_id, is_bid, tick, size), slow, for checks only
+"""
+from array import array
+import uuid
+
+_EMPTY = -1
+_DELETED = -2
+_LOW_BITS = (1 << 64) - 1
+
+
+class DictOrderStore(object):
+    def __init__(self):
+        self._orders = {}
+
+    def __len__(self):
+        return len(self._orders)
+
+    def clear(self):
+        self._orders = {}
+
+    def insert(self, order_id, is_bid, tick, size):
+        self._orders[order_id] = [is_bid, tick, size]
+
+    def pop(self, order_id):
+        resting = self._orders.pop(order_id, None)
+        return None if resting is None else tuple(resting)
+
+    def reduce(self, order_id, amount):
+        resting = self._orders.get(order_id)
+        if resting is None:
+            return None
+        resting[2] -= amount
+        return resting[0], resting[1]
+
+    def set_size(self, order_id, size):
+        resting = self._orders.get(order_id)
+        if resting is None:
+            return None
+        delta = size - resting[2]
+        resting[2] = size
+        return resting[0], resting[1], delta
+
+    def items(self):
+        for order_id, (is_bid, tick, size) in self._orders.items():
+            yield order_id, is_bid, tick, size
+
+
+class CompactOrderStore(object):
+    """Struct-of-arrays order store with a UUID-keyed open-addressing index
+
+    Slot arrays (one entry per order slot):
+    _id_hi, _id_lo: the order id as two unsigned 64-bit halves
+    _tick, _size: price tick and scaled size
+    _is_bid: 1 for bids, 0 for asks
+    _next_free: free-list link for unused slots
+
+    _table holds slot numbers (or _EMPTY/_DELETED) and is probed linearly
+    starting from the low bits of the id, which are random for UUID4 ids.
+    It is rebuilt when more than half of it is in use.
+
+    The stdlib array module is used rather than NumPy since every operation
+    here touches single elements, and array hands back plain Python ints.
+    """
+
+    def __init__(self, capacity=1024):
+        self._capacity = 0
+        self._id_hi = array('Q')
+        self._id_lo = array('Q')
+        self._tick = array('q')
+        self._size = array('q')
+        self._is_bid = array('b')
+        self._next_free = array('i')
+        self._free_head = _EMPTY
+        self._count = 0
+        self._grow(max(capacity, 16))
+        self._rebuild_table(self._capacity * 2)
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self.__init__(capacity=self._capacity)
+
+    @staticmethod
+    def pack_id(order_id):
+        """Split a UUID string into (high, low) 64-bit halves"""
+        value = int(order_id.replace('-', ''), 16)
+        return value >> 64, value & _LOW_BITS
+
+    def _grow(self, new_capacity):
+        old_capacity = self._capacity
+        extra = new_capacity - old_capacity
+        self._id_hi.extend(array('Q', bytes(8 * extra)))
+        self._id_lo.extend(array('Q', bytes(8 * extra)))
+        self._tick.extend(array('q', bytes(8 * extra)))
+        self._size.extend(array('q', bytes(8 * extra)))
+        self._is_bid.extend(array('b', bytes(extra)))
+        #new slots are pushed onto the free-list in order
+        self._next_free.extend(array('i', range(old_capacity + 1, new_capacity + 1)))
+        self._next_free[new_capacity - 1] = self._free_head
+        self._free_head = old_capacity
+        self._capacity = new_capacity
+
+    def _rebuild_table(self, size):
+        table_size = 16
+        while table_size < size:
+            table_size *= 2
+        self._table = array('i', [_EMPTY]) * table_size
+        self._mask = table_size - 1
+        self._table_used = 0   #live entries plus tombstones
+        for slot in self._live_slots():
+            bucket = self._probe_free(self._id_hi[slot], self._id_lo[slot])
+            self._table[bucket] = slot
+            self._table_used += 1
+
+    def _live_slots(self):
+        free = set()
+        slot = self._free_head
+        while slot != _EMPTY:
+            free.add(slot)
+            slot = self._next_free[slot]
+        return (s for s in range(self._capacity) if s not in free)
+
+    def _probe_free(self, hi, lo):
+        table = self._table
+        mask = self._mask
+        bucket = (hi ^ lo) & mask
+        while table[bucket] >= 0:
+            bucket = (bucket + 1) & mask
+        return bucket
+
+    def _find(self, order_id):
+        """Return (bucket, slot) for an order id, or (None, _EMPTY) if it isn't stored"""
+        hi, lo = self.pack_id(order_id)
+        table = self._table
+        mask = self._mask
+        id_lo = self._id_lo
+        bucket = (hi ^ lo) & mask
+        while True:
+            slot = table[bucket]
+            if slot == _EMPTY:
+                return None, _EMPTY
+            if slot >= 0 and id_lo[slot] == lo and self._id_hi[slot] == hi:
+                return bucket, slot
+            bucket = (bucket + 1) & mask
+
+    def insert(self, order_id, is_bid, tick, size):
+        bucket, slot = self._find(order_id)
+        if slot == _EMPTY:
+            if self._free_head == _EMPTY:
+                self._grow(self._capacity * 2)
+            if (self._table_used + 1) * 2 > len(self._table):
+                self._rebuild_table(self._count * 4)
+            slot = self._free_head
+            self._free_head = self._next_free[slot]
+            hi, lo = self.pack_id(order_id)
+            self._id_hi[slot] = hi
+            self._id_lo[slot] = lo
+            bucket = self._probe_free(hi, lo)
+            if self._table[bucket] == _EMPTY:
+                self._table_used += 1
+            self._table[bucket] = slot
+            self._count += 1
+        self._is_bid[slot] = 1 if is_bid else 0
+        self._tick[slot] = tick
+        self._size[slot] = size
+
+    def pop(self, order_id):
+        bucket, slot = self._find(order_id)
+        if slot == _EMPTY:
+            return None
+        self._table[bucket] = _DELETED
+        self._next_free[slot] = self._free_head
+        self._free_head = slot
+        self._count -= 1
+        return self._is_bid[slot] == 1, self._tick[slot], self._size[slot]
+
+    def reduce(self, order_id, amount):
+        bucket, slot = self._find(order_id)
+        if slot == _EMPTY:
+            return None
+        self._size[slot] -= amount
+        return self._is_bid[slot] == 1, self._tick[slot]
+
+    def set_size(self, order_id, size):
+        bucket, slot = self._find(order_id)
+        if slot == _EMPTY:
+            return None
+        delta = size - self._size[slot]
+        self._size[slot] = size
+        return self._is_bid[slot] == 1, self._tick[slot], delta
+
+    def items(self):
+        for slot in self._live_slots():
+            order_id = str(uuid.UUID(int=(self._id_hi[slot] << 64) | self._id_lo[slot]))
+            yield order_id, self._is_bid[slot] == 1, self._tick[slot], self._size[slot]
+
+
+def create_order_store(kind):
+    if kind == 'dict':
+        return DictOrderStore()
+    elif kind == 'compact':
+        return CompactOrderStore()
+    raise ValueError(f"Unknown order store: {kind}")
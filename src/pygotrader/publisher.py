@@ -0,0 +1,115 @@
+"""
+Coalesced publishing of scalar market state to the shared namespace
+
+Every attribute set on a Manager namespace is a blocking call to the Manager
+process, so the feed shouldn't set ns.highest_bid and friends per message.
+A StatePublisher keeps the latest value of each field locally, marks the
+ones that changed as dirty, and copies only those to the namespace when it
+flushes: at most every `interval` seconds, or straight away when a value
+moves by more than `significant_change` (as a fraction of what was last
+published), so a jump in price isn't held back for a whole interval.
+Only the fields listed in `triggers` can force an early flush (all of them
+by default), since e.g. a one tick change in the spread is a big fraction.
+
+Important classes:
+StatePublisher: set() fields as often as you like, maybe_flush() on the hot
+path, flush() to publish unconditionally
+"""
+import numbers
+import time
+from pygotrader.metrics import Histogram, RateMeter
+
+
+class StatePublisher(object):
+    """Publishes dirty fields to ns, coalescing updates between flushes
+
+    Metrics, see snapshot():
+    flushes: RateMeter of flushes that wrote at least one field
+    fields_written: how many namespace attributes were set in total
+    significant_flushes: flushes triggered by a significant change
+    staleness: Histogram of seconds between a field first going dirty and
+    the flush that published it, so its max is the staleness bound consumers
+    actually saw
+    """
+
+    def __init__(self, ns, interval=0.1, significant_change=0.001, triggers=None, clock=time.monotonic):
+        self.ns = ns
+        self.interval = interval
+        self.significant_change = significant_change
+        self.triggers = None if triggers is None else frozenset(triggers)
+        self.clock = clock
+        self.values = {}
+        self._published = {}
+        self._dirty_since = {}   #field -> when it first changed since the last flush
+        self._significant = False
+        self._last_flush = clock()
+        self.flushes = RateMeter()
+        self.fields_written = 0
+        self.significant_flushes = 0
+        self.staleness = Histogram()
+
+    def set(self, field, value):
+        if self.values.get(field, self) == value:
+            return
+        self.values[field] = value
+        if self._published.get(field, self) == value:
+            #changed back before it was published
+            self._dirty_since.pop(field, None)
+            return
+        if field not in self._dirty_since:
+            self._dirty_since[field] = self.clock()
+        if not self._significant and self._is_significant(field, value):
+            self._significant = True
+
+    def _is_significant(self, field, value):
+        if self.significant_change is None:
+            return False
+        if self.triggers is not None and field not in self.triggers:
+            return False
+        published = self._published.get(field)
+        if not isinstance(published, numbers.Number) or not isinstance(value, numbers.Number):
+            #nothing published yet, or a value that can't be compared
+            return True
+        if published == 0:
+            return value != 0
+        return abs(value - published) / abs(published) >= self.significant_change
+
+    @property
+    def dirty(self):
+        return list(self._dirty_since)
+
+    def maybe_flush(self):
+        """Flush if the interval has passed or a value changed significantly.
+        Returns whether anything was written"""
+        if not self._dirty_since:
+            return False
+        if self._significant:
+            self.significant_flushes += 1
+            return self.flush()
+        if self.clock() - self._last_flush >= self.interval:
+            return self.flush()
+        return False
+
+    def flush(self):
+        now = self.clock()
+        self._last_flush = now
+        self._significant = False
+        if not self._dirty_since:
+            return False
+        for field, since in self._dirty_since.items():
+            value = self.values[field]
+            setattr(self.ns, field, value)
+            self._published[field] = value
+            self.staleness.record(now - since)
+        self.fields_written += len(self._dirty_since)
+        self._dirty_since = {}
+        self.flushes.mark()
+        return True
+
+    def snapshot(self):
+        return {'interval': self.interval,
+                'flushes': self.flushes.total,
+                'flushes_per_second': round(self.flushes.rate, 1),
+                'fields_written': self.fields_written,
+                'significant_flushes': self.significant_flushes,
+                'staleness': self.staleness.snapshot()}
@@ -1,29 +1,89 @@
 from cbpro.order_book import OrderBook
+from cbpro.public_client import PublicClient
 from sortedcontainers import SortedDict
+from collections import namedtuple
 from decimal import Decimal
+import math
+import pickle
 import time
 import datetime as dt
 from threading import Thread
 import json
 import multiprocessing
 import asyncio
-import websockets
+from pygotrader.feed import json_loads, receive_batches
+from pygotrader.features import FeatureEngine
+from pygotrader.metrics import FeedStats
+from pygotrader.publisher import StatePublisher
+from pygotrader.shared_state import BUY, SELL
+from pygotrader.tick_book import LevelBook, TickBook
+
+CHANNELS = {'full': ['full'], 'level2': ['level2', 'matches']}
+
+BookState = namedtuple('BookState', ['sequence', 'asks', 'bids', 'ask_sizes', 'bid_sizes', 'tick_book'])
+
+_EPOCH = dt.datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_midnights = {}  #'YYYY-MM-DD' -> epoch seconds at midnight UTC
+
+def parse_timestamp_ns(timestamp):
+    """Convert an exchange timestamp such as '2019-08-14T20:42:27.265Z' to 
+    integer nanoseconds since the epoch
+    
+    The format is fixed, so the fields are sliced out directly instead of going 
+    through datetime.strptime.  The date part changes once a day, so its epoch 
+    offset is cached.
+    """
+    day = timestamp[:10]
+    midnight = _midnights.get(day)
+    if midnight is None:
+        if len(_midnights) > 32:
+            _midnights.clear()
+        ordinal = dt.date(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10])).toordinal()
+        midnight = _midnights[day] = (ordinal - _EPOCH_ORDINAL) * 86400
+    seconds = midnight + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+    if timestamp[19:20] == '.':
+        fraction = timestamp[20:].rstrip('Z')
+        nanoseconds = int(fraction[:9].ljust(9, '0'))
+    else:
+        nanoseconds = 0
+    return seconds * 1000000000 + nanoseconds
+
+def timestamp_ns_to_datetime(timestamp_ns):
+    """Naive UTC datetime for integer epoch nanoseconds (microsecond precision)"""
+    return _EPOCH + dt.timedelta(microseconds=timestamp_ns // 1000)
+
 
 class ExchangeMessage(object):
     """Turns an exchange message into an object so that it can be used 
     for trading algorithms
+    
+    The timestamp is kept as integer epoch nanoseconds in time_ns, and the 
+    time attribute builds a datetime from it only when it is asked for.  Price
+    and sizes are floats.  __slots__ keeps each object small since algorithms
+    can be handed thousands of these.
     """
+    __slots__ = ('sequence', 'time_ns', 'type', 'product_id', 'order_id', 'price',
+                 'side', 'remaining_size', 'size')
+
     def __init__(self, msg):
-        self.sequence = msg["sequence"] if 'sequence' in msg else ""
-        self.time = dt.datetime.strptime(msg["timestamp"], '%Y-%m-%dT%H:%M:%S.%fZ') \
-            if 'timestamp' in msg else dt.datetime.strptime(msg["time"], '%Y-%m-%dT%H:%M:%S.%fZ')
+        get = msg.get
+        self.sequence = get("sequence", "")
+        self.time_ns = parse_timestamp_ns(get("timestamp") or msg["time"])
         self.type = msg["type"]
         self.product_id = msg["product_id"]
-        self.order_id = msg["order_id"] if 'order_id' in msg else None
-        self.price = float(msg["price"]) if 'price' in msg else None
-        self.side = msg["side"] if 'side' in msg else ""
-        self.remaining_size = msg["remaining_size"] if 'remaining_size' in msg else None
-        self.size = msg["size"] if 'size' in msg else None
+        self.order_id = get("order_id")
+        price = get("price")
+        self.price = None if price is None else float(price)
+        self.side = get("side", "")
+        remaining_size = get("remaining_size")
+        self.remaining_size = None if remaining_size is None else float(remaining_size)
+        size = get("size")
+        self.size = None if size is None else float(size)
+
+    @property
+    def time(self):
+        return timestamp_ns_to_datetime(self.time_ns)
 
     def __str__(self):
         print_out = f"ExchangeMessageObject: {self.sequence} {self.side} {self.product_id} {self.size} @ {self.price}"
@@ -39,73 +99,582 @@ class PygoOrderBook(OrderBook):
     - Checking orders from the exchange for user's
     - Handling matches (completed buys/sells)
     - Calculating order depth per price
-    - Updating the _listen method since that's the core of the receive loop
+    - Keeping a running total of the size resting at each price level
+    - Updating the _listen method since that's the core of the receive loop.  It
+      drains every frame that is already buffered and applies them as one batch
+      before publishing anything derived from the book (see on_messages)
     - Adding functionality to handle orders placed by user
     
-    TODO:
-    - Figure out a better way to share ExchangeMessage objects between processes/threads
+    The per-level totals live in _ask_sizes/_bid_sizes (price -> Decimal) and
+    are adjusted in add/remove/match/change, so reading the top N levels
+    doesn't have to walk every order resting at each price.  Pass 
+    check_level_sizes=True to compare them against a full recompute after
+    every message (slow, meant for tests).
+    
+    book_engine selects how the book itself is stored:
+    'sorted' - the inherited SortedDict of Decimal price -> list of order dicts
+    'tick' - a tick_book.TickBook on integer ticks of the product's quote 
+    increment.  The increment is looked up from the exchange unless 
+    quote_increment is given.  Best bid/ask and depth come back as floats.
+    order_store picks how the tick engine keeps resting orders: 'dict', or
+    'compact' for the struct-of-arrays store in order_store.py.
+    
+    channel selects what the book subscribes to:
+    'full' - every order on the full channel, kept in the level-3 book above
+    'level2' - the level2 and matches channels.  The book is a 
+    tick_book.LevelBook of aggregated sizes, rebuilt from the channel's own
+    snapshot and updated from its l2update messages, so there's no REST 
+    snapshot, no sequence checking and no per-order state.  book_engine and
+    order_store are ignored.  Meant for view mode and algorithms that only 
+    need depth and trades.
+    
+    Matches are appended to match_buffer, a shared_state.MatchRingBuffer, as 
+    columns of numbers rather than pickled objects on a Manager list.
+    
+    Sequence numbers are checked on every message.  On a gap (or on the very 
+    first message) the book starts a resync: incoming messages are buffered,
+    a level-3 snapshot is fetched from api_url and built into a new book in
+    an executor thread, and once it's swapped in only the buffered messages
+    newer than the snapshot are applied.  The event loop keeps receiving the
+    whole time.  Outside of an event loop (e.g. replaying a recorded feed) the
+    snapshot is loaded synchronously instead.  A failed snapshot load is
+    retried every resync_retry seconds while the feed keeps being buffered.
+    
+    If a feed_recorder.FeedRecorder is passed as recorder, every websocket 
+    frame and REST response the book uses is written to it (see replay.py).
+    
+    The ids of the user's own orders are kept in a local set, my_order_ids,
+    that the OrderHandler keeps up to date over order_id_channel (see 
+    OrderHandler.add_order_id_listener).  Only messages about those orders
+    touch ns.my_orders, every other message is skipped without any IPC.
+    
+    If a shared_state.SharedRecord is passed as feature_record, a 
+    features.FeatureEngine is updated after every message and its feature
+    vector (microprice, imbalance, order flow imbalance, trade VWAPs, ...) is
+    published to the record along with everything else.
+    
+    update_signal, a shared_state.UpdateSignal, is notified after every 
+    batch so an event-scheduled algorithm can wake up right away.
+    
+    If a shared_state.SharedMarketSnapshot is passed as market_snapshot, the
+    depth, top of book, last trade, sequence number and match buffer cursor
+    are published to it together after every batch that changed the book, 
+    so an algorithm can read all of them as of the same moment.
+    
+    strategy, a colocated.ColocatedStrategy, is handed the book itself after
+    every batch, on the same event loop, without going through another 
+    process (see colocated.py).
+    
+    Best bid/ask, spread, last trade and message rate are kept locally by a
+    publisher.StatePublisher and copied to ns at most every publish_interval
+    seconds, or sooner if one moves by more than significant_change.
     """
-    def __init__(self, ns, product_id='BTC-USD', log_to=None, url='wss://ws-feed.pro.coinbase.com'):
-        super().__init__(product_id=product_id)
+    def __init__(self, ns, product_id='BTC-USD', log_to=None, url='wss://ws-feed.pro.coinbase.com',
+        depth_ladder=None, match_buffer=None, check_level_sizes=False, book_engine='sorted', quote_increment=None, order_store='dict',
+        depth_interval=0.5, max_batch=1000, api_url='https://api.pro.coinbase.com', tick_window=65536,
+        resync_retry=1.0, recorder=None, order_id_channel=None, publish_interval=0.1, significant_change=0.001,
+        channel='full', feature_record=None, update_signal=None, market_snapshot=None,
+        strategy=None):
+        super().__init__(product_id=product_id, log_to=log_to)
+        self._client = PublicClient(api_url=api_url)
         self.url = url
         self.ns = ns
+        self.depth_ladder = depth_ladder
+        self.match_buffer = match_buffer
+        self.check_level_sizes = check_level_sizes
         self.has_started = False
+        self.depth_interval = depth_interval
+        self.max_batch = max_batch
+        self.stats = FeedStats()
+        self.stats_interval = 1.0
+        self.publisher = StatePublisher(ns, interval=publish_interval, significant_change=significant_change,
+                                        triggers=('highest_bid', 'lowest_ask', 'last_match'))
+        self._last_depth_publish = 0.0
+        self._last_stats_publish = 0.0
+        self._ask_sizes = {}
+        self._bid_sizes = {}
+        if book_engine not in ('sorted', 'tick'):
+            raise ValueError(f"Unknown book engine: {book_engine}")
+        self.book_engine = book_engine
+        if channel not in CHANNELS:
+            raise ValueError(f"Unknown channel: {channel}")
+        self.channel = channel
+        self.channels = CHANNELS[channel]
+        self.quote_increment = quote_increment
+        self.order_store = order_store
+        self.tick_window = tick_window
+        self.tick_book = None
+        self.resync_retry = resync_retry
+        self.recorder = recorder
+        self.order_id_channel = order_id_channel
+        self.feature_record = feature_record
+        self.update_signal = update_signal
+        self.market_snapshot = market_snapshot
+        self._snapshot_dirty = True
+        self.strategy = strategy
+        self.features = None
+        if feature_record is not None:
+            self.features = FeatureEngine()
+            if tuple(feature_record.fields) != self.features.fields:
+                raise ValueError("The feature record's fields don't match the feature engine's")
+        self.my_order_ids = set()
+        self._expected_client_oids = {}   #client_oid -> when it was expected, oldest first
+        self.expect_timeout = 60.0   #seconds to wait for an expected order's 'received' message
+        self._resync_buffer = None   #messages held back while a snapshot loads
+        self._resync_started = None
+
+    @property
+    def product_id(self):
+        """products is a plain string until the websocket client connects"""
+        return self.products if isinstance(self.products, str) else self.products[0]
 
     def on_message(self, message):
-        super().on_message(message)
+        self.read_order_id_updates()
+        self.apply_message(message)
+        self.publish_state()
+        if self.update_signal is not None:
+            self.update_signal.notify()
+        if self.strategy is not None:
+            self.strategy.on_update(self, [message])
+
+    def on_messages(self, messages):
+        """Apply a batch of messages, then publish derived state once"""
+        self.read_order_id_updates()
+        for message in messages:
+            self.apply_message(message)
+        self.publish_state()
+        if messages and self.update_signal is not None:
+            self.update_signal.notify()
+        if messages and self.strategy is not None:
+            self.strategy.on_update(self, messages)
+
+    def apply_message(self, message):
+        """Update the book (and our own orders) without publishing anything"""
+        self._snapshot_dirty = True
+        if self._log_to:
+            pickle.dump(message, self._log_to)
+        if self.channel == 'level2':
+            self._apply_level2(message)
+        elif self._resync_buffer is not None:
+            self._resync_buffer.append(message)
+        else:
+            self._apply_sequenced(message)
         self.handle_my_order(message) 
-        self.ns.highest_bid = self.get_bid()
+
+    def _apply_level2(self, message):
+        msg_type = message.get('type')
+        if msg_type == 'l2update':
+            if self.tick_book is not None:
+                self.tick_book.update(message['changes'])
+        elif msg_type == 'snapshot':
+            level_book = LevelBook(self.get_quote_increment(), window=self.tick_window)
+            level_book.load(message)
+            self.tick_book = level_book
+            if self.features is not None:
+                self.features.reset()
+        elif msg_type in ('match', 'last_match'):
+            self.record_match(message)
+            return
+        else:
+            return
+        if self.features is not None:
+            self.update_features(message)
+
+    def update_features(self, message):
+        """Pass the book's new top levels to the feature engine"""
+        features = self.features
+        top = self.get_top_of_book()
+        if top == features.top:
+            #only the deeper levels changed
+            features.changed = True
+            return
+        timestamp = message.get('time')
+        ts_ns = parse_timestamp_ns(timestamp) if timestamp else time.time_ns()
+        features.on_top_of_book(ts_ns, *top)
+
+    def _apply_sequenced(self, message):
+        sequence = message.get('sequence', -1)
+        if self._sequence == -1:
+            self._resync_buffer = [message]
+            self.start_resync()
+            return
+        if sequence <= self._sequence:
+            #older than the book, e.g. from before the snapshot was taken
+            return
+        elif sequence > self._sequence + 1:
+            self._resync_buffer = [message]
+            self.on_sequence_gap(self._sequence, sequence)
+            return
+
+        msg_type = message['type']
+        if msg_type == 'open':
+            self.add(message)
+        elif msg_type == 'done' and 'price' in message:
+            self.remove(message)
+        elif msg_type == 'match':
+            self.match(message)
+            self._current_ticker = message
+        elif msg_type == 'change':
+            self.change(message)
+        self._sequence = sequence
+        if self.features is not None and msg_type != 'received':
+            self.update_features(message)
+        if self.check_level_sizes:
+            self.verify_level_sizes()
+
+    def on_sequence_gap(self, gap_start, gap_end):
+        self.stats.gaps += 1
+        self.stats.missed_messages += gap_end - gap_start - 1
+        self.start_resync()
+
+    @property
+    def resyncing(self):
+        return self._resync_buffer is not None
+
+    def start_resync(self):
+        """Load a fresh snapshot, in an executor thread if there's a running loop"""
+        if self._resync_buffer is None:
+            self._resync_buffer = []
+        self._resync_started = time.monotonic()
+        self.stats.resyncing = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.finish_resync(self.load_snapshot())
+        else:
+            self._request_snapshot(loop)
+
+    def _request_snapshot(self, loop):
+        future = loop.run_in_executor(None, self.load_snapshot)
+        future.add_done_callback(lambda f: self._on_snapshot_loaded(loop, f))
+
+    def _on_snapshot_loaded(self, loop, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.stats.resync_failures += 1
+            self.on_error(future.exception())
+            loop.call_later(self.resync_retry, self._request_snapshot, loop)
+            return
+        self.finish_resync(future.result())
+        self.publish_state(force=True)
+
+    def load_snapshot(self):
+        """Fetch a level-3 snapshot and build a BookState from it
         
+        Doesn't touch the live book, so it's safe to run in another thread.
+        """
+        res = self._client.get_product_order_book(product_id=self.product_id, level=3)
+        if self.recorder is not None:
+            self.recorder.record_snapshot(res, product_id=self.product_id)
+        asks, bids, ask_sizes, bid_sizes = SortedDict(), SortedDict(), {}, {}
+        tick_book = None
+        if self.book_engine == 'tick':
+            tick_book = TickBook(self.get_quote_increment(), window=self.tick_window, order_store=self.order_store)
+        for side, entries, book, level_sizes in (('buy', res['bids'], bids, bid_sizes),
+                                                 ('sell', res['asks'], asks, ask_sizes)):
+            for price, size, order_id in entries:
+                order = {'id': order_id, 'side': side, 'price': Decimal(price), 'size': Decimal(size)}
+                if tick_book is not None:
+                    tick_book.add(order)
+                    continue
+                price = order['price']
+                orders = book.get(price)
+                if orders is None:
+                    book[price] = [order]
+                    level_sizes[price] = order['size']
+                else:
+                    orders.append(order)
+                    level_sizes[price] += order['size']
+        return BookState(res['sequence'], asks, bids, ask_sizes, bid_sizes, tick_book)
+
+    def finish_resync(self, state):
+        """Swap in a freshly built book and replay what was buffered meanwhile"""
+        self._asks = state.asks
+        self._bids = state.bids
+        self._ask_sizes = state.ask_sizes
+        self._bid_sizes = state.bid_sizes
+        self.tick_book = state.tick_book
+        self._sequence = state.sequence
+        if self.features is not None:
+            self.features.reset()
+        buffered = self._resync_buffer or []
+        self._resync_buffer = None
+        self.stats.resyncing = False
+        self.stats.record_resync(time.monotonic() - self._resync_started)
+        for i, message in enumerate(buffered):
+            if self._resync_buffer is not None:
+                #another gap in the buffered messages, wait for the next snapshot
+                self._resync_buffer.extend(buffered[i:])
+                break
+            self._apply_sequenced(message)
+
+    def publish_state(self, force=False):
+        """Copy state derived from the book out to the other processes
+        
+        Scalar state goes through the publisher, and the depth ladder and feed
+        stats go out at most every depth_interval and stats_interval seconds,
+        unless force is set.
+        """
+        bid = self.get_bid()
+        ask = self.get_ask()
+        publisher = self.publisher
+        publisher.set('highest_bid', bid)
+        publisher.set('lowest_ask', ask)
+        publisher.set('spread', ask - bid if bid is not None and ask is not None else None)
+        publisher.set('message_rate', self.stats.messages.rate)
+        if force:
+            publisher.flush()
+        else:
+            publisher.maybe_flush()
+        if self.features is not None and (force or self.features.changed):
+            levels = self.features.levels
+            ask_prices, ask_sizes, bid_prices, bid_sizes = self.get_depth(levels, levels)
+            self.feature_record.publish(self.features.values(ask_sizes, bid_sizes))
+        if self.market_snapshot is not None and (force or self._snapshot_dirty):
+            self.publish_snapshot()
+        now = time.time()
+        if force or now - self._last_depth_publish >= self.depth_interval:
+            self.calculate_order_depth()
+            self._last_depth_publish = now
+        if force or now - self._last_stats_publish >= self.stats_interval:
+            self.ns.feed_stats = dict(self.stats.snapshot(), publisher=publisher.snapshot())
+            self._last_stats_publish = now
+
+    def publish_snapshot(self):
+        """Publish the book, last trade and match cursor as one market snapshot"""
+        snapshot = self.market_snapshot
+        last_match = self.publisher.values.get('last_match')
+        if self.match_buffer is not None:
+            match_cursor = self.match_buffer.cursor
+            now_ns = self.match_buffer.clock()
+        else:
+            match_cursor = 0
+            now_ns = time.time_ns()
+        snapshot.publish(*self.get_depth(snapshot.levels, snapshot.levels),
+                         sequence=-1 if self.channel == 'level2' else self._sequence,
+                         last_price=math.nan if last_match is None else last_match,
+                         match_cursor=match_cursor, time_ns=now_ns)
+        self._snapshot_dirty = False
+
+    def reset_book(self):
+        """Synchronously reload the book from a snapshot, dropping anything buffered"""
+        self._resync_buffer = None
+        self._resync_started = time.monotonic()
+        self.finish_resync(self.load_snapshot())
+
+    def get_quote_increment(self):
+        if self.quote_increment is None:
+            products = self._client.get_products()
+            if self.recorder is not None:
+                self.recorder.record_products(products)
+            for product in products:
+                if product['id'] == self.product_id:
+                    self.quote_increment = product['quote_increment']
+                    break
+            else:
+                raise ValueError(f"Unable to find the quote increment for {self.product_id}")
+        return self.quote_increment
+
+    def _level_sizes(self, side):
+        return self._bid_sizes if side == 'buy' else self._ask_sizes
+
+    def _level_orders(self, side, price):
+        return self.get_bids(price) if side == 'buy' else self.get_asks(price)
+
+    def _resting_size(self, side, price, order_id):
+        """Size of a resting order, or None if it isn't in the book"""
+        orders = self._level_orders(side, price)
+        if orders:
+            for o in orders:
+                if o['id'] == order_id:
+                    return o['size']
+        return None
+
+    def _adjust_level_size(self, side, price, delta):
+        level_sizes = self._level_sizes(side)
+        if self._level_orders(side, price) is None:
+            level_sizes.pop(price, None)
+        else:
+            level_sizes[price] = level_sizes.get(price, 0) + delta
+
+    def add(self, order):
+        if self.tick_book is not None:
+            self.tick_book.add(order)
+            return
+        super().add(order)
+        size = Decimal(order.get('size') or order['remaining_size'])
+        self._adjust_level_size(order['side'], Decimal(order['price']), size)
+
+    def remove(self, order):
+        if self.tick_book is not None:
+            self.tick_book.remove(order)
+            return
+        price = Decimal(order['price'])
+        size = self._resting_size(order['side'], price, order['order_id'])
+        super().remove(order)
+        self._adjust_level_size(order['side'], price, -(size or 0))
+
     def match(self, order):
-        super().match(order)
-        message_object = ExchangeMessage(order)
-        self.ns.exchange_order_matches.append(message_object)
-        self.ns.last_match = message_object.price
-
-    def calculate_order_depth(self,max_asks=10,max_bids=10):
-        if len(self._asks) < max_asks:
-            max_asks = len(self._asks)
-        for x in range(0,max_asks):
-            price = self._asks.iloc[x]
-            depth = sum(a['size'] for a in self._asks[price])
-            self.ns.ui_asks[x] = {'price':price,'depth':depth}
-
-        if len(self._bids) < max_bids:
-            max_bids = len(self._bids)
-        i=0
-        for bid in reversed(self._bids):
-            if i == max_bids:
+        if self.tick_book is not None:
+            self.tick_book.match(order)
+        else:
+            price = Decimal(order['price'])
+            had_orders = bool(self._level_orders(order['side'], price))
+            super().match(order)
+            if had_orders:
+                self._adjust_level_size(order['side'], price, -Decimal(order['size']))
+        self.record_match(order)
+
+    def record_match(self, order):
+        """Add a trade to the match buffer and the last price"""
+        price = float(order['price'])
+        if self.match_buffer is not None or self.features is not None:
+            ts_ns = parse_timestamp_ns(order.get('timestamp') or order['time'])
+            size = float(order['size'])
+            if self.match_buffer is not None:
+                self.match_buffer.append(order.get('sequence', 0), ts_ns, price, size,
+                                         BUY if order['side'] == 'buy' else SELL)
+            if self.features is not None:
+                self.features.on_trade(ts_ns, price, size)
+        self.publisher.set('last_match', price)
+
+    def change(self, order):
+        if self.tick_book is not None:
+            self.tick_book.change(order)
+            return
+        if 'new_size' not in order or 'price' not in order:
+            super().change(order)
+            return
+        price = Decimal(order['price'])
+        old_size = self._resting_size(order['side'], price, order['order_id'])
+        super().change(order)
+        if old_size is not None:
+            self._adjust_level_size(order['side'], price, Decimal(order['new_size']) - old_size)
+
+    def verify_level_sizes(self):
+        """Check the running per-level totals against a full recompute
+        
+        Raises an AssertionError describing the first mismatch.
+        """
+        if self.tick_book is not None:
+            self.tick_book.verify()
+            return
+        for side, book, level_sizes in (('sell', self._asks, self._ask_sizes),
+                                        ('buy', self._bids, self._bid_sizes)):
+            assert len(book) == len(level_sizes), \
+                f"{side}: {len(book)} price levels but {len(level_sizes)} running totals"
+            for price, orders in book.items():
+                expected = sum(o['size'] for o in orders)
+                actual = level_sizes.get(price)
+                assert actual == expected, f"{side} {price}: running total {actual}, recomputed {expected}"
+
+    def get_depth(self, max_asks=10, max_bids=10):
+        """Return the top ask and bid levels, best first, as 
+        (ask_prices, ask_sizes, bid_prices, bid_sizes)
+        
+        Levels with nothing left resting at them are skipped.
+        """
+        if self.tick_book is not None:
+            return self.tick_book.get_depth(max_asks, max_bids)
+        ask_prices, ask_sizes = self._top_levels(iter(self._asks), self._ask_sizes, max_asks)
+        bid_prices, bid_sizes = self._top_levels(reversed(self._bids), self._bid_sizes, max_bids)
+        return ask_prices, ask_sizes, bid_prices, bid_sizes
+
+    def get_top_of_book(self):
+        """Return (bid, bid size, ask, ask size) as floats, None for an empty side"""
+        if self.tick_book is not None:
+            return self.tick_book.get_top_of_book()
+        top = []
+        for book, level_sizes, index in ((self._bids, self._bid_sizes, -1), (self._asks, self._ask_sizes, 0)):
+            if book:
+                price = book.peekitem(index)[0]
+                top += [float(price), float(level_sizes.get(price, 0))]
+            else:
+                top += [None, None]
+        return tuple(top)
+
+    def get_bid(self):
+        if self.tick_book is not None:
+            return self.tick_book.get_bid()
+        return super().get_bid() if self._bids else None
+
+    def get_ask(self):
+        if self.tick_book is not None:
+            return self.tick_book.get_ask()
+        return super().get_ask() if self._asks else None
+
+    def _top_levels(self, prices, level_sizes, max_levels):
+        top_prices = []
+        top_sizes = []
+        for price in prices:
+            if len(top_prices) == max_levels:
                 break
-            price = bid
-            depth = sum(b['size'] for b in self._bids[bid])
-            self.ns.ui_bids[i] = {'price':price,'depth':depth}
-            i=i+1
+            size = level_sizes[price]
+            if size:
+                top_prices.append(price)
+                top_sizes.append(size)
+        return top_prices, top_sizes
+
+    def calculate_order_depth(self,max_asks=None,max_bids=None):
+        """Publish the top ask and bid levels to the shared depth ladder
+        
+        By default as many levels as the ladder holds are published.  This is
+        one shared memory write instead of a Manager proxy call per level.
+        """
+        if self.depth_ladder is None:
+            return
+        if max_asks is None:
+            max_asks = self.depth_ladder.levels
+        if max_bids is None:
+            max_bids = self.depth_ladder.levels
+
+        self.depth_ladder.publish(*self.get_depth(max_asks, max_bids))
 
     async def _listen(self,sub_params):
         """
         Overriding the grandparent's (WebsocketClient) listen method
-        in order to calculate the order depth and copy the data to the 
-        shared namespace for the TUI to display
+        in order to apply messages in batches and copy the derived data to 
+        the shared namespace and shared memory for the TUI to display
+        
+        feed.receive_batches hands over everything that has piled up since
+        the last batch (up to max_batch frames).  It's decoded and applied to
+        the book and only then published, so a burst of messages costs one 
+        publish instead of one per message.
         """        
-        async with websockets.connect(self.url) as websocket:
-            await websocket.send(json.dumps(sub_params))
-            # self.keepalive.start()
-            start_time = time.time()
-            while not self.shutdown_event.is_set():
-                try:
-                    now = time.time()
-                    if((now - start_time) > 0.5):
-                        self.calculate_order_depth()
-                        start_time = now                    
-                    data = await websocket.recv()
-                    msg = json.loads(data)
-                except ValueError as e:
-                    self.on_error(e)
-                except Exception as e:
-                    self.on_error(e)
-                else:
-                    self.on_message(msg)    
+        try:
+            await receive_batches(self.url, sub_params, self.shutdown_event, self._handle_frames,
+                                  on_idle=self.publish_state, idle_timeout=self.depth_interval,
+                                  max_batch=self.max_batch, recorder=self.recorder)
+            #the connection went away, but what was already received can
+            #still be applied once a pending snapshot arrives
+            while self.resyncing and not self.shutdown_event.is_set():
+                await asyncio.sleep(0.01)
+        finally:
+            self.publish_state(force=True)
 
+    def _handle_frames(self, frames):
+        """Decode and apply a batch of raw frames.  Returns False once the 
+        connection has gone away."""
+        messages = []
+        connected = True
+        for data in frames:
+            if isinstance(data, Exception):
+                self.on_error(data)
+                connected = False
+                break
+            try:
+                messages.append(json_loads(data))
+            except ValueError as e:
+                self.stats.decode_errors += 1
+                self.on_error(e, data)
+        if messages:
+            self.stats.record_batch(len(messages))
+        try:
+            self.on_messages(messages)
+        except Exception as e:
+            self.on_error(e)
+        return connected
 
     def on_open(self):
         super()
@@ -127,11 +696,46 @@ class PygoOrderBook(OrderBook):
         except ValueError:
             pass
         
+    def read_order_id_updates(self):
+        """Apply every update the OrderHandler has sent since the last call
+        
+        Updates are (action, ids) tuples, action being one of:
+        'add'/'remove': ids of our orders that were placed or went away
+        'replace': the complete set of our open order ids
+        'expect': client_oids of orders about to be placed, so their 
+        'received' message can be matched before the REST call returns
+        """
+        channel = self.order_id_channel
+        if channel is None:
+            return
+        try:
+            while channel.poll():
+                self.update_my_order_ids(*channel.recv())
+        except (EOFError, OSError):
+            #the order handler has gone away
+            self.order_id_channel = None
+
+    def update_my_order_ids(self, action, ids):
+        """Apply one (action, ids) update, see read_order_id_updates"""
+        if action == 'add':
+            self.my_order_ids.update(ids)
+        elif action == 'remove':
+            self.my_order_ids.difference_update(ids)
+        elif action == 'replace':
+            self.my_order_ids = set(ids)
+        elif action == 'expect' and self.channel == 'full':
+            #only the full channel has 'received' messages to match them with
+            now = time.monotonic()
+            expected = self._expected_client_oids
+            #forget the ones that never showed up, rejected or dropped orders
+            for client_oid, since in list(expected.items()):
+                if now - since < self.expect_timeout:
+                    break
+                del expected[client_oid]
+            expected.update(dict.fromkeys(ids, now))
+
     def lookup_my_order(self, order_id):
-        if order_id in self.ns.my_orders:
-            return True
-        else:
-            return False
+        return order_id in self.my_order_ids
             
     def update_my_order(self, order_id, order):
         self.ns.my_orders.update({order_id:order})
@@ -171,6 +775,11 @@ class PygoOrderBook(OrderBook):
         else:
             return        
                 
+        if self._expected_client_oids and message.get('client_oid') in self._expected_client_oids:
+            #one of ours, placed but not yet known by its order id
+            del self._expected_client_oids[message['client_oid']]
+            self.my_order_ids.add(order_id)
+            return
         
         if(self.lookup_my_order(order_id)):
             myorder = self.convert_message_to_order(message)
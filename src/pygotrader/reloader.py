@@ -0,0 +1,220 @@
+"""
+Loading new versions of the algorithm file while the algorithm keeps running
+
+A FileWatcher notices when the algorithm file is saved.  On Linux it uses
+inotify (through ctypes, no extra packages) on the file's directory, so it
+also catches editors that save by writing a temporary file and renaming it
+over the original.  Only finished writes count (close after writing, or a
+rename into place), so a half-saved file doesn't trigger a reload.  Where
+inotify isn't available it falls back to checking the file's modification
+time, size and inode every poll_interval seconds.
+
+An AlgorithmReloader runs the watcher on a background thread.  When the file
+changes, the new version is compiled and executed as a fresh module and
+checked (it has to define a callable trading_algorithm whose arguments can
+be worked out) without touching the version that's running.  The result
+waits in the reloader until the trading loop take()s it between ticks, so
+swapping versions is a single assignment and a version that doesn't load is
+never swapped in.
+
+Important classes/functions:
+load_module: execute a file as a new module, without touching sys.modules
+FileWatcher: wait() for the file to change
+AlgorithmReloader: load() a version now, or start() watching and take()
+    whatever was loaded since
+"""
+from collections import namedtuple
+import ctypes
+import ctypes.util
+import importlib.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import traceback
+
+from pygotrader.metrics import ReloadStats
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')   #wd, mask, cookie, len, followed by the name
+
+LoadedAlgorithm = namedtuple('LoadedAlgorithm', ['module', 'kwargs', 'seconds', 'error'])
+
+
+def load_module(path, name='algorithm'):
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None:
+        raise ImportError(f"Can't load {path} as a Python module")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _inotify():
+    """Return libc if it has inotify, otherwise None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher(object):
+    """Notices when a file has been written to or replaced"""
+
+    def __init__(self, path, poll_interval=1.0, use_inotify=True):
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        self._name = os.fsencode(os.path.basename(self.path))
+        self._fd = None
+        self._last_stat = self._stat()
+        libc = _inotify() if use_inotify else None
+        if libc is not None:
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd >= 0:
+                mask = _IN_CLOSE_WRITE | _IN_MOVED_TO
+                if libc.inotify_add_watch(fd, os.fsencode(os.path.dirname(self.path)), mask) >= 0:
+                    self._fd = fd
+                else:
+                    os.close(fd)
+        self.mode = 'inotify' if self._fd is not None else 'poll'
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _read_events(self):
+        """Return whether any pending event was about our file"""
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name == self._name:
+                    changed = True
+
+    def wait(self, timeout=None):
+        """Wait up to timeout seconds for the file to change.  Returns whether it did"""
+        if self._fd is not None:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                ready, _, _ = select.select([self._fd], [], [], remaining)
+                if ready and self._read_events():
+                    return True
+                if not ready:
+                    return False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._stat()
+            if current != self._last_stat:
+                self._last_stat = current
+                return current is not None
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval if deadline is None else
+                       max(min(self.poll_interval, deadline - time.monotonic()), 0))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class AlgorithmReloader(object):
+    """Loads new versions of the algorithm file off the trading loop
+
+    available is the dict of arguments the handler can offer trading_algorithm
+    (see algorithm_handler.algorithm_arguments), used to check a version and
+    work out its kwargs ahead of time.  `settle` seconds after a change is
+    noticed, any further changes are folded into the same reload, since some
+    editors save in several steps.
+
+    Important methods:
+    load: compile and check the file now, returning a LoadedAlgorithm
+    start, close: run the watcher thread
+    take: the LoadedAlgorithm loaded since the last take, or None.  Its
+        error is set (and module is None) if the new version didn't load
+    """
+
+    def __init__(self, path, available, poll_interval=1.0, settle=0.05, use_inotify=True):
+        self.path = path
+        self.available = available
+        self.settle = settle
+        self.watcher = FileWatcher(path, poll_interval=poll_interval, use_inotify=use_inotify)
+        self.stats = ReloadStats(mode=self.watcher.mode)
+        self.ready = threading.Event()
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._loads = 0
+
+    def load(self):
+        #imported here since algorithm_handler imports this module
+        from pygotrader.algorithm_handler import algorithm_arguments
+        start = time.perf_counter()
+        self._loads += 1
+        try:
+            module = load_module(self.path, f'algorithm_v{self._loads}')
+            function = getattr(module, 'trading_algorithm', None)
+            if not callable(function):
+                raise AttributeError(f"{self.path} has no trading_algorithm() function")
+            kwargs = algorithm_arguments(function, self.available)
+        except Exception:
+            self.stats.failures += 1
+            return LoadedAlgorithm(None, None, time.perf_counter() - start, traceback.format_exc())
+        seconds = time.perf_counter() - start
+        self.stats.load_time.record(seconds)
+        return LoadedAlgorithm(module, kwargs, seconds, None)
+
+    def _offer(self, loaded):
+        with self._lock:
+            self._pending = loaded
+            self.ready.set()
+
+    def take(self):
+        if not self.ready.is_set():
+            return None
+        with self._lock:
+            loaded, self._pending = self._pending, None
+            self.ready.clear()
+        return loaded
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.watcher.wait(0.5):
+                continue
+            if self.settle:
+                while self.watcher.wait(self.settle):
+                    pass
+            self._offer(self.load())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.watcher.close()
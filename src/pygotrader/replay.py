@@ -0,0 +1,347 @@
+"""
+Playing back a feed recorded with feed_recorder.FeedRecorder
+
+A recording can be replayed into a PygoOrderBook two ways, neither of which
+touches the network:
+
+replay_direct: calls book.on_message for each recorded frame.  The book's
+REST client is swapped for the FeedReplay, which hands out the recorded
+snapshots, so the book goes through the same resyncs it did live.
+
+ReplayServer: a local websocket server sending the recorded frames plus an
+HTTP server answering the book's REST requests from the recording.  Point
+a book (or the whole program, see --replay) at its url and api_url to run
+the normal receive loop against a recorded market day.
+
+Both can replay as fast as possible (speed=None) or paced by the recorded
+receive times, where speed=1.0 is wall-clock pace and speed=10 is ten times
+faster.
+
+Running this module replays a recording and reports throughput:
+    python -m pygotrader.replay FEED_FILE [--speed X] [--via server] [--profile OUT]
+"""
+from argparse import ArgumentParser
+from collections import deque
+import asyncio
+import cProfile
+import http.server
+import json
+import threading
+import time
+import types
+
+from pygotrader import pygo_order_book, shared_state
+from pygotrader.feed_recorder import FRAME, PRODUCTS, SNAPSHOT, read_feed
+
+
+class _Pacer(object):
+    """Works out how long to wait before sending a frame received at recv_ns"""
+
+    def __init__(self, speed=None):
+        self.speed = speed
+        self._start = None
+
+    def delay(self, recv_ns):
+        if not self.speed:
+            return 0.0
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = (recv_ns, now)
+        first_ns, started = self._start
+        return started + (recv_ns - first_ns) / 1e9 / self.speed - now
+
+
+class FeedReplay(object):
+    """A recording being played back, which also stands in for the REST client
+
+    frames() walks through the recorded frames.  get_product_order_book hands
+    out each product's recorded snapshots in order, one per call, since a 
+    replayed book runs into the same gaps as the live one did.  If the book
+    asks before frames() has reached the next snapshot (always the case when
+    replaying directly), it's read ahead of the frames recorded while it 
+    loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._records = read_feed(path)
+        self._ahead = deque()
+        self._snapshots = {}   #product_id -> snapshots frames() went past before anyone asked
+        self._lock = threading.Lock()
+        self._products = None
+
+    def _next_record(self):
+        with self._lock:
+            if self._ahead:
+                return self._ahead.popleft()
+            return next(self._records, None)
+
+    def _find_ahead(self, kind, product_id=None):
+        """Remove and return the decoded payload of the next record of a kind
+        (for product_id, if given), or None"""
+        def matches(record):
+            if record.kind != kind:
+                return False
+            payload = json.loads(record.payload)
+            if product_id is not None and payload.get('product_id', product_id) != product_id:
+                return False
+            return True
+
+        with self._lock:
+            for i, record in enumerate(self._ahead):
+                if matches(record):
+                    del self._ahead[i]
+                    return json.loads(record.payload)
+            for record in self._records:
+                if matches(record):
+                    return json.loads(record.payload)
+                self._ahead.append(record)
+        return None
+
+    def _passed_snapshot(self, payload):
+        snapshot = json.loads(payload)
+        self._snapshots.setdefault(snapshot.get('product_id'), deque()).append(snapshot)
+
+    def frames(self, speed=None):
+        """Yield the recorded frames (as bytes), paced if a speed is given"""
+        for _, payload in self.timed_frames(speed):
+            yield payload
+
+    def timed_frames(self, speed=None):
+        """Same as frames(), yielding (receive time in epoch ns, frame)"""
+        pacer = _Pacer(speed)
+        while True:
+            record = self._next_record()
+            if record is None:
+                return
+            if record.kind == FRAME:
+                delay = pacer.delay(record.recv_ns)
+                if delay > 0:
+                    time.sleep(delay)
+                yield record.recv_ns, record.payload
+            elif record.kind == SNAPSHOT:
+                self._passed_snapshot(record.payload)
+            elif record.kind == PRODUCTS and self._products is None:
+                self._products = json.loads(record.payload)
+
+    async def async_frames(self, speed=None):
+        """Same as frames(), sleeping on the event loop instead"""
+        pacer = _Pacer(speed)
+        while True:
+            record = self._next_record()
+            if record is None:
+                return
+            if record.kind == FRAME:
+                delay = pacer.delay(record.recv_ns)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield record.payload
+            elif record.kind == SNAPSHOT:
+                self._passed_snapshot(record.payload)
+            elif record.kind == PRODUCTS and self._products is None:
+                self._products = json.loads(record.payload)
+
+    def get_product_order_book(self, product_id, level=3):
+        for key in (product_id, None):
+            if self._snapshots.get(key):
+                return self._snapshots[key].popleft()
+        snapshot = self._find_ahead(SNAPSHOT, product_id)
+        if snapshot is None:
+            raise ValueError(f"No snapshots of {product_id} left in {self.path}")
+        return snapshot
+
+    def get_products(self):
+        if self._products is None:
+            self._products = self._find_ahead(PRODUCTS) or []
+        return self._products
+
+
+def replay_direct(book, path, speed=None):
+    """Replay a recording into book.on_message.  Returns the number of frames"""
+    replay = FeedReplay(path)
+    book._client = replay
+    count = 0
+    for frame in replay.frames(speed):
+        count += 1
+        try:
+            message = pygo_order_book.json_loads(frame)
+        except ValueError as e:
+            book.stats.decode_errors += 1
+            book.on_error(e, frame)
+            continue
+        book.on_message(message)
+    book.publish_state(force=True)
+    return count
+
+
+class ReplayServer(object):
+    """Local websocket and REST stand-ins serving a recording
+
+    Meant for a single client: the snapshots served over HTTP follow the
+    position of the websocket replay.  When every frame has been sent,
+    `finished` is set and the websocket is closed, unless hold_open is set,
+    in which case it stays open until the client goes away.
+
+    Important methods:
+    serve: async context manager running both servers on the current loop
+    start: runs serve() on a background thread, for use from sync code
+    """
+
+    def __init__(self, path, speed=None, host='127.0.0.1', hold_open=False):
+        self.replay = FeedReplay(path)
+        self.speed = speed
+        self.host = host
+        self.hold_open = hold_open
+        self.frames_sent = 0
+        self.finished = threading.Event()
+        self.url = None
+        self.api_url = None
+        self._http = None
+        self._thread = None
+        self._stop = None
+
+    async def _handler(self, websocket):
+        await websocket.recv()   #subscribe message
+        async for frame in self.replay.async_frames(self.speed):
+            await websocket.send(frame.decode())
+            self.frames_sent += 1
+        self.finished.set()
+        if self.hold_open:
+            await websocket.wait_closed()
+
+    def _start_http(self):
+        replay = self.replay
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0].rstrip('/')
+                try:
+                    if path == '/products':
+                        body = replay.get_products()
+                    elif path.startswith('/products/') and path.endswith('/book'):
+                        body = replay.get_product_order_book(path.split('/')[2])
+                    else:
+                        raise ValueError(f"Not recorded: {path}")
+                    status = 200
+                except ValueError as e:
+                    status, body = 404, {'message': str(e)}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._http = http.server.ThreadingHTTPServer((self.host, 0), Handler)
+        threading.Thread(target=self._http.serve_forever, daemon=True).start()
+        self.api_url = f'http://{self.host}:{self._http.server_address[1]}'
+
+    def serve(self):
+        import contextlib
+        import websockets
+
+        @contextlib.asynccontextmanager
+        async def serving():
+            self._start_http()
+            try:
+                async with websockets.serve(self._handler, self.host, 0) as server:
+                    self.url = f'ws://{self.host}:{server.sockets[0].getsockname()[1]}'
+                    yield self
+            finally:
+                self._http.shutdown()
+                self._http.server_close()
+        return serving()
+
+    def start(self):
+        """Run the servers on a background thread.  Returns once they're listening"""
+        ready = threading.Event()
+
+        async def run():
+            self._stop = asyncio.Event()
+            async with self.serve():
+                ready.set()
+                await self._stop.wait()
+
+        def target():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(run())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def close(self):
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._thread.join()
+            self._thread = None
+
+
+def create_namespace():
+    return types.SimpleNamespace(highest_bid=0.00, last_match=0.00, lowest_ask=0.00, message='',
+                                 my_orders={}, feed_stats={})
+
+def main():
+    parser = ArgumentParser(description="Replay a recorded feed into the order book and report throughput")
+    parser.add_argument("feed", help="Recording made with --record")
+    parser.add_argument("--product", default='BTC-USD')
+    parser.add_argument("--speed", type=float, default=None,
+        help="Playback speed relative to the recording, e.g. 1 for wall-clock pace. Default is as fast as possible")
+    parser.add_argument("--via", choices=['direct', 'server'], default='direct',
+        help="Call on_message directly, or go through a local websocket/REST stand-in")
+    parser.add_argument("--book_engine", choices=['sorted', 'tick'], default='sorted')
+    parser.add_argument("--order_store", choices=['dict', 'compact'], default='dict')
+    parser.add_argument("--quote_increment", default=None)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--profile", metavar="OUT", help="Write cProfile stats of the replay to OUT")
+    args = parser.parse_args()
+
+    depth_ladder = shared_state.SharedDepthLadder(levels=args.depth)
+    match_buffer = shared_state.MatchRingBuffer()
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        book = pygo_order_book.PygoOrderBook(create_namespace(), product_id=args.product,
+                                             depth_ladder=depth_ladder, match_buffer=match_buffer,
+                                             book_engine=args.book_engine, order_store=args.order_store,
+                                             quote_increment=args.quote_increment)
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        if args.via == 'direct':
+            frames = replay_direct(book, args.feed, speed=args.speed)
+        else:
+            frames = asyncio.run(_replay_through_server(book, args.feed, args.speed))
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        elapsed = time.perf_counter() - start
+
+        stats = book.stats.snapshot()
+        print(f"{frames} frames in {elapsed:.2f}s ({frames / elapsed:,.0f} frames/s)")
+        print(f"Final sequence {book._sequence}, bid {book.get_bid()}, ask {book.get_ask()}")
+        print(f"Resyncs: {stats['resyncs']}, gaps: {stats['gaps']}, decode errors: {stats['decode_errors']}")
+        if args.via == 'server':
+            print(f"Batches: {stats['batches']}, batch size: {stats['batch_size']}")
+    finally:
+        for shared in (depth_ladder, match_buffer):
+            shared.close()
+            shared.unlink()
+
+async def _replay_through_server(book, path, speed):
+    server = ReplayServer(path, speed=speed)
+    async with server.serve():
+        book.url = server.url
+        book._client = pygo_order_book.PublicClient(api_url=server.api_url)
+        book.shutdown_event = threading.Event()
+        await book._listen({'type': 'subscribe', 'product_ids': [book.product_id], 'channels': book.channels})
+    book.publish_state(force=True)
+    return server.frames_sent
+
+
+if __name__ == "__main__":
+    main()
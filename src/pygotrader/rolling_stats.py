@@ -0,0 +1,305 @@
+"""
+Streaming estimators for trading algorithms
+
+Every estimator here is updated one value at a time in O(1) (amortized for
+the min/max), both when a value enters the window and when it leaves, so
+the cost of a tick depends on how many matches came and went since the last
+one and not on how many are in the window.
+
+Means, variances and the regression use Welford-style running moments
+rather than raw sums, which keeps them accurate over long runs where raw
+sums of squares would cancel catastrophically.
+
+Important classes:
+RollingMoments: mean, variance and standard deviation of a window
+RollingOLS: least squares slope, intercept and correlation of y on x
+RollingMax, RollingMin: window extremes with monotonic deques
+EWMA: exponentially weighted mean and variance, optionally in time
+RollingMatchStats: all of the above over the last N seconds of a
+    shared_state.MatchRingBuffer, which is what algorithms are handed
+
+z-scores are RollingMoments.zscore(x).
+"""
+from collections import deque
+import math
+import time
+
+
+class RollingMoments(object):
+    """Running count, mean and variance of a window of values"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+
+    def remove(self, x):
+        """Take a value that was added earlier back out"""
+        if self.count <= 1:
+            self.reset()
+            return
+        self.count -= 1
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        self._m2 -= delta * (x - self.mean)
+
+    def variance(self, ddof=1):
+        if self.count <= ddof:
+            return math.nan
+        return max(self._m2, 0.0) / (self.count - ddof)
+
+    def std(self, ddof=1):
+        return math.sqrt(self.variance(ddof))
+
+    def zscore(self, x, ddof=1):
+        """How many standard deviations x is from the window's mean"""
+        std = self.std(ddof)
+        return (x - self.mean) / std if std > 0 else math.nan
+
+
+class RollingOLS(object):
+    """Ordinary least squares fit of y = intercept + slope * x over a window
+
+    Keeps running means of x and y and their co-moments, so adding or
+    removing a point is O(1).  slope, intercept and rvalue agree with
+    scipy.stats.linregress on the same points.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self._sxx = 0.0
+        self._syy = 0.0
+        self._sxy = 0.0
+
+    def add(self, x, y):
+        self.count += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.count
+        self.mean_y += dy / self.count
+        self._sxx += dx * (x - self.mean_x)
+        self._syy += dy * (y - self.mean_y)
+        self._sxy += dx * (y - self.mean_y)
+
+    def remove(self, x, y):
+        """Take a point that was added earlier back out"""
+        if self.count <= 1:
+            self.reset()
+            return
+        self.count -= 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x -= dx / self.count
+        self.mean_y -= dy / self.count
+        self._sxx -= dx * (x - self.mean_x)
+        self._syy -= dy * (y - self.mean_y)
+        self._sxy -= dx * (y - self.mean_y)
+
+    @property
+    def slope(self):
+        if self.count < 2 or self._sxx <= 0:
+            return math.nan
+        return self._sxy / self._sxx
+
+    @property
+    def intercept(self):
+        return self.mean_y - self.slope * self.mean_x
+
+    @property
+    def rvalue(self):
+        if self.count < 2 or self._sxx <= 0 or self._syy <= 0:
+            return math.nan
+        return max(-1.0, min(1.0, self._sxy / math.sqrt(self._sxx * self._syy)))
+
+    def predict(self, x):
+        return self.intercept + self.slope * x
+
+
+class RollingMax(object):
+    """Maximum of a window whose values leave in the order they came in
+
+    Each value is added with a key that only ever increases (a timestamp or
+    a counter).  evict(key) drops every value added with a smaller key.  A
+    monotonic deque keeps only the values that could still become the
+    maximum, so both operations are amortized O(1).
+    """
+    _better = staticmethod(lambda a, b: a >= b)
+
+    def __init__(self):
+        self._candidates = deque()   #(key, value), values getting worse from the front
+
+    def reset(self):
+        self._candidates.clear()
+
+    def add(self, key, value):
+        candidates = self._candidates
+        better = self._better
+        while candidates and better(value, candidates[-1][1]):
+            candidates.pop()
+        candidates.append((key, value))
+
+    def evict(self, key):
+        candidates = self._candidates
+        while candidates and candidates[0][0] < key:
+            candidates.popleft()
+
+    @property
+    def value(self):
+        return self._candidates[0][1] if self._candidates else math.nan
+
+
+class RollingMin(RollingMax):
+    """Minimum of a window, see RollingMax"""
+    _better = staticmethod(lambda a, b: a <= b)
+
+
+class EWMA(object):
+    """Exponentially weighted moving mean and variance
+
+    With halflife=None each update gets weight alpha.  With a halflife (in
+    the same units as the times passed to update), the weight depends on how
+    much time went by since the previous update, so irregularly spaced
+    trades are weighted by time rather than by count.
+    """
+
+    def __init__(self, alpha=0.1, halflife=None):
+        self.alpha = alpha
+        self.halflife = halflife
+        self.mean = math.nan
+        self.variance = math.nan
+        self._last_time = None
+
+    def update(self, x, t=None):
+        if math.isnan(self.mean):
+            self.mean = x
+            self.variance = 0.0
+            self._last_time = t
+            return self.mean
+        alpha = self.alpha
+        if self.halflife is not None and t is not None:
+            elapsed = max(t - self._last_time, 0) if self._last_time is not None else 0
+            alpha = 1.0 - 0.5 ** (elapsed / self.halflife)
+            self._last_time = t
+        delta = x - self.mean
+        self.mean += alpha * delta
+        self.variance = (1.0 - alpha) * (self.variance + alpha * delta * delta)
+        return self.mean
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if not math.isnan(self.variance) else math.nan
+
+
+class RollingMatchStats(object):
+    """Price statistics of the last `seconds` of trades in a MatchRingBuffer
+
+    Call update() on every tick.  It adds the matches appended since the last
+    call and removes the ones that have aged out, reading only those rows
+    from the buffer.
+
+    Attributes, all over the window:
+    prices: RollingMoments of trade prices
+    volume: total traded size
+    ols: RollingOLS of price against time in seconds, or against the match's
+        position in the feed with regress_on='index'
+    high, low: RollingMax/RollingMin of prices
+    ewma: EWMA of prices with the given halflife in seconds (not windowed)
+    last_price: the latest trade's price
+
+    The window ends at clock(), the buffer's clock unless one is given.
+
+    If the buffer wraps around past matches that are still in the window
+    (more than its capacity in one window), the estimators are rebuilt from
+    what's left in the buffer.
+    """
+
+    def __init__(self, matches, seconds, regress_on='time', halflife=None, clock=None):
+        if regress_on not in ('time', 'index'):
+            raise ValueError(f"Can't regress on {regress_on}")
+        self.matches = matches
+        self.seconds = seconds
+        self.regress_on = regress_on
+        self.clock = clock or getattr(matches, 'clock', time.time_ns)
+        self.prices = RollingMoments()
+        self.ols = RollingOLS()
+        self.high = RollingMax()
+        self.low = RollingMin()
+        self.ewma = EWMA(halflife=halflife) if halflife else EWMA()
+        self.volume = 0.0
+        self.last_price = math.nan
+        self.rebuilds = 0
+        self._start = None   #oldest match in the window
+        self._end = None     #next match to add
+        self._base_ns = None
+
+    @property
+    def count(self):
+        return self.prices.count
+
+    def _x(self, cursor, ts_ns):
+        if self.regress_on == 'index':
+            return float(cursor)
+        if self._base_ns is None:
+            self._base_ns = ts_ns
+        return (ts_ns - self._base_ns) / 1e9
+
+    def _reset(self):
+        for estimator in (self.prices, self.ols, self.high, self.low):
+            estimator.reset()
+        self.volume = 0.0
+        self.rebuilds += 1
+
+    def update(self, now_ns=None):
+        if now_ns is None:
+            now_ns = self.clock()
+        matches = self.matches
+        end = matches.cursor
+        cutoff_ns = now_ns - int(self.seconds * 1e9)
+        if self._start is None:
+            self._start = self._end = matches.cursor_at_time(cutoff_ns, end=end)
+        elif self._start < end - matches.capacity:
+            #rows we'd need to remove are gone, start over from what's left
+            self._reset()
+            self._start = self._end = matches.cursor_at_time(cutoff_ns, end=end)
+
+        new = matches.between(self._end, end, copy=True)
+        cursor = end - new.count
+        for ts_ns, price, size in zip(new.ts_ns.tolist(), new.price.tolist(), new.size.tolist()):
+            self.prices.add(price)
+            self.ols.add(self._x(cursor, ts_ns), price)
+            self.high.add(cursor, price)
+            self.low.add(cursor, price)
+            self.ewma.update(price, ts_ns / 1e9)
+            self.volume += size
+            self.last_price = price
+            cursor += 1
+        self._end = end
+
+        start = matches.cursor_at_time(cutoff_ns, start=self._start, end=end)
+        if start > self._start:
+            old = matches.between(self._start, start, copy=True)
+            cursor = start - old.count
+            for ts_ns, price, size in zip(old.ts_ns.tolist(), old.price.tolist(), old.size.tolist()):
+                self.prices.remove(price)
+                self.ols.remove(self._x(cursor, ts_ns), price)
+                self.volume -= size
+                cursor += 1
+            self.high.evict(start)
+            self.low.evict(start)
+            self._start = start
+        if not self.prices.count:
+            self.volume = 0.0
@@ -0,0 +1,711 @@
+"""
+Fixed-layout market data structures that live in shared memory
+
+The multiprocessing Manager namespace is fine for the odd flag or message,
+but every read and write on it is an IPC round-trip to the Manager server.
+Market data that gets republished several times a second is kept here
+instead, in multiprocessing.shared_memory blocks that every process maps
+directly and reads through NumPy views.
+
+Writers and readers are coordinated with a sequence counter (a seqlock):
+the single writer bumps the counter to an odd number, writes the data, and
+then bumps it to the next even number.  Readers copy the data and retry if
+the counter was odd or changed while they were copying, so they never see
+a half-written update and never block the writer.
+
+Important classes:
+SharedDepthLadder: top-N ask/bid price and size ladder for the TUI and algorithms
+MatchRingBuffer: fixed-capacity columnar history of trade matches
+SharedRecord: a fixed set of named float values, e.g. the feed's features
+SharedMarketSnapshot: double-buffered book depth and last trade, read as one
+    immutable MarketSnapshot
+UpdateSignal: lets the feed wake up processes waiting for new market data
+UpdateReader: one consumer of an UpdateSignal
+
+Note: these objects can be handed to child processes.  With the default fork
+start method the mapping is simply inherited, otherwise the block is
+re-attached by name when the object is unpickled.  Only the creating
+process should call unlink().
+"""
+from collections import namedtuple
+from multiprocessing import shared_memory
+import math
+import multiprocessing
+import time
+import numpy as np
+
+BUY = 1
+SELL = -1
+
+
+class SharedDepthLadder(object):
+    """Top-N ask/bid depth ladder published by the order book
+
+    Memory layout (all little-endian, 8 byte aligned):
+    header: int64[4] - sequence, levels, number of valid asks, number of valid bids
+    stamp:  int64[1] - time.time_ns() of the last publish
+    asks:   float64[levels, 2] - (price, size), best ask first
+    bids:   float64[levels, 2] - (price, size), best bid first
+
+    Important methods:
+    publish: writes a new ladder.  Only one process/thread may publish.
+    read: returns a consistent copy of the current ladder
+    """
+    HEADER_FIELDS = 4
+
+    def __init__(self, levels=10, name=None, create=True):
+        if levels < 1:
+            raise ValueError("Depth ladder needs at least one level")
+        self._levels = levels
+        self._owner = create
+        size = 8 * (self.HEADER_FIELDS + 1 + 4 * levels)
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._map_arrays()
+        if create:
+            self._header[:] = 0
+            self._header[1] = levels
+            self._stamp[0] = 0
+            self._asks[:] = 0.0
+            self._bids[:] = 0.0
+
+    def _map_arrays(self):
+        buf = self._shm.buf
+        levels = self._levels
+        offset = 0
+        self._header = np.ndarray((self.HEADER_FIELDS,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8 * self.HEADER_FIELDS
+        self._stamp = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8
+        self._asks = np.ndarray((levels, 2), dtype=np.float64, buffer=buf, offset=offset)
+        offset += 16 * levels
+        self._bids = np.ndarray((levels, 2), dtype=np.float64, buffer=buf, offset=offset)
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'levels': self._levels}
+
+    def __setstate__(self, state):
+        self._levels = state['levels']
+        self._owner = False
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._map_arrays()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def levels(self):
+        return self._levels
+
+    @property
+    def sequence(self):
+        return int(self._header[0])
+
+    @property
+    def published_at(self):
+        """time.time_ns() of the last publish, 0 if nothing was published yet"""
+        return int(self._stamp[0])
+
+    def publish(self, ask_prices, ask_sizes, bid_prices, bid_sizes):
+        """Write a new ladder.  Levels beyond the given lists are zeroed.
+
+        Prices and sizes can be lists of floats/Decimals or NumPy arrays,
+        best level first.  Anything past self.levels is ignored.
+        """
+        levels = self._levels
+        n_asks = min(len(ask_prices), levels)
+        n_bids = min(len(bid_prices), levels)
+        header = self._header
+        header[0] += 1  #odd: write in progress
+        if n_asks:
+            self._asks[:n_asks, 0] = ask_prices[:n_asks]
+            self._asks[:n_asks, 1] = ask_sizes[:n_asks]
+        self._asks[n_asks:] = 0.0
+        if n_bids:
+            self._bids[:n_bids, 0] = bid_prices[:n_bids]
+            self._bids[:n_bids, 1] = bid_sizes[:n_bids]
+        self._bids[n_bids:] = 0.0
+        header[2] = n_asks
+        header[3] = n_bids
+        self._stamp[0] = time.time_ns()
+        header[0] += 1  #even: ladder is consistent again
+
+    def read(self, retries=1000):
+        """Return (asks, bids) as (n, 2) arrays of (price, size), best level first
+
+        Only valid levels are returned, so the arrays can be shorter than
+        self.levels.  The arrays are private copies.
+        """
+        header = self._header
+        for _ in range(retries):
+            start = header[0]
+            if start & 1:
+                continue
+            n_asks = int(header[2])
+            n_bids = int(header[3])
+            asks = self._asks[:n_asks].copy()
+            bids = self._bids[:n_bids].copy()
+            if header[0] == start:
+                return asks, bids
+        raise TimeoutError("Depth ladder kept changing while being read")
+
+    def close(self):
+        self._header = self._stamp = self._asks = self._bids = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+class MatchColumns(namedtuple('MatchColumns', ['sequence', 'ts_ns', 'price', 'size', 'side'])):
+    """Columns of trade matches as NumPy arrays, oldest first
+    
+    sequence: int64 exchange sequence number
+    ts_ns: int64 exchange timestamp in nanoseconds since the epoch
+    price, size: float64
+    side: int8 maker side, BUY (1) or SELL (-1)
+    """
+    __slots__ = ()
+
+    @property
+    def count(self):
+        return len(self.sequence)
+
+
+class MatchRingBuffer(object):
+    """Fixed-capacity ring buffer of trade matches, stored column by column
+
+    There is a single writer (the order book) and any number of lock-free 
+    readers.  The writer fills in a row and only then advances the write 
+    counter, so readers never see a partially written match.  Memory use is 
+    fixed at roughly 33 bytes per row no matter how long the program runs; 
+    once the buffer is full the oldest matches are overwritten.
+
+    Memory layout:
+    header:   int64[3] - total matches ever written (the cursor), capacity,
+              matches started (the cursor, or one more while a row is being
+              written)
+    sequence: int64[capacity]
+    ts_ns:    int64[capacity]
+    price:    float64[capacity]
+    size:     float64[capacity]
+    side:     int8[capacity]
+
+    Important methods:
+    append: add a match (writer only)
+    since_cursor: matches written after a cursor value, plus the new cursor
+    since: matches with an exchange sequence number after a given one
+    last: matches from the last N seconds
+    cursor_at_time, between: the building blocks of the above, for readers
+    that keep their own cursors (see windows.RollingWindows)
+
+    clock returns "now" in epoch nanoseconds for last() and the readers that
+    follow the buffer.  It's the wall clock, except when a recording is being
+    backtested, where it's the recorded time.  It isn't shared between 
+    processes.
+
+    The read methods return NumPy views into shared memory when the rows 
+    don't wrap around the end of the buffer, and a copy when they do.  A view
+    stays valid until another `capacity` matches have been appended; pass 
+    copy=True to always get a private, consistent copy.
+    """
+    HEADER_FIELDS = 3
+
+    def __init__(self, capacity=2**18, name=None, create=True):
+        if capacity < 1:
+            raise ValueError("Match buffer needs room for at least one match")
+        self._capacity = capacity
+        self._owner = create
+        self.clock = time.time_ns
+        size = 8 * self.HEADER_FIELDS + 33 * capacity
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._map_arrays()
+        if create:
+            self._header[0] = 0
+            self._header[1] = capacity
+            self._header[2] = 0
+
+    def _map_arrays(self):
+        buf = self._shm.buf
+        capacity = self._capacity
+        offset = 0
+        self._header = np.ndarray((self.HEADER_FIELDS,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += 8 * self.HEADER_FIELDS
+        columns = []
+        for dtype in (np.int64, np.int64, np.float64, np.float64, np.int8):
+            columns.append(np.ndarray((capacity,), dtype=dtype, buffer=buf, offset=offset))
+            offset += np.dtype(dtype).itemsize * capacity
+        self._columns = MatchColumns(*columns)
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'capacity': self._capacity}
+
+    def __setstate__(self, state):
+        self._capacity = state['capacity']
+        self._owner = False
+        self.clock = time.time_ns
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._map_arrays()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def cursor(self):
+        """Total number of matches ever appended"""
+        return int(self._header[0])
+
+    def append(self, sequence, ts_ns, price, size, side):
+        cursor = int(self._header[0])
+        self._header[2] = cursor + 1   #lets readers know this row's slot is being overwritten
+        i = cursor % self._capacity
+        columns = self._columns
+        columns.sequence[i] = sequence
+        columns.ts_ns[i] = ts_ns
+        columns.price[i] = price
+        columns.size[i] = size
+        columns.side[i] = side
+        self._header[0] = cursor + 1   #publish the row
+
+    def _segments(self, start, end):
+        """Physical (lo, hi) index ranges holding logical rows [start, end)"""
+        if start >= end:
+            return [(0, 0)]
+        lo = start % self._capacity
+        hi = lo + (end - start)
+        if hi <= self._capacity:
+            return [(lo, hi)]
+        return [(lo, self._capacity), (0, hi - self._capacity)]
+
+    def _read(self, start, end, copy):
+        for _ in range(1000):
+            segments = self._segments(start, end)
+            if len(segments) == 1:
+                lo, hi = segments[0]
+                result = MatchColumns(*(c[lo:hi] for c in self._columns))
+                if copy:
+                    result = MatchColumns(*(c.copy() for c in result))
+            else:
+                result = MatchColumns(*(np.concatenate([c[lo:hi] for lo, hi in segments])
+                                        for c in self._columns))
+            #a row the writer has started on overwrites logical row started - capacity,
+            #which may have been half written while we copied it
+            oldest = int(self._header[2]) - self._capacity
+            if not (copy or len(segments) > 1) or oldest <= start:
+                return result
+            #the writer lapped us while copying, drop the rows it may have overwritten
+            start = oldest
+        raise TimeoutError("Match buffer kept being overwritten while being read")
+
+    def _valid_range(self, cursor=None):
+        end = self.cursor
+        start = max(0, end - self._capacity)
+        if cursor is not None:
+            start = min(max(start, cursor), end)
+        return start, end
+
+    def since_cursor(self, cursor, copy=False):
+        """Return (matches appended at or after cursor, new cursor)
+
+        Keep the returned cursor and pass it back in to get only new matches 
+        next time.  Matches that were already overwritten are skipped.
+        """
+        start, end = self._valid_range(cursor)
+        return self._read(start, end, copy), end
+
+    def _search(self, column, value, start, end):
+        """First logical row in [start, end) whose column value is >= value
+
+        Relies on the column being non-decreasing in write order, which holds 
+        for both exchange sequence numbers and timestamps.
+        """
+        offset = start
+        for lo, hi in self._segments(start, end):
+            index = int(np.searchsorted(column[lo:hi], value, side='left'))
+            if index < hi - lo:
+                return offset + index
+            offset += hi - lo
+        return end
+
+    def cursor_at_time(self, ts_ns, start=0, end=None):
+        """Cursor of the first match at or after ts_ns, searching only the 
+        cursors from start (or the oldest match still held) up to end"""
+        start, end = self._valid_range(start) if end is None else (max(start, end - self._capacity), end)
+        return self._search(self._columns.ts_ns, ts_ns, start, end)
+
+    def between(self, start, end, copy=False):
+        """Matches with cursors in [start, end)"""
+        start = max(start, self.cursor - self._capacity)
+        return self._read(start, max(start, end), copy)
+
+    def since(self, sequence, copy=False):
+        """Return the matches with an exchange sequence number after sequence"""
+        start, end = self._valid_range()
+        start = self._search(self._columns.sequence, sequence + 1, start, end)
+        return self._read(start, end, copy)
+
+    def last(self, seconds, now_ns=None, copy=False):
+        """Return the matches from the last `seconds` seconds
+        
+        now_ns defaults to the buffer's clock, the current wall clock time in
+        epoch nanoseconds.
+        """
+        if now_ns is None:
+            now_ns = self.clock()
+        start, end = self._valid_range()
+        start = self._search(self._columns.ts_ns, now_ns - int(seconds * 1e9), start, end)
+        return self._read(start, end, copy)
+
+    def close(self):
+        self._header = self._columns = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+class SharedRecord(object):
+    """A fixed set of named float64 values, published as a whole
+
+    Used for the feature vector computed by features.FeatureEngine.  The
+    field names are fixed when the record is created and travel with it when
+    it's pickled; only the values live in shared memory.  Same seqlock scheme
+    as SharedDepthLadder.
+
+    Memory layout:
+    header: int64[2] - sequence, number of fields
+    stamp:  int64[1] - time.time_ns() of the last publish
+    values: float64[number of fields]
+
+    Important methods:
+    publish: writes every value at once (writer only)
+    read: returns a consistent {field: value} dict
+    read_array: same, as a NumPy array in field order
+    """
+    HEADER_FIELDS = 3
+
+    def __init__(self, fields, name=None, create=True):
+        self._fields = tuple(fields)
+        if not self._fields:
+            raise ValueError("Shared record needs at least one field")
+        self._owner = create
+        size = 8 * (self.HEADER_FIELDS + 1 + len(self._fields))
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._map_arrays()
+        if create:
+            self._header[0] = 0
+            self._header[1] = len(self._fields)
+            self._stamp[0] = 0
+            self._values[:] = np.nan
+
+    def _map_arrays(self):
+        buf = self._shm.buf
+        self._header = np.ndarray((self.HEADER_FIELDS,), dtype=np.int64, buffer=buf, offset=0)
+        self._stamp = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=8 * self.HEADER_FIELDS)
+        self._values = np.ndarray((len(self._fields),), dtype=np.float64, buffer=buf,
+                                  offset=8 * (self.HEADER_FIELDS + 1))
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'fields': self._fields}
+
+    def __setstate__(self, state):
+        self._fields = state['fields']
+        self._owner = False
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._map_arrays()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def sequence(self):
+        return int(self._header[0])
+
+    @property
+    def published_at(self):
+        """time.time_ns() of the last publish, 0 if nothing was published yet"""
+        return int(self._stamp[0])
+
+    def publish(self, values):
+        """Write all the values, in field order"""
+        header = self._header
+        header[0] += 1  #odd: write in progress
+        self._values[:] = values
+        self._stamp[0] = time.time_ns()
+        header[0] += 1
+
+    def read_array(self, retries=1000):
+        header = self._header
+        for _ in range(retries):
+            start = header[0]
+            if start & 1:
+                continue
+            values = self._values.copy()
+            if header[0] == start:
+                return values
+        raise TimeoutError("Shared record kept changing while being read")
+
+    def read(self, retries=1000):
+        """Return {field: value}.  Values that were never published are NaN"""
+        return dict(zip(self._fields, self.read_array(retries).tolist()))
+
+    def close(self):
+        self._header = self._stamp = self._values = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+class MarketSnapshot(namedtuple('MarketSnapshot', ['version', 'sequence', 'time_ns', 'bid', 'bid_size', 'ask',
+                                                   'ask_size', 'last_price', 'asks', 'bids', 'match_cursor',
+                                                   'matches'])):
+    """One product's market as of a single publish by the feed
+
+    version: counts the feed's publishes, 0 if nothing was published yet
+    sequence: the exchange sequence number the book was at, -1 for level2
+    time_ns: when it was published, in epoch nanoseconds
+    bid, bid_size, ask, ask_size, last_price: floats, NaN if unknown
+    asks, bids: read-only (n, 2) arrays of (price, size), best level first
+    match_cursor: the match buffer's cursor at the time, so the matches
+        that came in afterwards are matches.since_cursor(match_cursor)
+    matches: MatchColumns of the trades in the window before time_ns (up to
+        match_cursor), or None if it was read without a match buffer
+    """
+    __slots__ = ()
+
+
+class SharedMarketSnapshot(object):
+    """Double-buffered top-of-book, depth and last trade, published as a whole
+
+    Depth and scalars are written to one of two slots, alternating, and the
+    version in the control block then points readers at it.  A reader copies
+    the slot the latest version is in while the writer fills the other one,
+    so the two only get in each other's way if the writer publishes twice
+    during one read; each slot has its own seqlock for that case.
+
+    Memory layout:
+    control: int64[2] - version (publishes so far), levels
+    then two slots of
+    header:  int64[7] - slot sequence, version, exchange sequence, time_ns,
+             match cursor, number of valid asks, number of valid bids
+    values:  float64[1 + 4 * levels] - last price, asks (price, size) * levels,
+             bids (price, size) * levels
+
+    Important methods:
+    publish: writes a new snapshot.  Only one process/thread may publish
+    read: a MarketSnapshot, with the match window if given a match buffer
+    """
+    SLOT_FIELDS = 7
+
+    def __init__(self, levels=10, name=None, create=True):
+        if levels < 1:
+            raise ValueError("Market snapshot needs at least one level")
+        self._levels = levels
+        self._owner = create
+        size = 16 + 2 * 8 * (self.SLOT_FIELDS + 1 + 4 * levels)
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._map_arrays()
+        if create:
+            self._control[0] = 0
+            self._control[1] = levels
+            for header, values in self._slots:
+                header[:] = 0
+                values[:] = np.nan
+
+    def _map_arrays(self):
+        buf = self._shm.buf
+        levels = self._levels
+        self._control = np.ndarray((2,), dtype=np.int64, buffer=buf, offset=0)
+        offset = 16
+        self._slots = []
+        for _ in range(2):
+            header = np.ndarray((self.SLOT_FIELDS,), dtype=np.int64, buffer=buf, offset=offset)
+            offset += 8 * self.SLOT_FIELDS
+            values = np.ndarray((1 + 4 * levels,), dtype=np.float64, buffer=buf, offset=offset)
+            offset += 8 * (1 + 4 * levels)
+            self._slots.append((header, values))
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'levels': self._levels}
+
+    def __setstate__(self, state):
+        self._levels = state['levels']
+        self._owner = False
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._map_arrays()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def levels(self):
+        return self._levels
+
+    @property
+    def version(self):
+        return int(self._control[0])
+
+    def publish(self, ask_prices, ask_sizes, bid_prices, bid_sizes, sequence=-1, last_price=math.nan,
+                match_cursor=0, time_ns=None):
+        """Write a new snapshot into the slot readers aren't using
+
+        Prices and sizes are lists or arrays, best level first, like 
+        SharedDepthLadder.publish.
+        """
+        levels = self._levels
+        version = int(self._control[0]) + 1
+        header, values = self._slots[version % 2]
+        n_asks = min(len(ask_prices), levels)
+        n_bids = min(len(bid_prices), levels)
+        header[0] += 1  #odd: write in progress
+        values[0] = last_price
+        asks = values[1:1 + 2 * levels]
+        bids = values[1 + 2 * levels:]
+        if n_asks:
+            asks[0:2 * n_asks:2] = ask_prices[:n_asks]
+            asks[1:2 * n_asks:2] = ask_sizes[:n_asks]
+        if n_bids:
+            bids[0:2 * n_bids:2] = bid_prices[:n_bids]
+            bids[1:2 * n_bids:2] = bid_sizes[:n_bids]
+        header[1:] = (version, sequence, time.time_ns() if time_ns is None else time_ns, match_cursor, n_asks, n_bids)
+        header[0] += 1  #even: consistent again
+        self._control[0] = version
+
+    def read(self, match_buffer=None, window=10, retries=1000):
+        """Return the latest MarketSnapshot
+
+        With a match_buffer, its matches are the trades from the `window` 
+        seconds before the snapshot was published, copied out of the buffer.
+        """
+        levels = self._levels
+        for _ in range(retries):
+            version = int(self._control[0])
+            header, values = self._slots[version % 2]
+            start = int(header[0])
+            if start & 1:
+                continue
+            fields = header.copy()
+            copied = values.copy()
+            if header[0] == start and (version == 0 or fields[1] == version):
+                break
+        else:
+            raise TimeoutError("Market snapshot kept changing while being read")
+        _, version, sequence, time_ns, match_cursor, n_asks, n_bids = (int(v) for v in fields)
+        asks = copied[1:1 + 2 * n_asks].reshape(-1, 2)
+        bids = copied[1 + 2 * levels:1 + 2 * levels + 2 * n_bids].reshape(-1, 2)
+        asks.flags.writeable = False
+        bids.flags.writeable = False
+        matches = None
+        if match_buffer is not None:
+            start = match_buffer.cursor_at_time(time_ns - int(window * 1e9), end=match_cursor)
+            matches = match_buffer.between(start, match_cursor, copy=True)
+            for column in matches:
+                column.flags.writeable = False
+        bid, bid_size = (float(bids[0, 0]), float(bids[0, 1])) if n_bids else (math.nan, math.nan)
+        ask, ask_size = (float(asks[0, 0]), float(asks[0, 1])) if n_asks else (math.nan, math.nan)
+        return MarketSnapshot(version, sequence, time_ns, bid, bid_size, ask, ask_size, float(copied[0]),
+                              asks, bids, match_cursor, matches)
+
+    def close(self):
+        self._control = self._slots = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+class UpdateSignal(object):
+    """Wakes the processes waiting for new data whenever the feed publishes some
+
+    The feed calls notify() after each batch it applies.  Every consumer
+    gets its own UpdateReader from reader(), which keeps track of what it has
+    seen, so any number of them can wait on the same signal and each one
+    wakes on every notify.  The times of the last `history` updates are kept
+    so each reader can tell how long the oldest update it hadn't seen yet
+    waited for it.
+    """
+
+    def __init__(self, history=64):
+        self.history = history
+        self._condition = multiprocessing.Condition()
+        #updates so far, then the time_ns of update n in slot 1 + n % history
+        self._counters = multiprocessing.RawArray('q', 1 + history)
+
+    @property
+    def updates(self):
+        return self._counters[0]
+
+    def notify(self):
+        counters = self._counters
+        update = counters[0] + 1
+        counters[1 + update % self.history] = time.time_ns()
+        counters[0] = update
+        with self._condition:
+            self._condition.notify_all()
+
+    def reader(self):
+        """A new UpdateReader, which starts out having seen every update so far"""
+        return UpdateReader(self)
+
+
+class UpdateReader(object):
+    """One consumer's view of an UpdateSignal
+
+    Call wait() and then consume().  Any number of notifies between two
+    consumes count as one wake up.  A reader belongs to one consumer; give
+    every process or thread that waits on the signal its own.
+    """
+
+    def __init__(self, signal):
+        self.signal = signal
+        self.seen = signal.updates
+
+    def wait(self, timeout=None):
+        """Wait for an update this reader hasn't consumed.  Returns False on timeout"""
+        counters = self.signal._counters
+        with self.signal._condition:
+            return self.signal._condition.wait_for(lambda: counters[0] != self.seen, timeout)
+
+    def consume(self):
+        """Return (updates so far, time_ns of the oldest update not consumed
+        yet or 0), and start waiting for the next one
+
+        If more than `history` updates went by unconsumed, the oldest one
+        still kept stands in for it.
+        """
+        signal = self.signal
+        counters = signal._counters
+        updates = counters[0]
+        if updates == self.seen:
+            return updates, 0
+        oldest = max(self.seen + 1, updates - signal.history + 1)
+        self.seen = updates
+        return updates, counters[1 + oldest % signal.history]
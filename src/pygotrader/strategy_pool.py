@@ -0,0 +1,104 @@
+"""
+Running several trading algorithms at once
+
+Each strategy is an algorithm file run by its own algorithm_handler.
+AlgorithmHandler, which is its own process, so strategies run in parallel on
+as many cores as there are strategies and a slow one only holds itself up.
+They all read the same market data: the depth ladder, match buffer, feature
+record and update signal live in shared memory (see shared_state.py) and
+are attached to, not copied, by every process.
+
+Every strategy gets an order_handler.TaggedOrderHandler as its order_handler,
+so the orders they create all go through the one OrderHandler, in the order
+they were created, tagged with the name of the strategy that made them.
+
+Strategies are given on the command line as PATH[@SECONDS], e.g.
+    --algorithm_file trend.py@0.5 --algorithm_file spread.py
+where SECONDS is how often that strategy runs (its run_rate in poll mode,
+1/SECONDS as its max_rate in event mode).  A strategy's name is its file
+name without the extension, with a number added if two are the same.
+
+Important classes/functions:
+StrategySpec, parse_strategy: a strategy from the command line
+StrategyPool: starts and stops the strategies' AlgorithmHandlers
+"""
+from collections import namedtuple
+import os
+
+from pygotrader.algorithm_handler import AlgorithmHandler
+from pygotrader.order_handler import TaggedOrderHandler
+
+StrategySpec = namedtuple('StrategySpec', ['name', 'algorithm_file', 'run_rate'], defaults=(None,))
+
+
+def parse_strategy(text):
+    """Turn PATH[@SECONDS] into a StrategySpec"""
+    path, rate = text, None
+    if '@' in text:
+        head, _, tail = text.rpartition('@')
+        try:
+            rate = float(tail)
+        except ValueError:
+            pass   #an @ that's part of the path
+        else:
+            if rate <= 0:
+                raise ValueError(f"Run rate of {head} has to be more than 0 seconds")
+            path = head
+    name = os.path.splitext(os.path.basename(path))[0]
+    return StrategySpec(name, path, rate)
+
+
+class StrategyPool(object):
+    """One AlgorithmHandler process per strategy
+
+    options are passed on to every AlgorithmHandler (schedule, match_buffer,
+    products...).  With a single strategy its handler isn't given a name, so
+    it publishes ns.algorithm_stats like a lone AlgorithmHandler would.
+
+    Important methods:
+    start, close: start and stop every strategy's process
+    stats: each strategy's latest algorithm_stats, by name
+    """
+
+    def __init__(self, ns, authenticated_client, order_handler, strategies, **options):
+        self.ns = ns
+        self.strategies = self._unique_names(strategies)
+        self.handlers = {}
+        for spec in self.strategies:
+            handler_options = dict(options)
+            if spec.run_rate is not None:
+                handler_options['run_rate'] = spec.run_rate
+                if handler_options.get('schedule') == 'event':
+                    handler_options['max_rate'] = 1.0 / spec.run_rate
+            tagged = TaggedOrderHandler(order_handler, spec.name) if order_handler is not None else None
+            self.handlers[spec.name] = AlgorithmHandler(ns, authenticated_client, tagged,
+                                                        algorithm_file=spec.algorithm_file,
+                                                        name=spec.name if len(self.strategies) > 1 else None,
+                                                        **handler_options)
+
+    @staticmethod
+    def _unique_names(strategies):
+        seen = {}
+        unique = []
+        for spec in strategies:
+            count = seen.get(spec.name, 0) + 1
+            seen[spec.name] = count
+            unique.append(spec._replace(name=spec.name if count == 1 else f'{spec.name}{count}'))
+        return unique
+
+    def start(self):
+        for handler in self.handlers.values():
+            handler.start()
+
+    def close(self):
+        #let them all wind down at once rather than one after the other
+        for handler in self.handlers.values():
+            handler.shutdown_event.set()
+        for handler in self.handlers.values():
+            handler.process.join()
+
+    def stats(self):
+        return {name: getattr(self.ns, handler.stats_attribute, None) for name, handler in self.handlers.items()}
+
+    def __len__(self):
+        return len(self.handlers)
@@ -0,0 +1,366 @@
+"""
+Integer-tick order book engine
+
+An alternative to the SortedDict/Decimal book inherited from
+cbpro.order_book.OrderBook.  Prices are converted to integer ticks of the
+product's quote increment and sizes to integers scaled by 10**8, so every
+book operation is integer arithmetic.  Each side keeps its levels in a
+contiguous NumPy array covering a window of ticks around the best price,
+with the best price tracked as levels come and go.
+
+Levels that fall outside the window (e.g. a bid at $0.01 in the level-3
+snapshot) go into a small overflow dict.  When the best price walks out of
+the window, the window is re-centered on it.
+
+The same level arrays back LevelBook, the aggregated book used with the
+level2 channel, where the exchange sends the size at each price instead of
+individual orders.
+
+Important classes:
+TickBook: the book engine, selected with PygoOrderBook(book_engine='tick')
+LevelBook: level-2 book, selected with PygoOrderBook(channel='level2')
+"""
+from decimal import Decimal
+import numpy as np
+from pygotrader.order_store import create_order_store
+
+SIZE_DECIMALS = 8
+
+
+def count_decimals(increment):
+    """Number of decimal places in an increment such as '0.01'"""
+    exponent = Decimal(str(increment)).normalize().as_tuple().exponent
+    return max(0, -exponent)
+
+def to_scaled_int(value, decimals):
+    """Convert a decimal string (or Decimal/float) to an int scaled by 10**decimals
+
+    This avoids building a Decimal for every price and size on the feed.
+    Digits past the given number of decimals are truncated.
+    """
+    if isinstance(value, Decimal):
+        return int(value.scaleb(decimals))
+    if not isinstance(value, str):
+        value = str(value)
+    if 'e' in value or 'E' in value:
+        value = format(Decimal(value), 'f')
+    whole, _, frac = value.partition('.')
+    frac = (frac + '0' * decimals)[:decimals]
+    return int(whole or '0') * 10**decimals + (int(frac) if frac else 0)
+
+
+class _TickSide(object):
+    """One side of the book as arrays of aggregated size and order count per tick"""
+
+    def __init__(self, is_bid, window):
+        self.is_bid = is_bid
+        self.window = window
+        self.sizes = np.zeros(window, dtype=np.int64)
+        self.counts = np.zeros(window, dtype=np.int32)
+        self.base = None    #tick at index 0
+        self.overflow = {}  #tick -> [size, count] for levels outside the window
+        self.best = None
+
+    def clear(self):
+        self.sizes[:] = 0
+        self.counts[:] = 0
+        self.base = None
+        self.overflow = {}
+        self.best = None
+
+    def _better(self, tick, other):
+        return tick > other if self.is_bid else tick < other
+
+    def adjust(self, tick, size_delta, count_delta=0):
+        """Add size_delta and count_delta to the level at tick"""
+        if self.base is None:
+            self.base = tick - self.window // 2
+        i = tick - self.base
+        if 0 <= i < self.window:
+            if size_delta:
+                self.sizes[i] += size_delta
+            if not count_delta:
+                return
+            count = int(self.counts[i]) + count_delta
+            self.counts[i] = count
+        else:
+            if not count_delta:
+                if tick in self.overflow:
+                    self.overflow[tick][0] += size_delta
+                return
+            level = self.overflow.setdefault(tick, [0, 0])
+            level[0] += size_delta
+            level[1] += count_delta
+            count = level[1]
+            if count == 0:
+                del self.overflow[tick]
+
+        if count == count_delta and count > 0:
+            #new level
+            if self.best is None or self._better(tick, self.best):
+                self.best = tick
+                if not 0 <= i < self.window:
+                    self._recenter(tick)
+        elif count == 0 and tick == self.best:
+            self.best = self._next_best(tick)
+
+    def set_level(self, tick, size):
+        """Set the size at tick outright.  Used by LevelBook, where each 
+        occupied level counts as a single order"""
+        current, count = self.level(tick)
+        if size:
+            if count:
+                self.adjust(tick, size - current)
+            else:
+                self.adjust(tick, size, 1)
+        elif count:
+            self.adjust(tick, -current, -1)
+
+    def level(self, tick):
+        """Return (size, count) resting at tick"""
+        if self.base is not None:
+            i = tick - self.base
+            if 0 <= i < self.window:
+                return int(self.sizes[i]), int(self.counts[i])
+        return tuple(self.overflow.get(tick, (0, 0)))
+
+    def _window_ticks(self, start, n):
+        """Yield up to n occupied ticks in the window, from index start going worse"""
+        counts = self.counts
+        chunk = 256
+        found = 0
+        if self.is_bid:
+            hi = start + 1
+            while hi > 0 and found < n:
+                lo = max(0, hi - chunk)
+                for i in np.flatnonzero(counts[lo:hi])[::-1]:
+                    yield self.base + lo + int(i)
+                    found += 1
+                    if found == n:
+                        return
+                hi = lo
+                chunk *= 2
+        else:
+            lo = start
+            while lo < self.window and found < n:
+                hi = min(self.window, lo + chunk)
+                for i in np.flatnonzero(counts[lo:hi]):
+                    yield self.base + lo + int(i)
+                    found += 1
+                    if found == n:
+                        return
+                lo = hi
+                chunk *= 2
+
+    def _next_best(self, tick):
+        if self.base is not None:
+            start = tick - self.base + (-1 if self.is_bid else 1)
+            if 0 <= start < self.window:
+                for t in self._window_ticks(start, 1):
+                    return t
+        if not self.overflow:
+            return None
+        best = max(self.overflow) if self.is_bid else min(self.overflow)
+        self._recenter(best)
+        return best
+
+    def _recenter(self, center):
+        levels = self.overflow
+        for i in np.flatnonzero(self.counts):
+            levels[self.base + int(i)] = [int(self.sizes[i]), int(self.counts[i])]
+        self.sizes[:] = 0
+        self.counts[:] = 0
+        self.base = center - self.window // 2
+        self.overflow = {}
+        for tick, (size, count) in levels.items():
+            i = tick - self.base
+            if 0 <= i < self.window:
+                self.sizes[i] = size
+                self.counts[i] = count
+            else:
+                self.overflow[tick] = [size, count]
+
+    def top(self, n):
+        """Return up to n (tick, size) pairs with size left, best first"""
+        result = []
+        if self.best is None or n <= 0:
+            return result
+        for tick in self._window_ticks(self.best - self.base, self.window):
+            size = int(self.sizes[tick - self.base])
+            if size:
+                result.append((tick, size))
+                if len(result) == n:
+                    return result
+        #ran off the end of the window, carry on into the overflow levels
+        for tick in sorted(self.overflow, reverse=self.is_bid):
+            size = self.overflow[tick][0]
+            if size:
+                result.append((tick, size))
+                if len(result) == n:
+                    break
+        return result
+
+    def occupied(self):
+        """Return {tick: (size, count)} for every level.  Slow, for checks only"""
+        levels = {tick: tuple(level) for tick, level in self.overflow.items()}
+        if self.base is not None:
+            for i in np.flatnonzero(self.counts):
+                levels[self.base + int(i)] = (int(self.sizes[i]), int(self.counts[i]))
+        return levels
+
+
+class TickBook(object):
+    """Level-3 book engine on integer ticks
+
+    Accepts the same order dicts as cbpro.order_book.OrderBook's add, remove,
+    match and change methods.  Each side is a _TickSide and resting orders
+    are kept in an order store (see order_store.py): 'dict' for a plain dict 
+    of order_id -> [is_bid, tick, scaled size], or 'compact' for the 
+    struct-of-arrays store.
+
+    Important methods:
+    get_bid, get_ask: best prices as floats, or None if that side is empty
+    get_depth: top N levels, best first, as lists of floats
+    verify: compares the level arrays with a recompute from the resting orders
+    """
+
+    def __init__(self, quote_increment, window=65536, order_store='dict'):
+        self.price_decimals = count_decimals(quote_increment)
+        self.tick_size = to_scaled_int(quote_increment, self.price_decimals)
+        if self.tick_size <= 0:
+            raise ValueError(f"Invalid quote increment: {quote_increment}")
+        self._price_scale = 10**self.price_decimals
+        self._size_scale = 10**SIZE_DECIMALS
+        self.bids = _TickSide(True, window)
+        self.asks = _TickSide(False, window)
+        self.orders = create_order_store(order_store)
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self.orders.clear()
+
+    def to_tick(self, price):
+        return to_scaled_int(price, self.price_decimals) // self.tick_size
+
+    def to_price(self, tick):
+        return tick * self.tick_size / self._price_scale
+
+    def to_size(self, scaled_size):
+        return scaled_size / self._size_scale
+
+    def _side(self, is_bid):
+        return self.bids if is_bid else self.asks
+
+    def add(self, order):
+        order_id = order.get('order_id') or order['id']
+        is_bid = order['side'] == 'buy'
+        tick = self.to_tick(order['price'])
+        size = to_scaled_int(order.get('size') or order['remaining_size'], SIZE_DECIMALS)
+        self.orders.insert(order_id, is_bid, tick, size)
+        self._side(is_bid).adjust(tick, size, 1)
+
+    def remove(self, order):
+        resting = self.orders.pop(order['order_id'])
+        if resting is None:
+            return
+        is_bid, tick, size = resting
+        self._side(is_bid).adjust(tick, -size, -1)
+
+    def match(self, order):
+        size = to_scaled_int(order['size'], SIZE_DECIMALS)
+        resting = self.orders.reduce(order['maker_order_id'], size)
+        if resting is None:
+            return
+        is_bid, tick = resting
+        self._side(is_bid).adjust(tick, -size)
+
+    def change(self, order):
+        if 'new_size' not in order:
+            return
+        new_size = to_scaled_int(order['new_size'], SIZE_DECIMALS)
+        resting = self.orders.set_size(order['order_id'], new_size)
+        if resting is None:
+            return
+        is_bid, tick, delta = resting
+        self._side(is_bid).adjust(tick, delta)
+
+    def get_bid(self):
+        return None if self.bids.best is None else self.to_price(self.bids.best)
+
+    def get_ask(self):
+        return None if self.asks.best is None else self.to_price(self.asks.best)
+
+    def get_top_of_book(self):
+        """Return (bid, bid size, ask, ask size) as floats, None for an empty side"""
+        bids, asks = self.bids, self.asks
+        bid, ask = bids.best, asks.best
+        tick_size, price_scale, size_scale = self.tick_size, self._price_scale, self._size_scale
+        return (None if bid is None else bid * tick_size / price_scale,
+                None if bid is None else bids.level(bid)[0] / size_scale,
+                None if ask is None else ask * tick_size / price_scale,
+                None if ask is None else asks.level(ask)[0] / size_scale)
+
+    def get_depth(self, max_asks=10, max_bids=10):
+        """Return (ask_prices, ask_sizes, bid_prices, bid_sizes), best first"""
+        asks = self.asks.top(max_asks)
+        bids = self.bids.top(max_bids)
+        return ([self.to_price(t) for t, _ in asks], [self.to_size(s) for _, s in asks],
+                [self.to_price(t) for t, _ in bids], [self.to_size(s) for _, s in bids])
+
+    def verify(self):
+        """Check the level arrays and best prices against the resting orders
+
+        Raises an AssertionError describing the first mismatch.
+        """
+        expected = {True: {}, False: {}}
+        for order_id, is_bid, tick, size in self.orders.items():
+            size_count = expected[is_bid].setdefault(tick, [0, 0])
+            size_count[0] += size
+            size_count[1] += 1
+        for is_bid in (True, False):
+            side = self._side(is_bid)
+            name = 'buy' if is_bid else 'sell'
+            actual = side.occupied()
+            levels = {tick: tuple(level) for tick, level in expected[is_bid].items()}
+            assert actual == levels, f"{name}: level arrays don't match the resting orders"
+            best = (max if is_bid else min)(levels) if levels else None
+            assert side.best == best, f"{name}: best tick {side.best}, expected {best}"
+
+
+class LevelBook(TickBook):
+    """Level-2 book on integer ticks: aggregated size per price, no orders
+
+    Built from the level2 channel's 'snapshot' message and kept up to date
+    with the [side, price, size] changes of its 'l2update' messages, where a
+    size of 0 removes the level.  get_bid, get_ask and get_depth work as they
+    do on a TickBook.
+    """
+
+    def __init__(self, quote_increment, window=65536):
+        super().__init__(quote_increment, window=window)
+
+    def load(self, snapshot):
+        self.clear()
+        for side, levels in ((self.bids, snapshot['bids']), (self.asks, snapshot['asks'])):
+            for price, size in levels:
+                side.set_level(self.to_tick(price), to_scaled_int(size, SIZE_DECIMALS))
+
+    def update(self, changes):
+        for side, price, size in changes:
+            self._side(side == 'buy').set_level(self.to_tick(price), to_scaled_int(size, SIZE_DECIMALS))
+
+    def add(self, order):
+        raise TypeError("A level-2 book has no orders, see update()")
+
+    remove = match = change = add
+
+    def verify(self):
+        """Check that every level holds one 'order' and the best prices are right"""
+        for is_bid in (True, False):
+            side = self._side(is_bid)
+            name = 'buy' if is_bid else 'sell'
+            levels = side.occupied()
+            assert all(count == 1 for size, count in levels.values()), f"{name}: level counted more than once"
+            best = (max if is_bid else min)(levels) if levels else None
+            assert side.best == best, f"{name}: best tick {side.best}, expected {best}"
@@ -0,0 +1,75 @@
+"""
+Sampled cProfile captures of the trading algorithm's slowest ticks
+
+Profiling every call to trading_algorithm() would slow all of them down, so
+a TickProfiler only profiles one tick in every `every`, plus the tick after
+one that overran its budget, since slow ticks tend to come in runs.  Of the
+ticks it profiled, the `keep` slowest are written to `directory` as
+tick_<number>_<milliseconds>ms.prof, and a capture is deleted again once
+`keep` slower ones have been written.  Open them with pstats or snakeviz:
+
+    python -m pstats algorithm_profiles/tick_1200_48.1ms.prof
+
+Important classes:
+TickProfiler: should_profile() before a tick, then start() and stop()
+"""
+import bisect
+import cProfile
+import os
+
+
+class TickProfiler(object):
+    """Decides which ticks to profile and keeps the slowest captures"""
+
+    def __init__(self, directory, every=100, keep=5):
+        if every < 1 or keep < 1:
+            raise ValueError("Profile at least every tick and keep at least one capture")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every = every
+        self.keep = keep
+        self.captured = 0
+        self.kept = []   #(seconds, path), fastest first
+        self._ticks = 0
+        self._profile_next = False
+        self._profile = None
+
+    def should_profile(self):
+        """Count a tick, returning whether it should be profiled"""
+        self._ticks += 1
+        profile = self._profile_next or self._ticks % self.every == 0
+        self._profile_next = False
+        return profile
+
+    def overran(self):
+        """The tick that just finished took too long, so profile the next one"""
+        self._profile_next = True
+
+    def start(self):
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, seconds):
+        """Stop profiling the current tick, which took `seconds` (profiler
+        overhead included).  Returns the capture's path if it was kept"""
+        profile, self._profile = self._profile, None
+        profile.disable()
+        self.captured += 1
+        if len(self.kept) >= self.keep and seconds <= self.kept[0][0]:
+            return None
+        path = os.path.join(self.directory, f'tick_{self._ticks}_{seconds * 1000:.1f}ms.prof')
+        profile.dump_stats(path)
+        bisect.insort(self.kept, (seconds, path))
+        if len(self.kept) > self.keep:
+            _, dropped = self.kept.pop(0)
+            try:
+                os.remove(dropped)
+            except OSError:
+                pass
+        return path
+
+    def snapshot(self):
+        return {'directory': self.directory,
+                'every': self.every,
+                'captured': self.captured,
+                'kept': [{'seconds': seconds, 'path': path} for seconds, path in reversed(self.kept)]}
@@ -1,5 +1,5 @@
 import curses, math, time, copy
-from pygotrader import cli, order_handler, algorithm_handler
+from pygotrader import cli, order_handler, algorithm_handler, strategy_pool
 from threading import Thread
 import multiprocessing
 
@@ -28,19 +28,27 @@ class Menu(object):
     input_actions: calls on proper functions with the user input after the user hits 
     enter
     
+    Every watched product has a feed.ProductState in products.  The screen 
+    shows one product at a time, the Tab key moves on to the next one.
+    
     Note: don't use stdscr.clear() as it will cause flicker.  Use stdscr.erase()
     
     TODO: 
     - Handle horizontal resizing properly
     """
     
-    def __init__(self,ns, order_book, authenticated_client, order_handler, algorithm_file, debug = False):
+    def __init__(self,ns, order_book, authenticated_client, order_handler, algorithm_file, debug = False,
+        products=None, algorithm_options=None, strategies=None):
         self.ns = ns
         self.order_book = order_book
+        self.products = products or []
+        self.product_index = 0
         self.authenticated_client = authenticated_client
         self.order_handler = order_handler
         self.algorithm_handler = None
         self.algorithm_file = algorithm_file
+        self.strategies = strategies or [strategy_pool.parse_strategy(algorithm_file)]
+        self.algorithm_options = algorithm_options or {}
         self.debug = debug        
         self.mode = 'view'
         self.input_menu = ''
@@ -48,7 +56,7 @@ class Menu(object):
         self.bids = []
         self.highest_bid = 0.00
         self.last_match = 0.00  
-        self.product = 'BTC-USD'
+        self.product = self.products[0].product_id if self.products else 'BTC-USD'
         self.my_balances = {'USD':0.00,self.product:0.00}
         self.message = ''
         self.my_crypto = ''
@@ -106,11 +114,11 @@ class Menu(object):
     
         def info_loop():
             while not self.shutdown_event.is_set():
-                self.product = self.order_book.products
-                self.highest_bid = self.ns.highest_bid
-                self.last_match = self.ns.last_match
-                self.asks = self.ns.ui_asks
-                self.bids = self.ns.ui_bids
+                state = self.products[self.product_index]
+                self.product = state.product_id
+                self.highest_bid = state.ns.highest_bid
+                self.last_match = state.ns.last_match
+                self.asks, self.bids = state.depth_ladder.read()
                 # This is hacky because Manager dictionaries are buggy
                 # and you can't get an iterator directly from them,
                 # so we do a deep copy and turn it into a list to get an iterator from that
@@ -156,6 +164,12 @@ class Menu(object):
         self.win.refresh()
         curses.curs_set(1)
         
+    def next_product(self):
+        self.product_index = (self.product_index + 1) % len(self.products)
+        self.product = self.products[self.product_index].product_id
+        self.my_crypto = self.product.split('-')[0]
+        self.asks, self.bids = self.products[self.product_index].depth_ladder.read()
+
     def display_menu(self):
         if self.mode == 'view':
             self.menu = f"Press key for action - (Q)uit: {self.input_command}"
@@ -179,14 +193,14 @@ class Menu(object):
         
     def calculate_size(self):
         self.height,self.width = self.stdscr.getmaxyx()
-        self.askbid_spread_size = min(10,math.floor((0.8 * self.height) / 2.0))
+        max_levels = self.products[0].depth_ladder.levels if self.products else 10
+        self.askbid_spread_size = min(max_levels,math.floor((0.8 * self.height) / 2.0))
 
     # def info_loop(self):
     #     self.product = self.order_book.products
     #     self.highest_bid = self.ns.highest_bid
     #     self.last_match = self.ns.last_match
-    #     self.asks = self.ns.ui_asks
-    #     self.bids = self.ns.ui_bids
+    #     self.asks, self.bids = self.depth_ladder.read()
     #     # This is hacky because Manager dictionaries are buggy
     #     # and you can't get an iterator directly from them,
     #     # so we do a deep copy and turn it into a list to get an iterator from that
@@ -219,29 +233,32 @@ class Menu(object):
             if self.height > 3:
                 self.win.addstr(0,0,'Product\t\tBalances', curses.A_BOLD)
                 self.win.addstr(0,askbid_start_col,'Ask/Bid    Ask/Bid Depth', curses.A_BOLD)
-                self.win.addstr(1,0,f"{self.product}")
+                if len(self.products) > 1:
+                    self.win.addstr(1,0,f"{self.product} [Tab {self.product_index+1}/{len(self.products)}]")
+                else:
+                    self.win.addstr(1,0,f"{self.product}")
                 if self.mode != 'view':
                     self.win.addstr("\t\tUSD:  ")    
                     self.win.addstr("{:>10.2f}".format(self.my_balances['USD']), curses.color_pair(1)) 
-                    self.win.addstr(2, 0, "\t\t{}: ".format('BTC'))
-                    self.win.addstr("{:>10.9f}".format(self.my_balances[self.product]), curses.color_pair(1))
+                    self.win.addstr(2, 0, "\t\t{}: ".format(self.my_crypto))
+                    self.win.addstr("{:>10.9f}".format(self.my_balances.get(self.product, 0.00)), curses.color_pair(1))
         
                 self.win.addstr(1, live_data_start_col, "Last Match: {:.2f}".format(self.last_match))
                 self.win.addstr(2, live_data_start_col, "Highest Bid: {:.2f}".format(self.highest_bid))
                 
             if self.height > (self.askbid_spread_size * 2 + 1):
-                max_asks = self.askbid_spread_size
-                for idx,ask in enumerate(self.asks):
-                    if idx == max_asks:
-                        break                    
-                    self.win.addstr(1+idx,askbid_start_col,"{:.2f}      {:.2f}".format(self.asks[(max_asks-1)-idx]['price'],self.asks[(max_asks-1)-idx]['depth']), curses.color_pair(3))
+                #asks are drawn best-last so the spread sits in the middle of the ladder
+                max_asks = min(self.askbid_spread_size, len(self.asks))
+                first_ask_row = 1 + self.askbid_spread_size - max_asks
+                for idx in range(0,max_asks):
+                    price, depth = self.asks[(max_asks-1)-idx]
+                    self.win.addstr(first_ask_row+idx,askbid_start_col,"{:.2f}      {:.2f}".format(price,depth), curses.color_pair(3))
         
-                max_bids = self.askbid_spread_size
-                for idx,bid in enumerate(self.bids):
-                    if idx == max_bids:
-                        break
+                max_bids = min(self.askbid_spread_size, len(self.bids))
+                for idx in range(0,max_bids):
+                    price, depth = self.bids[idx]
                     index = 1 + self.askbid_spread_size + idx
-                    self.win.addstr(index,askbid_start_col,"{:.2f}      {:.2f}".format(bid['price'],bid['depth']), curses.color_pair(4))
+                    self.win.addstr(index,askbid_start_col,"{:.2f}      {:.2f}".format(price,depth), curses.color_pair(4))
             
             if self.height > 5:
                 self.win.addstr(4, 0, 'Orders: [▲ and ▼ to scroll]', curses.A_BOLD)
@@ -268,7 +285,8 @@ class Menu(object):
                     
                 self.win.addstr(self.height-3, 0, 'Message: {}'.format(self.message))
                 if self.algorithm_handler != None:
-                    self.win.addstr(self.height-2, 0, 'Automated trading enabled', curses.A_STANDOUT)
+                    strategies = len(self.algorithm_handler)
+                    self.win.addstr(self.height-2, 0, 'Automated trading enabled' + (f' ({strategies} strategies)' if strategies > 1 else ''), curses.A_STANDOUT)
             self.win.addstr(self.height-1, 0, self.menu)
         except curses.error:
             raise cli.CustomExit
@@ -300,6 +318,10 @@ class Menu(object):
         else:
             key_char = (chr(key_integer)).lower() #chr() can't handle -1, so this needs to be after the -1 check
         
+        if key_integer == 9 and len(self.products) > 1 and self.mode in ['normal','view']:  #Tab key
+            self.next_product()
+            return
+
         #Curses sends this key when resizing the window
         if key_integer == curses.KEY_RESIZE:
             self.calculate_size()
@@ -388,18 +410,18 @@ class Menu(object):
         try:        
             if self.mode == 'buy_market':
                     amount = float(input)
-                    self.order_handler.create_buy_order(size=amount,price=0.00,product_id=self.order_book.products)
+                    self.order_handler.create_buy_order(size=amount,price=0.00,product_id=self.product)
                     self.change_mode('normal')
             elif self.mode == 'sell_market':
                     amount = float(input)
-                    self.order_handler.create_sell_order(size=amount,price=0.00,product_id=self.order_book.products)
+                    self.order_handler.create_sell_order(size=amount,price=0.00,product_id=self.product)
                     self.change_mode('normal')
             elif self.mode == 'buy_amount':
                     self.temp_input_amount = float(input)
                     self.change_mode('buy_price')
             elif self.mode == 'buy_price':
                     price = float(input)
-                    self.order_handler.create_buy_order(size=self.temp_input_amount,price=price,product_id=self.order_book.products,type='limit')
+                    self.order_handler.create_buy_order(size=self.temp_input_amount,price=price,product_id=self.product,type='limit')
                     self.temp_input_amount = 0.00
                     self.change_mode('normal')
             elif self.mode == 'sell_amount':
@@ -407,7 +429,7 @@ class Menu(object):
                     self.change_mode('sell_price')                    
             elif self.mode == 'sell_price':
                     price = float(input)
-                    self.order_handler.create_sell_order(size=self.temp_input_amount,price=price,product_id=self.order_book.products,type='limit')
+                    self.order_handler.create_sell_order(size=self.temp_input_amount,price=price,product_id=self.product,type='limit')
                     self.temp_input_amount = 0.00
                     self.change_mode('normal')
             elif self.mode == 'cancel_order':
@@ -424,7 +446,13 @@ class Menu(object):
 
     def toggle_automated_trading(self):
         if self.algorithm_handler == None:
-            self.algorithm_handler = algorithm_handler.AlgorithmHandler(self.ns, self.authenticated_client, self.order_handler, algorithm_file=self.algorithm_file)
+            self.algorithm_handler = strategy_pool.StrategyPool(self.ns, self.authenticated_client, self.order_handler, self.strategies,
+                                                                match_buffer=self.products[0].match_buffer,
+                                                                features=self.products[0].features,
+                                                                update_signal=self.products[0].updates,
+                                                                market_snapshot=self.products[0].snapshot,
+                                                                products={s.product_id: s for s in self.products},
+                                                                **self.algorithm_options)
             self.algorithm_handler.start()
         else:
             self.algorithm_handler.close()
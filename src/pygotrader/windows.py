@@ -0,0 +1,78 @@
+"""
+Rolling time windows over the match buffer, for algorithms
+
+A RollingWindows keeps one start cursor per window length into a
+shared_state.MatchRingBuffer.  Each update() moves every window's start
+forward by a binary search over the timestamps between where it was and
+the newest match, so keeping a window current costs O(log n) in the
+matches that arrived or expired since the last update, no matter how long
+the window is.  The windows are then read as NumPy arrays, normally views
+straight into shared memory.
+
+    windows.update()
+    w = windows.window(10)
+    w.time, w.price, w.size, w.side     #the last 10 seconds, oldest first
+
+Important classes:
+RollingWindows: several window lengths over one match buffer
+Window: the columns of one window
+"""
+from collections import namedtuple
+import time
+
+
+class Window(namedtuple('Window', ['time', 'price', 'size', 'side'])):
+    """Matches in a window as NumPy arrays, oldest first
+
+    time: int64 exchange timestamps in nanoseconds since the epoch
+    price, size: float64
+    side: int8 maker side, shared_state.BUY or SELL
+    """
+    __slots__ = ()
+
+    @property
+    def count(self):
+        return len(self.time)
+
+
+class RollingWindows(object):
+    """Windows of the last N seconds of matches, for several N at once
+
+    lengths: window lengths in seconds
+    clock: returns the current time in epoch nanoseconds, by default the match 
+    buffer's clock.  Pass e.g. the latest exchange timestamp when replaying a
+    recording.
+
+    Important methods:
+    update: moves every window up to now
+    window: the matches in one of the windows as of the last update
+    """
+
+    def __init__(self, match_buffer, lengths=(10, 60, 300), clock=None):
+        self.matches = match_buffer
+        self.lengths = tuple(lengths)
+        self.clock = clock or getattr(match_buffer, 'clock', time.time_ns)
+        self._starts = {length: 0 for length in self.lengths}
+        self._end = 0
+        self.now_ns = 0
+
+    def update(self, now_ns=None):
+        if now_ns is None:
+            now_ns = self.clock()
+        matches = self.matches
+        end = matches.cursor
+        for length, start in self._starts.items():
+            self._starts[length] = matches.cursor_at_time(now_ns - int(length * 1e9), start=start, end=end)
+        self._end = end
+        self.now_ns = now_ns
+
+    def window(self, seconds, copy=False):
+        """Matches from the `seconds` seconds before the last update.  seconds 
+        must be one of the lengths.  With copy=False the arrays may be views
+        that are overwritten once the buffer wraps around"""
+        try:
+            start = self._starts[seconds]
+        except KeyError:
+            raise ValueError(f"No {seconds} second window, the lengths are {self.lengths}") from None
+        columns = self.matches.between(start, self._end, copy)
+        return Window(columns.ts_ns, columns.price, columns.size, columns.side)
@@ -0,0 +1,235 @@
+import datetime
+import http.server
+import json
+import random
+import threading
+import time
+import types
+import uuid
+from decimal import Decimal
+
+import pytest
+
+from pygotrader import pygo_order_book
+
+
+def make_feed(seed=1, orders=200, messages=2000, product_id='BTC-USD', start_sequence=1000):
+    """Build a level-3 snapshot and a consistent stream of full channel messages
+
+    The stream is generated against a model book, so every done/match/change
+    refers to an order that is actually resting at that moment.  Prices are
+    clustered around 100.00 so levels hold several orders each.
+    """
+    rng = random.Random(seed)
+    book = {'buy': {}, 'sell': {}}   #order_id -> [price, size] in arrival order
+    clock = datetime.datetime(2019, 8, 14, 20, 42, 27, 265000)
+
+    def new_order(side):
+        offset = rng.randint(1, 40)
+        price = Decimal(10000 - offset if side == 'buy' else 10000 + offset) / 100
+        size = Decimal(rng.randint(1, 500000000)) / Decimal(100000000)
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4)), price, size
+
+    def stamp():
+        return clock.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    for _ in range(orders):
+        side = rng.choice(('buy', 'sell'))
+        order_id, price, size = new_order(side)
+        book[side][order_id] = [price, size]
+    snapshot = {
+        'sequence': start_sequence,
+        'bids': [[str(p), str(s), i] for i, (p, s) in book['buy'].items()],
+        'asks': [[str(p), str(s), i] for i, (p, s) in book['sell'].items()],
+    }
+
+    #the first message only triggers the snapshot load, like on a live connection
+    stream = [{'type': 'received', 'product_id': product_id, 'sequence': start_sequence,
+               'time': stamp(), 'side': 'buy', 'order_type': 'market'}]
+    sequence = start_sequence
+    while len(stream) < messages:
+        sequence += 1
+        clock += datetime.timedelta(microseconds=rng.randint(1, 200000))
+        side = rng.choice(('buy', 'sell'))
+        kind = rng.random()
+        base = {'product_id': product_id, 'sequence': sequence, 'time': stamp(), 'side': side}
+        if kind < 0.4 or len(book[side]) < 5:
+            order_id, price, size = new_order(side)
+            book[side][order_id] = [price, size]
+            stream.append(dict(base, type='open', order_id=order_id, price=str(price),
+                               remaining_size=str(size)))
+        elif kind < 0.7:
+            order_id = rng.choice(list(book[side]))
+            price, size = book[side].pop(order_id)
+            stream.append(dict(base, type='done', order_id=order_id, price=str(price),
+                               remaining_size=str(size), reason='canceled'))
+        elif kind < 0.9:
+            best = (max if side == 'buy' else min)(p for p, _ in book[side].values())
+            maker_id = next(i for i, (p, _) in book[side].items() if p == best)
+            price, size = book[side][maker_id]
+            fill = size if rng.random() < 0.5 else (size / 2).quantize(Decimal('0.00000001'))
+            book[side][maker_id][1] = size - fill
+            stream.append(dict(base, type='match', trade_id=sequence, maker_order_id=maker_id,
+                               taker_order_id=str(uuid.UUID(int=rng.getrandbits(128), version=4)), price=str(price), size=str(fill)))
+            if fill == size:
+                sequence += 1
+                del book[side][maker_id]
+                stream.append(dict(base, type='done', sequence=sequence, order_id=maker_id,
+                                   price=str(price), remaining_size='0', reason='filled'))
+        else:
+            order_id = rng.choice(list(book[side]))
+            price, size = book[side][order_id]
+            new_size = (size * Decimal('0.5')).quantize(Decimal('0.00000001'))
+            book[side][order_id][1] = new_size
+            stream.append(dict(base, type='change', order_id=order_id, price=str(price),
+                               old_size=str(size), new_size=str(new_size)))
+    return snapshot, stream
+
+
+@pytest.fixture
+def synthetic_feed():
+    return make_feed()
+
+
+@pytest.fixture
+def book_factory(monkeypatch):
+    """Return a function that builds an offline PygoOrderBook for a snapshot"""
+    def factory(snapshot, **kwargs):
+        ns = types.SimpleNamespace(highest_bid=0.00, last_match=0.00, lowest_ask=0.00,
+                                   message='', my_orders={})
+        book = pygo_order_book.PygoOrderBook(ns, **kwargs)
+        monkeypatch.setattr(book._client, 'get_product_order_book',
+                            lambda product_id, level: snapshot)
+        return book
+    return factory
+
+
+def snapshot_of(book):
+    """Level-3 snapshot of a sorted-engine PygoOrderBook, like the REST API returns"""
+    return {
+        'sequence': book._sequence,
+        'bids': [[str(p), str(o['size']), o['id']] for p, orders in book._bids.items() for o in orders],
+        'asks': [[str(p), str(o['size']), o['id']] for p, orders in book._asks.items() for o in orders],
+    }
+
+
+@pytest.fixture
+def rest_standin():
+    """Start a local stand-in for the exchange's REST API
+
+    Returns (api_url, responses).  Every GET pops the next (status, body) off
+    the front of responses, or answers 404 once it's empty.  The paths 
+    requested are collected in responses.requests.
+    """
+    class Responses(list):
+        requests = []
+
+    responses = Responses()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            responses.requests.append(self.path)
+            status, body = responses.pop(0) if responses else (404, {'message': 'NotFound'})
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}', responses
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def order_standin():
+    """Start a local stand-in for the exchange's order endpoints
+
+    Answers POST /orders, DELETE /orders/<id> and GET /orders like the REST
+    API does, over keep-alive HTTP/1.1, after sleeping `latency` seconds.
+    Orders for product 'BAD-USD' are rejected with a 400.  Every request is
+    recorded in standin.requests as (method, path, headers, body, connection),
+    and standin.peak is the most orders and cancels that were being answered
+    at once.
+    """
+    standin = types.SimpleNamespace(latency=0.0, requests=[], peak=0, active=0, connections=set(),
+                                    lock=threading.Lock())
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _answer(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            with standin.lock:
+                standin.requests.append((self.command, self.path, dict(self.headers), body, self.client_address[1]))
+                standin.connections.add(self.client_address[1])
+                if self.command != 'GET':
+                    standin.active += 1
+                    standin.peak = max(standin.peak, standin.active)
+            try:
+                time.sleep(standin.latency)
+                status, response = self._respond(body)
+            finally:
+                if self.command != 'GET':
+                    with standin.lock:
+                        standin.active -= 1
+            payload = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _respond(self, body):
+            if self.command == 'GET' and self.path.startswith('/orders'):
+                return 200, []
+            if self.command == 'POST' and self.path == '/orders':
+                order = json.loads(body)
+                if order['product_id'] == 'BAD-USD':
+                    return 400, {'message': 'Product not found'}
+                return 200, dict(order, id=str(uuid.uuid4()), status='pending')
+            if self.command == 'DELETE' and self.path.startswith('/orders/'):
+                return 200, [self.path[len('/orders/'):]]
+            return 404, {'message': 'NotFound'}
+
+        do_GET = do_POST = do_DELETE = _answer
+
+        def log_message(self, *args):
+            pass
+
+    class Server(http.server.ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 64   #a burst connects all at once
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    standin.url = f'http://127.0.0.1:{server.server_address[1]}'
+    yield standin
+    server.shutdown()
+    server.server_close()
+
+
+def serve_frames(frames, hold_open=False):
+    """Start a local websocket server that sends frames to each client
+
+    The connection is closed once everything is sent, unless hold_open is 
+    set, in which case it stays open until the client disconnects.
+    """
+    import websockets
+
+    async def handler(websocket):
+        await websocket.recv()   #subscribe message
+        for frame in frames:
+            await websocket.send(frame)
+        if hold_open:
+            await websocket.wait_closed()
+
+    return websockets.serve(handler, '127.0.0.1', 0)
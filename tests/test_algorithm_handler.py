@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+import types
+
+import pytest
+
+from pygotrader import algorithm_handler, shared_state
+from pygotrader.algorithm_handler import AlgorithmHandler, algorithm_arguments
+
+AVAILABLE = {'ns': 1, 'order_handler': 2, 'matches': 3, 'products': 4}
+
+
+def test_only_declared_arguments_are_passed():
+    def trading_algorithm(ns, order_handler, asks=None, bids=None, matches=None):
+        pass
+    assert algorithm_arguments(trading_algorithm, AVAILABLE) == {'ns': 1, 'order_handler': 2, 'matches': 3}
+
+def test_var_keyword_gets_everything():
+    def trading_algorithm(ns, **kwargs):
+        pass
+    assert algorithm_arguments(trading_algorithm, AVAILABLE) == AVAILABLE
+
+
+def test_event_schedule_runs_on_updates(tmp_path):
+    algorithm_file = tmp_path / 'algorithm.py'
+    algorithm_file.write_text(
+        "import time\n"
+        "def trading_algorithm(ns):\n"
+        "    ns.runs.append(time.monotonic())\n"
+        "    if len(ns.runs) == 3:\n"
+        "        ns.done.set()\n")
+    signal = shared_state.UpdateSignal()
+    ns = types.SimpleNamespace(message='', runs=[])
+    handler = AlgorithmHandler(ns, None, None, algorithm_file=str(algorithm_file), schedule='event',
+                               update_signal=signal, max_rate=50.0)
+    ns.done = handler.shutdown_event
+    runs = ns.runs
+
+    def feed():
+        while not handler.shutdown_event.is_set():
+            signal.notify()
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=feed)
+    thread.start()
+    handler.main_loop(ns, handler.shutdown_event)
+    thread.join()
+
+    assert len(runs) == 3
+    assert all(b - a >= 1 / 50.0 - 0.002 for a, b in zip(runs, runs[1:]))
+    stats = handler.stats.snapshot()
+    assert stats['wakeups'] == 3
+    assert stats['coalesced'] > 0
+    assert stats['feed_to_decision']['count'] == 3
+    assert ns.algorithm_stats['runs'] >= 1
+
+def test_event_schedule_needs_a_signal():
+    with pytest.raises(ValueError):
+        AlgorithmHandler(None, None, None, schedule='event')
+
+
+def test_reload_swaps_in_new_versions_and_keeps_a_broken_one_out(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    algorithm_file = tmp_path / 'algorithm.py'
+    version = "def trading_algorithm(ns):\n    ns.seen.add({})\n"
+    algorithm_file.write_text(version.format(1))
+    ns = types.SimpleNamespace(message='', seen=set())
+    handler = AlgorithmHandler(ns, None, None, algorithm_file=str(algorithm_file), run_rate=0.0)
+    thread = threading.Thread(target=handler.main_loop, args=(ns, handler.shutdown_event))
+    thread.start()
+    try:
+        def wait_for(condition):
+            deadline = time.monotonic() + 5
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert condition()
+
+        wait_for(lambda: 1 in ns.seen)
+        algorithm_file.write_text("def trading_algorithm(ns):\n    ns.seen.add(2\n")   #half saved
+        wait_for(lambda: 'still running the previous version' in ns.message)
+        assert 'SyntaxError' in (tmp_path / 'algorithm_error.txt').read_text()
+        ns.seen.clear()
+        wait_for(lambda: 1 in ns.seen)
+
+        replacement = tmp_path / 'algorithm.py.tmp'
+        replacement.write_text(version.format(3))
+        replacement.replace(algorithm_file)   #how a lot of editors save
+        wait_for(lambda: 3 in ns.seen)
+    finally:
+        handler.shutdown_event.set()
+        thread.join()
+    reload = handler.reloader.stats.snapshot()
+    assert (reload['reloads'], reload['failures']) == (1, 1)
+    assert reload['swap_gap']['count'] == 1
+    assert reload['load_time']['count'] == 2
+
+def test_ticks_are_timed_and_the_slowest_profiled(tmp_path):
+    algorithm_file = tmp_path / 'algorithm.py'
+    algorithm_file.write_text(
+        "import time\n"
+        "def trading_algorithm(ns):\n"
+        "    ns.ticks += 1\n"
+        "    time.sleep(0.03 if ns.ticks in (4, 9) else 0)\n")
+    ns = types.SimpleNamespace(message='', ticks=0)
+    handler = AlgorithmHandler(ns, None, None, algorithm_file=str(algorithm_file), run_rate=0.01,
+                               profile_dir=str(tmp_path / 'profiles'), profile_every=3)
+    handler.profiler = algorithm_handler.TickProfiler(handler.profile_dir, every=3, keep=2)
+    handler.algorithm = algorithm_handler.AlgorithmReloader(str(algorithm_file), {'ns': ns}, use_inotify=False).load().module
+    handler.kwargs = {'ns': ns}
+    for _ in range(12):
+        handler.run_algorithm()
+
+    stats = handler.stats.snapshot()
+    #ticks 3, 6, 9 and 12 are sampled, and 5 because 4 overran
+    assert stats['profiled'] == 5
+    #every tick is timed, profiled or not
+    assert stats['tick_time']['count'] == 12
+    assert stats['overruns'] == 2
+    assert stats['tick_time']['max'] >= 0.03
+    assert 0 < stats['tick_time']['p50'] < 0.03
+    profiles = handler.profiler.snapshot()
+    assert profiles['captured'] == 5
+    assert len(profiles['kept']) == 2
+    assert profiles['kept'][0]['seconds'] >= 0.03   #tick 9, slowest first
+    assert sorted(p.name for p in (tmp_path / 'profiles').iterdir()) == \
+        sorted(os.path.basename(p['path']) for p in profiles['kept'])
+
+def test_default_budget_follows_the_schedule():
+    assert AlgorithmHandler(None, None, None, run_rate=0.25).stats.budget == 0.25
+    signal = shared_state.UpdateSignal()
+    assert AlgorithmHandler(None, None, None, schedule='event', update_signal=signal, max_rate=10).stats.budget == 0.1
+    assert AlgorithmHandler(None, None, None, tick_budget=0.5).stats.budget == 0.5
+
+def test_snapshot_is_read_once_per_run(tmp_path):
+    algorithm_file = tmp_path / 'algorithm.py'
+    algorithm_file.write_text(
+        "def trading_algorithm(ns, snapshot, bids):\n"
+        "    ns.seen.append((snapshot.version, snapshot.bid, bids is snapshot.bids))\n")
+    ns = types.SimpleNamespace(message='', seen=[])
+    market = shared_state.SharedMarketSnapshot(levels=2)
+    try:
+        handler = AlgorithmHandler(ns, None, None, algorithm_file=str(algorithm_file), market_snapshot=market)
+        available = {'ns': ns, 'snapshot': None, 'asks': None, 'bids': None}
+        reloader = algorithm_handler.AlgorithmReloader(str(algorithm_file), available, use_inotify=False)
+        loaded = reloader.load()
+        handler.algorithm, handler.kwargs = loaded.module, loaded.kwargs
+        assert sorted(handler.kwargs) == ['bids', 'ns', 'snapshot']
+        handler.run_algorithm()
+        market.publish([101.0], [1.0], [100.0], [2.0])
+        handler.run_algorithm()
+        assert ns.seen[0][0] == 0
+        assert ns.seen[1] == (1, 100.0, True)
+    finally:
+        market.close()
+        market.unlink()
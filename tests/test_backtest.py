@@ -0,0 +1,164 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import make_feed
+from pygotrader import backtest, feed_recorder, shared_state
+from pygotrader.pygo_order_book import parse_timestamp_ns
+
+
+@pytest.fixture
+def recording(tmp_path):
+    snapshot, stream = make_feed(messages=3000)
+    path = tmp_path / 'feed.gz'
+    with feed_recorder.FeedRecorder(path) as recorder:
+        start_ns = parse_timestamp_ns(stream[0]['time'])
+        recorder.record_snapshot(snapshot, recv_ns=start_ns, product_id='BTC-USD')
+        for message in stream:
+            recorder.record_frame(json.dumps(message), recv_ns=parse_timestamp_ns(message['time']))
+    return path, snapshot, stream
+
+def write_algorithm(tmp_path, source):
+    path = tmp_path / 'algorithm.py'
+    path.write_text(source)
+    return str(path)
+
+
+def test_market_orders_walk_the_book_after_the_latency(book_factory):
+    snapshot = {'sequence': 1, 'bids': [['99.00', '1.0', 'b1']],
+                'asks': [['101.00', '0.5', 'a1'], ['102.00', '2.0', 'a2']]}
+    book = book_factory(snapshot)
+    book.on_message({'type': 'heartbeat', 'sequence': 1})
+    orders = backtest.SimulatedOrderHandler(book, book.ns, latency=0.1, taker_fee=0.01)
+    orders.advance(10**9)
+    orders.create_buy_order(size='1.0', price='0', product_id='BTC-USD')
+    orders.advance(10**9 + 5 * 10**7)
+    assert orders.fills == []
+    orders.advance(10**9 + 10**8)
+    assert [(f.price, f.size, f.liquidity) for f in orders.fills] == [(101.0, 0.5, 'taker'), (102.0, 0.5, 'taker')]
+    assert orders.position == 1.0
+    assert orders.fees == pytest.approx(0.01 * (50.5 + 51.0))
+    assert orders.cash == pytest.approx(-(50.5 + 51.0) * 1.01)
+    assert orders.equity(101.0) == pytest.approx(orders.cash + 101.0)
+
+def test_taken_liquidity_is_used_up_until_the_book_changes(book_factory):
+    snapshot = {'sequence': 1, 'bids': [['99.00', '1.0', 'b1']],
+                'asks': [['101.00', '0.5', 'a1'], ['102.00', '2.0', 'a2']]}
+    book = book_factory(snapshot)
+    book.on_message({'type': 'heartbeat', 'sequence': 1})
+    orders = backtest.SimulatedOrderHandler(book, book.ns, latency=0)
+    for _ in range(3):
+        orders.create_buy_order(size=1.0, price=None, product_id='BTC-USD')
+    orders.advance(10**9)
+    assert [(f.price, f.size) for f in orders.fills] == [(101.0, 0.5), (102.0, 0.5), (102.0, 1.0), (102.0, 0.5)]
+    assert orders.position == 2.5
+    assert orders.rejected == 0
+    orders.create_buy_order(size=1.0, price=None, product_id='BTC-USD')
+    orders.advance(2 * 10**9)
+    assert orders.rejected == 1   #nothing left
+    orders.on_book_update()
+    orders.create_buy_order(size=0.5, price=None, product_id='BTC-USD')
+    orders.advance(3 * 10**9)
+    assert orders.fills[-1][3:5] == (101.0, 0.5)
+
+def test_market_orders_can_leave_the_price_out(book_factory):
+    snapshot = {'sequence': 1, 'bids': [['99.00', '1.0', 'b1']], 'asks': [['101.00', '1.0', 'a1']]}
+    book = book_factory(snapshot)
+    book.on_message({'type': 'heartbeat', 'sequence': 1})
+    orders = backtest.SimulatedOrderHandler(book, book.ns, latency=0)
+    orders.create_buy_order(size=0.5, price=None, product_id='BTC-USD')
+    orders.create_sell_order(size='0.5', price=None, product_id='BTC-USD')
+    orders.advance(10**9)
+    assert [(f.side, f.price, f.size) for f in orders.fills] == [('buy', 101.0, 0.5), ('sell', 99.0, 0.5)]
+
+def test_limit_orders_are_post_only_and_fill_on_trade_through(book_factory):
+    snapshot = {'sequence': 1, 'bids': [['99.00', '1.0', 'b1']], 'asks': [['101.00', '1.0', 'a1']]}
+    book = book_factory(snapshot)
+    book.on_message({'type': 'heartbeat', 'sequence': 1})
+    orders = backtest.SimulatedOrderHandler(book, book.ns, latency=0.0)
+    orders.create_buy_order(size=1.0, price=101.0, product_id='BTC-USD', type='limit')
+    orders.create_buy_order(size=1.0, price=100.0, product_id='BTC-USD', type='limit')
+    orders.advance(1)
+    assert orders.rejected == 1
+    assert [o['price'] for o in book.ns.my_orders.values()] == [100.0]
+
+    orders.on_match(100.0, 5.0)   #at our price, we might still be behind the queue
+    assert orders.fills == []
+    orders.on_match(99.5, 0.25)
+    orders.on_match(99.0, 5.0)
+    assert [(f.price, f.size, f.liquidity) for f in orders.fills] == [(100.0, 0.25, 'maker'), (100.0, 0.75, 'maker')]
+    assert book.ns.my_orders == {}
+
+    order_id = orders.create_sell_order(size=1.0, price=102.0, product_id='BTC-USD', type='limit')
+    orders.advance(2)
+    orders.create_cancel_order(order_id)
+    orders.advance(3)
+    orders.on_match(103.0, 1.0)
+    assert len(orders.fills) == 2
+
+def test_backtest_runs_the_unchanged_algorithm(recording, tmp_path):
+    path, snapshot, stream = recording
+    algorithm = write_algorithm(tmp_path,
+        "calls = []\n"
+        "def trading_algorithm(ns, order_handler, asks, bids, matches, params):\n"
+        "    calls.append((asks[0, 0], bids[0, 0], ns.lowest_ask, ns.highest_bid, matches.last(30).count))\n"
+        "    if len(calls) == 3:\n"
+        "        order_handler.create_buy_order(size=params['size'], price=0, product_id='BTC-USD')\n"
+        "    elif len(calls) == 50:\n"
+        "        order_handler.create_sell_order(size=params['size'], price=0, product_id='BTC-USD')\n")
+    result = backtest.run_backtest(path, algorithm, params={'size': 0.001}, interval=1.0, latency=0.0)
+    recorded_seconds = (parse_timestamp_ns(stream[-1]['time']) - parse_timestamp_ns(stream[0]['time'])) / 1e9
+    assert result.seconds == pytest.approx(recorded_seconds)
+    assert recorded_seconds / 1.0 * 0.5 < result.runs <= recorded_seconds / 1.0 + 1
+    assert [f.side for f in result.fills] == ['buy', 'sell']
+    assert result.position == pytest.approx(0.0)
+    assert result.equity == pytest.approx(result.cash)
+    assert result.fees == pytest.approx(0.005 * result.volume)
+    assert result.equity < 0   #crossed the spread twice and paid fees
+
+def test_vectorized_backtest(tmp_path):
+    algorithm = write_algorithm(tmp_path,
+        "import numpy as np\n"
+        "def vectorized_algorithm(matches, size=1.0):\n"
+        "    target = np.zeros(len(matches.price))\n"
+        "    target[1:3] = size\n"
+        "    return target\n")
+    second = 10**9
+    matches = shared_state.MatchColumns(np.arange(5), np.array([0, 1, 2, 3, 4]) * second,
+                                        np.array([100.0, 101.0, 103.0, 102.0, 104.0]), np.ones(5),
+                                        np.ones(5, dtype=np.int8))
+    result = backtest.run_vectorized(matches, algorithm, {'size': 2.0}, latency=0.5, fee=0.01)
+    #bought 2 at 103 after trade 1, sold 2 at 104 after trade 3
+    assert result.fills == 2
+    assert result.position == 0.0
+    assert result.volume == pytest.approx(2 * 103 + 2 * 104)
+    assert result.equity == pytest.approx(2 * (104 - 103) - 0.01 * (2 * 103 + 2 * 104))
+
+def test_vectorized_matches_the_recording(recording, tmp_path):
+    path, snapshot, stream = recording
+    matches = backtest.load_matches(path)
+    trades = [m for m in stream if m['type'] == 'match']
+    assert matches.price.tolist() == [float(m['price']) for m in trades]
+
+def test_sweep_across_processes(recording, tmp_path):
+    path, snapshot, stream = recording
+    algorithm = write_algorithm(tmp_path,
+        "import numpy as np\n"
+        "def vectorized_algorithm(matches, size=1.0, every=2):\n"
+        "    target = np.zeros(len(matches.price))\n"
+        "    target[::every] = size\n"
+        "    return target\n"
+        "def trading_algorithm(ns, order_handler, params):\n"
+        "    order_handler.create_buy_order(size=params['size'], price=0, product_id='BTC-USD')\n")
+    results = backtest.sweep(path, algorithm, {'size': [0.5, 1.0], 'every': [2, 3]}, vectorized=True, workers=2)
+    assert sorted(tuple(r.params.values()) for r in results) == [(0.5, 2), (0.5, 3), (1.0, 2), (1.0, 3)]
+    assert [r.equity for r in results] == sorted((r.equity for r in results), reverse=True)
+    matches = backtest.load_matches(path)
+    expected = backtest.run_vectorized(matches, algorithm, {'size': 1.0, 'every': 3})
+    assert next(r for r in results if r.params == {'size': 1.0, 'every': 3}).equity == pytest.approx(expected.equity)
+
+    results = backtest.sweep(path, algorithm, {'size': [0.001, 0.002]}, workers=2, interval=5.0)
+    positions = {r.params['size']: r.position for r in results}
+    assert results[0].runs == results[1].runs > 0
+    assert positions[0.002] == pytest.approx(2 * positions[0.001]) and positions[0.001] > 0
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+import types
+
+from pygotrader import colocated, order_handler
+
+
+class FakeClient(object):
+    """Stands in for cbpro's AuthenticatedClient, answering after `delay` seconds"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.orders = []
+        self.threads = set()
+
+    def place_order(self, **order):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        self.orders.append(order)
+        return {'id': f'order-{len(self.orders)}', 'status': 'pending'}
+
+    def cancel_order(self, order_id):
+        return [order_id]
+
+
+def start_strategy(tmp_path, source, client, books, **options):
+    (tmp_path / 'fast.py').write_text(source)
+    strategy = colocated.ColocatedStrategy(str(tmp_path / 'fast.py'), order_handler.AsyncOrderClient(client),
+                                           ns=types.SimpleNamespace(message=''), **options)
+    strategy.attach(books)
+    return strategy.start()
+
+
+def test_strategy_runs_inline_with_the_live_book(tmp_path, monkeypatch, synthetic_feed, book_factory):
+    monkeypatch.chdir(tmp_path)
+    snapshot, stream = synthetic_feed
+    book = book_factory(snapshot)
+    client = FakeClient(delay=0.05)
+    strategy = start_strategy(tmp_path,
+        "seen = []\n"
+        "async def trading_algorithm(book, messages, orders, product_id):\n"
+        "    seen.append((book.get_bid(), messages[-1]['sequence'], product_id))\n"
+        "    if len(seen) == 1:\n"
+        "        order = await orders.buy(0.01, None, product_id)\n"
+        "        seen.append(order['id'])\n",
+        client, {book.product_id: book}, budget=None)
+
+    async def feed():
+        book.on_messages(stream[:100])
+        #the call got as far as its order before the book moved on
+        assert strategy.function.__globals__['seen'] == [(book.get_bid(), stream[99]['sequence'], 'BTC-USD')]
+        book.on_messages(stream[100:200])   #order still in flight
+        while strategy._task is not None:
+            await asyncio.sleep(0.01)
+        book.on_messages(stream[200:300])
+
+    try:
+        asyncio.run(feed())
+        seen = strategy.function.__globals__['seen']
+        assert seen[1] == 'order-1'
+        assert seen[2][1] == stream[299]['sequence']
+        assert client.orders[0]['client_oid'] in book._expected_client_oids
+        assert 'order-1' in book.my_order_ids
+        assert all(name.startswith('order-client') for name in client.threads)
+        stats = strategy.stats.snapshot()
+        assert (stats['runs'], stats['coalesced'], stats['overruns']) == (2, 1, 0)
+        assert strategy.order_client.snapshot()['placed'] == 1
+    finally:
+        strategy.close()
+
+def test_overrunning_strategy_is_cancelled_and_benched(tmp_path, monkeypatch, synthetic_feed, book_factory):
+    monkeypatch.chdir(tmp_path)
+    snapshot, stream = synthetic_feed
+    book = book_factory(snapshot)
+    client = FakeClient()
+    strategy = start_strategy(tmp_path,
+        "import asyncio, time\n"
+        "async def trading_algorithm(orders):\n"
+        "    await orders.cancel('x')\n"
+        "    time.sleep(0.01)\n"
+        "    await asyncio.sleep(0)\n"
+        "    await orders.buy(0.01, None, 'BTC-USD')\n",
+        client, {book.product_id: book}, budget=0.005, max_overruns=2)
+
+    async def feed():
+        for i in range(4):
+            book.on_messages(stream[i * 10:(i + 1) * 10])
+            while strategy._task is not None:
+                await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(feed())
+        stats = strategy.stats.snapshot()
+        #cancelled before getting to the buy, twice, then benched
+        assert client.orders == []
+        assert (stats['runs'], stats['overruns'], stats['cancelled']) == (2, 2, 2)
+        assert (stats['suspensions'], stats['skipped']) == (1, 2)
+        assert stats['loop_time']['min'] >= 0.01
+        assert 'budget' in strategy.ns.message
+    finally:
+        strategy.close()
+
+def test_strategy_has_to_be_async(tmp_path, monkeypatch, book_factory):
+    monkeypatch.chdir(tmp_path)
+    book = book_factory(None)
+    strategy = start_strategy(tmp_path, "def trading_algorithm(book):\n    pass\n", FakeClient(),
+                              {book.product_id: book})
+    try:
+        assert strategy.function is None
+        assert 'async def' in (tmp_path / 'algorithm_error_colocated.txt').read_text()
+    finally:
+        strategy.close()
+
+def test_errors_are_written_out_and_bench_the_strategy(tmp_path, monkeypatch, synthetic_feed, book_factory):
+    monkeypatch.chdir(tmp_path)
+    snapshot, stream = synthetic_feed
+    book = book_factory(snapshot)
+    strategy = start_strategy(tmp_path, "async def trading_algorithm(book):\n    1 / 0\n", FakeClient(),
+                              {book.product_id: book})
+
+    async def feed():
+        book.on_messages(stream[:10])
+        book.on_messages(stream[10:20])
+
+    try:
+        asyncio.run(feed())
+        assert strategy.stats.errors == 1
+        assert strategy.stats.skipped == 1
+        assert 'ZeroDivisionError' in (tmp_path / 'algorithm_error_colocated.txt').read_text()
+    finally:
+        strategy.close()
+
+def test_updates_outside_an_event_loop_are_skipped(tmp_path, monkeypatch, synthetic_feed, book_factory):
+    monkeypatch.chdir(tmp_path)
+    snapshot, stream = synthetic_feed
+    book = book_factory(snapshot)
+    strategy = start_strategy(tmp_path, "async def trading_algorithm(book):\n    pass\n", FakeClient(),
+                              {book.product_id: book})
+    try:
+        book.on_messages(stream[:10])
+        assert book._sequence == stream[9]['sequence']
+        assert strategy.stats.skipped == 1
+        assert strategy.stats.runs.total == 0
+    finally:
+        strategy.close()
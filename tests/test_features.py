@@ -0,0 +1,77 @@
+import math
+
+import pytest
+
+from conftest import make_feed
+from pygotrader import features, pygo_order_book, shared_state
+
+
+def test_order_flow_imbalance():
+    engine = features.FeatureEngine(windows=(10,))
+    engine.on_top_of_book(0, 100.0, 1.0, 101.0, 2.0)
+    assert engine.ofi == 0.0
+    engine.on_top_of_book(1, 100.0, 3.0, 101.0, 2.0)   #more size on the bid
+    assert engine.ofi == 2.0
+    engine.on_top_of_book(2, 100.5, 1.0, 101.0, 2.0)   #bid improved
+    assert engine.ofi == 3.0
+    engine.on_top_of_book(3, 100.5, 1.0, 100.8, 4.0)   #ask improved
+    assert engine.ofi == -1.0
+    engine.on_top_of_book(4, 100.5, 1.0, 101.0, 1.0)   #best ask taken out
+    assert engine.ofi == 3.0
+
+def test_top_of_book_features():
+    engine = features.FeatureEngine(levels=2, windows=(10,))
+    engine.on_top_of_book(0, 100.0, 3.0, 102.0, 1.0)
+    values = dict(zip(engine.fields, engine.values(ask_sizes=[1.0, 1.0, 50.0], bid_sizes=[3.0, 3.0])))
+    assert values['spread'] == 2.0
+    assert values['mid'] == 101.0
+    assert values['microprice'] == (100.0 * 1.0 + 102.0 * 3.0) / 4.0
+    assert values['imbalance'] == (6.0 - 2.0) / 8.0
+    assert math.isnan(values['vwap_10s'])
+
+def test_trade_windows_expire():
+    engine = features.FeatureEngine(windows=(10, 60))
+    second = 10**9
+    engine.on_trade(0, 100.0, 1.0)
+    engine.on_trade(30 * second, 110.0, 1.0)
+    engine.on_trade(35 * second, 120.0, 3.0)
+    values = dict(zip(engine.fields, engine.values()))
+    assert values['vwap_10s'] == pytest.approx((110.0 + 360.0) / 4.0)
+    assert values['volume_60s'] == 5.0
+    assert values['last_price'] == 120.0
+    assert values['timestamp'] == 35.0
+
+@pytest.mark.parametrize('book_engine', ['sorted', 'tick'])
+def test_book_publishes_features(book_engine, book_factory):
+    snapshot, stream = make_feed(seed=3)
+    record = shared_state.SharedRecord(features.feature_names())
+    try:
+        book = book_factory(snapshot, feature_record=record, book_engine=book_engine, quote_increment='0.01')
+        reference = features.FeatureEngine()
+        for message in stream:
+            book.on_message(message)
+            if not book.resyncing:
+                if message['type'] == 'match':
+                    reference.on_trade(pygo_order_book.parse_timestamp_ns(message['time']),
+                                       float(message['price']), float(message['size']))
+                reference.on_top_of_book(pygo_order_book.parse_timestamp_ns(message['time']),
+                                         *book.get_top_of_book())
+        published = record.read()
+        ask_prices, ask_sizes, bid_prices, bid_sizes = book.get_depth(5, 5)
+        expected = dict(zip(reference.fields, reference.values(ask_sizes, bid_sizes)))
+        assert published['bid'] == float(book.get_bid())
+        assert published['ask'] == float(book.get_ask())
+        for name, value in expected.items():
+            assert published[name] == pytest.approx(value, nan_ok=True), name
+    finally:
+        record.close()
+        record.unlink()
+
+def test_book_rejects_mismatched_record(book_factory):
+    record = shared_state.SharedRecord(('bid',))
+    try:
+        with pytest.raises(ValueError):
+            book_factory(None, feature_record=record)
+    finally:
+        record.close()
+        record.unlink()
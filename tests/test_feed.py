@@ -0,0 +1,91 @@
+import asyncio
+import itertools
+import json
+
+import pytest
+
+from conftest import make_feed, serve_frames
+from pygotrader import feed
+
+PRODUCTS = ['BTC-USD', 'ETH-USD', 'LTC-USD']
+
+
+@pytest.mark.parametrize('frame', ['{"type":"open","product_id":"ETH-USD","sequence":1}',
+                                   '{"type": "open", "product_id": "ETH-USD", "sequence": 1}',
+                                   b'{"product_id" : "ETH-USD"}'])
+def test_product_of(frame):
+    assert feed.product_of(frame) == 'ETH-USD'
+
+def test_product_of_without_product():
+    assert feed.product_of('{"type":"subscriptions","channels":[{"product_ids":["BTC-USD"]}]}') is None
+
+@pytest.fixture
+def feeds():
+    """(snapshot, stream) per product, and all frames interleaved as one connection would see them"""
+    streams = {p: make_feed(seed=i + 1, orders=60, messages=600, product_id=p) for i, p in enumerate(PRODUCTS)}
+    frames = [json.dumps(m) for m in itertools.chain.from_iterable(
+        itertools.zip_longest(*(stream for _, stream in streams.values()))) if m is not None]
+    frames.insert(5, json.dumps({'type': 'subscriptions', 'channels': []}))
+    return streams, frames
+
+def build_books(book_factory, streams, **kwargs):
+    books, expected = {}, {}
+    for product_id, (snapshot, stream) in streams.items():
+        state = feed.create_product_state(product_id, depth=5)
+        books[product_id] = book_factory(snapshot, product_id=product_id, depth_ladder=state.depth_ladder, **kwargs)
+        reference = book_factory(snapshot, product_id=product_id)
+        for message in stream:
+            reference.on_message(message)
+        expected[product_id] = (state, reference)
+    return books, expected
+
+def run_feed(multi_feed, frames):
+    async def run():
+        async with serve_frames(frames) as server:
+            multi_feed.url = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+            await asyncio.wait_for(multi_feed.run(), 20)
+    asyncio.run(run())
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_one_connection_feeds_every_book(workers, feeds, book_factory):
+    streams, frames = feeds
+    books, expected = build_books(book_factory, streams)
+    multi_feed = feed.MultiProductFeed(books, workers=workers, idle_timeout=0.05)
+    try:
+        run_feed(multi_feed, frames)
+        assert multi_feed.stats.messages.total == len(frames)
+        assert multi_feed.stats.decode_errors == 1   #the subscriptions message
+        for product_id, (state, reference) in expected.items():
+            asks, bids = state.depth_ladder.read()
+            ask_prices, ask_sizes, bid_prices, bid_sizes = reference.get_depth(5, 5)
+            assert asks[:, 0].tolist() == [float(p) for p in ask_prices]
+            assert bids[:, 1].tolist() == [float(s) for s in bid_sizes]
+            if not workers:
+                assert books[product_id]._sequence == streams[product_id][1][-1]['sequence']
+    finally:
+        for state, _ in expected.values():
+            feed.close_product_state(state)
+
+def test_connection_stats_are_published_once_an_interval(feeds, book_factory):
+    streams, frames = feeds
+    books, expected = build_books(book_factory, streams)
+
+    class CountingNamespace(object):
+        publishes = 0
+
+        def __setattr__(self, name, value):
+            if name == 'connection_stats':
+                type(self).publishes += 1
+            object.__setattr__(self, name, value)
+
+    ns = CountingNamespace()
+    multi_feed = feed.MultiProductFeed(books, ns=ns)
+    try:
+        for frame in frames[:200]:   #a quiet feed, every message its own batch
+            multi_feed.on_batch([frame])
+        assert CountingNamespace.publishes == 1
+        multi_feed.publish_stats(force=True)
+        assert ns.connection_stats['messages'] == 200
+    finally:
+        for state, _ in expected.values():
+            feed.close_product_state(state)
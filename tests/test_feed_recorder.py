@@ -0,0 +1,32 @@
+import gzip
+
+from pygotrader import feed_recorder
+
+
+def test_records_round_trip(tmp_path):
+    path = tmp_path / 'feed.gz'
+    with feed_recorder.FeedRecorder(path) as recorder:
+        recorder.record_frame('{"type": "heartbeat"}', recv_ns=1)
+        recorder.record_snapshot({'sequence': 5, 'bids': [], 'asks': []}, recv_ns=2)
+        recorder.record_frame(b'\x00binary', recv_ns=3)
+    records = list(feed_recorder.read_feed(path))
+    assert [(r.recv_ns, r.kind) for r in records] == [(1, feed_recorder.FRAME), (2, feed_recorder.SNAPSHOT),
+                                                      (3, feed_recorder.FRAME)]
+    assert records[0].payload == b'{"type": "heartbeat"}'
+    assert records[2].payload == b'\x00binary'
+
+def test_reopening_appends(tmp_path):
+    path = tmp_path / 'feed.gz'
+    for i in range(3):
+        with feed_recorder.FeedRecorder(path) as recorder:
+            recorder.record_frame(str(i))
+    assert [r.payload for r in feed_recorder.read_feed(path)] == [b'0', b'1', b'2']
+
+def test_truncated_record_is_ignored(tmp_path):
+    path = tmp_path / 'feed.gz'
+    with feed_recorder.FeedRecorder(path) as recorder:
+        recorder.record_frame('first')
+        recorder.record_frame('second' * 100)
+    data = gzip.decompress(path.read_bytes())
+    path.write_bytes(gzip.compress(data[:-10]))
+    assert [r.payload for r in feed_recorder.read_feed(path)] == [b'first']
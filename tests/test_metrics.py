@@ -0,0 +1,52 @@
+from pygotrader.metrics import FeedStats, Histogram, RateMeter
+
+
+def test_histogram_percentiles_are_close():
+    histogram = Histogram()
+    for value in range(1, 1001):
+        histogram.record(value)
+    assert histogram.count == 1000
+    assert histogram.min == 1 and histogram.max == 1000
+    assert histogram.mean == 500.5
+    for p in (50, 90, 99):
+        exact = 10 * p
+        assert exact <= histogram.percentile(p) <= exact * 1.2
+    assert histogram.percentile(100) == 1000
+
+def test_histogram_distribution_counts_everything():
+    histogram = Histogram(resolution=1)
+    for value in (0, 1, 3, 3, 100):
+        histogram.record(value)
+    distribution = histogram.distribution()
+    assert sum(count for _, count in distribution) == 5
+    assert [edge for edge, _ in distribution] == sorted(edge for edge, _ in distribution)
+
+def test_rate_meter_uses_last_interval():
+    now = [0.0]
+    meter = RateMeter(interval=1.0, clock=lambda: now[0])
+    meter.mark(10)
+    now[0] = 2.0
+    meter.mark(10)
+    assert meter.total == 20
+    assert meter.rate == 10.0
+
+def test_feed_stats_snapshot():
+    stats = FeedStats()
+    stats.record_batch(4)
+    stats.record_batch(1)
+    snapshot = stats.snapshot()
+    assert snapshot['messages'] == 5
+    assert snapshot['batches'] == 2
+    assert snapshot['batch_size']['max'] == 4
+
+def test_histogram_percentiles_of_sub_second_values():
+    histogram = Histogram()
+    values = [0.001 * i for i in range(1, 201)]
+    for value in values:
+        histogram.record(value)
+    for p in (50, 90, 99):
+        exact = values[p * 2 - 1]
+        assert exact <= histogram.percentile(p) <= exact * 1.2
+    histogram.record(0)
+    assert histogram.percentile(0.1) == 0
+    assert histogram.distribution()[0] == (0, 1)
@@ -0,0 +1,159 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import socket
+import struct
+import time
+import types
+
+import cbpro
+import pytest
+
+from pygotrader.order_gateway import ConnectionPool, OrderGateway
+
+SECRET = base64.b64encode(b'not a real secret').decode()
+
+
+def make_gateway(url, **options):
+    client = cbpro.AuthenticatedClient('key', SECRET, 'passphrase', api_url=url)
+    ns = types.SimpleNamespace(message='', my_orders={})
+    return OrderGateway(client, ns, **options)
+
+def collect(receiver, count, timeout=10):
+    results = []
+    deadline = time.monotonic() + timeout
+    while len(results) < count and receiver.poll(max(deadline - time.monotonic(), 0)):
+        results.append(receiver.recv())
+    return results
+
+def order_requests(standin):
+    return [r for r in standin.requests if r[0] != 'GET']
+
+
+def test_connection_pool_keeps_connections_alive(order_standin):
+    async def burst():
+        pool = ConnectionPool(order_standin.url, size=4)
+        try:
+            for _ in range(3):
+                responses = await asyncio.gather(*(pool.request('DELETE', f'/orders/{i}') for i in range(4)))
+                assert [json.loads(r.body) for r in responses] == [[str(i)] for i in range(4)]
+            return pool.opened, pool.reused
+        finally:
+            await pool.close()
+
+    opened, reused = asyncio.run(burst())
+    assert opened == 4
+    assert reused == 8
+    assert len(order_standin.connections) == 4
+
+def test_burst_goes_out_concurrently(order_standin):
+    order_standin.latency = 0.2
+    gateway = make_gateway(order_standin.url, max_in_flight=8)
+    results = gateway.add_result_listener()
+    gateway.start()
+    try:
+        start = time.monotonic()
+        request_ids = [gateway.create_cancel_order(f'order-{i}') for i in range(8)]
+        request_ids += [gateway.create_buy_order(0.01, None, 'BTC-USD', strategy='trend') for _ in range(8)]
+        events = collect(results, 16)
+        elapsed = time.monotonic() - start
+    finally:
+        gateway.close()
+
+    #two round trips for sixteen orders, not sixteen
+    assert elapsed < 1.5
+    assert order_standin.peak == 8
+    assert sorted(e['request_id'] for e in events) == sorted(request_ids)
+    assert all(e['ok'] for e in events)
+    buys = [e for e in events if e['order'] == 'buy']
+    assert all(e['strategy'] == 'trend' and e['response']['status'] == 'pending' for e in buys)
+    assert len({e['order_id'] for e in buys}) == 8
+    assert max(e['seconds'] for e in events) >= 0.2
+    #the second wave went over the first wave's connections
+    assert len({r[4] for r in order_requests(order_standin)}) == 8
+
+def test_orders_are_sent_in_the_order_they_were_created(order_standin):
+    gateway = make_gateway(order_standin.url, max_in_flight=1)
+    results = gateway.add_result_listener()
+    gateway.start()
+    try:
+        for i in range(5):
+            gateway.create_sell_order(i + 1, 100 + i, 'BTC-USD', type='limit')
+            gateway.create_cancel_order(f'order-{i}')
+        events = collect(results, 10)
+    finally:
+        gateway.close()
+
+    sent = order_requests(order_standin)
+    assert [r[0] for r in sent] == ['POST', 'DELETE'] * 5
+    assert [json.loads(r[3])['size'] for r in sent[::2]] == ['1', '2', '3', '4', '5']
+    assert [r[1] for r in sent[1::2]] == [f'/orders/order-{i}' for i in range(5)]
+    limit = json.loads(sent[0][3])
+    assert (limit['type'], limit['price'], limit['post_only']) == ('limit', '100', True)
+    assert [e['order'] for e in events] == ['sell', 'cancel'] * 5
+
+def test_requests_are_signed_and_failures_reported(order_standin):
+    gateway = make_gateway(order_standin.url)
+    results = gateway.add_result_listener()
+    gateway.start()
+    try:
+        gateway.create_buy_order(1, None, 'BAD-USD')
+        event, = collect(results, 1)
+    finally:
+        gateway.close()
+
+    assert not event['ok']
+    assert event['status'] == 400
+    assert event['response'] == {'message': 'Product not found'}
+    method, path, headers, body, _ = order_requests(order_standin)[0]
+    message = (headers['CB-ACCESS-TIMESTAMP'] + method + path + body.decode()).encode()
+    expected = base64.b64encode(hmac.new(base64.b64decode(SECRET), message, hashlib.sha256).digest()).decode()
+    assert headers['CB-ACCESS-SIGN'] == expected
+    assert headers['CB-ACCESS-KEY'] == 'key'
+
+def test_orders_queued_before_close_are_all_sent(order_standin):
+    order_standin.latency = 0.05
+    gateway = make_gateway(order_standin.url, max_in_flight=1)
+    results = gateway.add_result_listener()
+    gateway.start()
+    request_ids = [gateway.create_cancel_order(f'order-{i}') for i in range(10)]
+    gateway.close()
+
+    events = collect(results, 10, timeout=1)
+    assert [e['request_id'] for e in events] == request_ids
+    assert [r[1] for r in order_requests(order_standin)] == [f'/orders/order-{i}' for i in range(10)]
+
+def test_post_is_not_sent_again_when_the_connection_resets():
+    requests = []
+
+    async def serve(reader, writer):
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            method = head.split(b' ', 1)[0].decode()
+            length = int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0])
+            await reader.readexactly(length)
+            requests.append(method)
+            if method == 'POST':
+                #took the order, then the connection broke before the answer
+                writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                                           struct.pack('ii', 1, 0))
+                writer.transport.abort()
+                return
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n[]')
+            await writer.drain()
+
+    async def run():
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        pool = ConnectionPool(f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}', size=1)
+        try:
+            await pool.request('GET', '/orders')
+            with pytest.raises(ConnectionError):
+                await pool.request('POST', '/orders', b'{}')
+        finally:
+            await pool.close()
+            server.close()
+
+    asyncio.run(run())
+    assert requests == ['GET', 'POST']
@@ -0,0 +1,127 @@
+import threading
+import time
+import types
+
+from pygotrader import order_handler
+
+
+class FakeClient(object):
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.placed = []
+        self.lock = threading.Lock()
+
+    def place_order(self, **kwargs):
+        time.sleep(self.delay)
+        with self.lock:
+            self.placed.append(kwargs)
+            return {'id': f'order-{len(self.placed)}', 'status': 'pending'}
+
+    def get_orders(self):
+        return [{'id': 'order-1', 'product_id': 'BTC-USD', 'side': 'buy', 'type': 'limit',
+                 'price': '100.00', 'size': '1.0', 'status': 'open'}]
+
+
+def test_order_ids_sent_to_listeners():
+    client = FakeClient()
+    handler = order_handler.OrderHandler(client, types.SimpleNamespace(message='', my_orders={}))
+    listeners = [handler.add_order_id_listener(), handler.add_order_id_listener()]
+
+    result, order_id, order = handler.place_order(size='1.0', price='100.00', side='buy',
+                                                  product_id='BTC-USD', type='limit')
+    handler.load_my_orders()
+
+    client_oid = client.placed[0]['client_oid']
+    for listener in listeners:
+        updates = []
+        while listener.poll():
+            updates.append(listener.recv())
+        assert updates == [('expect', [client_oid]), ('add', [order_id]), ('replace', ['order-1'])]
+
+def test_orders_are_tagged_with_their_strategy():
+    client = FakeClient()
+    ns = types.SimpleNamespace(message='', my_orders={}, buy_order_queue=[], cancel_order_queue=[])
+    handler = order_handler.OrderHandler(client, ns)
+    tagged = order_handler.TaggedOrderHandler(handler, 'trend')
+    tagged.create_buy_order(size='1.0', price='100.00', product_id='BTC-USD', type='limit')
+    tagged.create_cancel_order('order-9')
+    assert ns.buy_order_queue[0]['strategy'] == 'trend'
+    cancel = dict(ns.cancel_order_queue[0])
+    assert cancel.pop('queued_ns') > 0
+    assert cancel == {'order': 'cancel', 'order_id': 'order-9', 'strategy': 'trend'}
+    assert tagged.order_timeout == handler.order_timeout
+
+    handler.tag_order('order-1', 'trend')
+    handler.load_my_orders()
+    assert ns.my_orders['order-1']['strategy'] == 'trend'
+
+def test_drain_takes_everything_oldest_first():
+    class RacingQueue(list):
+        """Gets another order appended right after the drain copies it"""
+        def __getitem__(self, index):
+            items = list.__getitem__(self, index)
+            if isinstance(index, slice) and len(self) < 4:
+                self.append({'order': 'buy', 'size': len(self) + 1})
+            return items
+
+    ns = types.SimpleNamespace(message='', buy_order_queue=RacingQueue())
+    handler = order_handler.OrderHandler(FakeClient(), ns)
+    for size in (1, 2, 3):
+        ns.buy_order_queue.append({'order': 'buy', 'size': size, 'queued_ns': time.time_ns()})
+    assert [q['size'] for q in handler.drain_queue('buy_order_queue')] == [1, 2, 3]
+    #the order that came in during the drain is still there for the next one
+    assert [q['size'] for q in ns.buy_order_queue] == [4]
+    assert handler.stats.snapshot()['queue_time']['count'] == 3
+
+def test_burst_is_placed_at_once():
+    client = FakeClient(delay=0.2)
+    ns = types.SimpleNamespace(message='', my_orders={}, buy_order_queue=[], sell_order_queue=[],
+                               cancel_order_queue=[])
+    handler = order_handler.OrderHandler(client, ns)
+    for size in range(1, 6):
+        handler.create_buy_order(size=size, price=None, product_id='BTC-USD')
+    thread = threading.Thread(target=handler.main_loop)
+    start = time.monotonic()
+    thread.start()
+    try:
+        deadline = start + 5
+        while 'order_handler_stats' not in vars(ns) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        elapsed = time.monotonic() - start
+    finally:
+        handler.shutdown_event.set()
+        thread.join(5)
+    assert not thread.is_alive()
+
+    assert sorted(order['size'] for order in client.placed) == [1, 2, 3, 4, 5]
+    assert elapsed < 0.2 * 5
+    assert ns.buy_order_queue == []
+    stats = ns.order_handler_stats
+    assert stats['drains'] == 1 and stats['depth']['max'] == 5
+    assert stats['sent'] == {'buy': 5} and stats['succeeded'] == 5
+    assert stats['queue_time']['count'] == 5
+    assert stats['submit_time']['min'] >= 0.2
+    assert ns.message.startswith('5 buy orders, 0 failed')
+
+def test_batch_taken_before_shutdown_is_still_placed():
+    client = FakeClient()
+    ns = types.SimpleNamespace(message='', my_orders={}, buy_order_queue=[], sell_order_queue=[],
+                               cancel_order_queue=[])
+    handler = order_handler.OrderHandler(client, ns)
+    drain_queue = handler.drain_queue
+
+    def drain_then_shut_down(queue_name):
+        batch = drain_queue(queue_name)
+        handler.shutdown_event.set()
+        time.sleep(0.1)   #long enough for main_loop to get to the executor
+        return batch
+
+    handler.drain_queue = drain_then_shut_down
+    for size in (1, 2):
+        handler.create_buy_order(size=size, price=None, product_id='BTC-USD')
+    thread = threading.Thread(target=handler.main_loop)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert sorted(order['size'] for order in client.placed) == [1, 2]
+    assert ns.order_handler_stats['succeeded'] == 2
@@ -0,0 +1,56 @@
+import random
+import uuid
+
+import pytest
+
+from pygotrader import order_store
+
+
+def order_ids(n, seed=7):
+    rng = random.Random(seed)
+    return [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(n)]
+
+@pytest.fixture(params=['dict', 'compact'])
+def store(request):
+    return order_store.create_order_store(request.param)
+
+def test_insert_and_pop(store):
+    ids = order_ids(3)
+    store.insert(ids[0], True, 100, 5)
+    store.insert(ids[1], False, 101, 7)
+    assert len(store) == 2
+    assert store.pop(ids[0]) == (True, 100, 5)
+    assert store.pop(ids[0]) is None
+    assert store.pop(ids[2]) is None
+    assert len(store) == 1
+
+def test_reduce_and_set_size(store):
+    order_id = order_ids(1)[0]
+    assert store.reduce(order_id, 1) is None
+    assert store.set_size(order_id, 1) is None
+    store.insert(order_id, False, 42, 10)
+    assert store.reduce(order_id, 3) == (False, 42)
+    assert store.set_size(order_id, 4) == (False, 42, -3)
+    assert list(store.items()) == [(order_id, False, 42, 4)]
+
+def test_stores_agree_under_churn():
+    compact = order_store.CompactOrderStore(capacity=16)
+    reference = order_store.DictOrderStore()
+    rng = random.Random(3)
+    live = []
+    for order_id in order_ids(5000):
+        if live and rng.random() < 0.45:
+            gone = live.pop(rng.randrange(len(live)))
+            assert compact.pop(gone) == reference.pop(gone)
+        tick = rng.randint(0, 1000)
+        compact.insert(order_id, tick % 2 == 0, tick, tick * 3)
+        reference.insert(order_id, tick % 2 == 0, tick, tick * 3)
+        live.append(order_id)
+    assert len(compact) == len(reference)
+    assert sorted(compact.items()) == sorted(reference.items())
+    #freed slots are reused rather than growing the arrays forever
+    assert compact._capacity < 2 * 5000
+
+def test_unknown_store():
+    with pytest.raises(ValueError):
+        order_store.create_order_store('btree')
@@ -0,0 +1,65 @@
+import types
+
+from pygotrader.publisher import StatePublisher
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingNamespace(types.SimpleNamespace):
+    writes = 0
+
+    def __setattr__(self, name, value):
+        if name != 'writes':
+            self.writes += 1
+        super().__setattr__(name, value)
+
+
+def test_coalesces_until_interval():
+    clock = Clock()
+    ns = CountingNamespace()
+    publisher = StatePublisher(ns, interval=0.1, significant_change=None, clock=clock)
+    for price in range(100):
+        publisher.set('highest_bid', 100.0 + price / 1000)
+        assert not publisher.maybe_flush()
+    assert publisher.dirty == ['highest_bid']
+    assert ns.writes == 0
+
+    clock.now = 0.25
+    assert publisher.maybe_flush()
+    assert ns.highest_bid == 100.099
+    assert ns.writes == 1
+    assert publisher.staleness.max == 0.25
+    assert publisher.snapshot()['fields_written'] == 1
+
+def test_unchanged_values_are_not_written():
+    clock = Clock()
+    ns = CountingNamespace()
+    publisher = StatePublisher(ns, significant_change=None, clock=clock)
+    publisher.set('last_match', 10.0)
+    publisher.flush()
+    publisher.set('last_match', 11.0)
+    publisher.set('last_match', 10.0)
+    clock.now = 1.0
+    assert not publisher.maybe_flush()
+    assert ns.writes == 1
+
+def test_significant_change_flushes_early():
+    clock = Clock()
+    ns = CountingNamespace()
+    publisher = StatePublisher(ns, interval=10.0, significant_change=0.01, triggers=['highest_bid'], clock=clock)
+    publisher.set('highest_bid', 100.0)
+    assert publisher.maybe_flush()   #first value
+
+    publisher.set('highest_bid', 100.5)
+    publisher.set('spread', 5.0)
+    assert not publisher.maybe_flush()
+    publisher.set('highest_bid', 101.5)
+    assert publisher.maybe_flush()
+    assert (ns.highest_bid, ns.spread) == (101.5, 5.0)
+    assert publisher.significant_flushes == 2
@@ -0,0 +1,376 @@
+import asyncio
+import calendar
+import datetime
+import json
+import multiprocessing
+import pickle
+import threading
+import time
+import types
+from decimal import Decimal
+
+import pytest
+
+from conftest import make_feed, serve_frames, snapshot_of
+from pygotrader import pygo_order_book, shared_state
+
+
+def replay(book, stream):
+    for message in stream:
+        book.on_message(message)
+
+def test_level_sizes_match_recompute(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    book = book_factory(snapshot, check_level_sizes=True)
+    replay(book, stream)
+    book.verify_level_sizes()
+    assert book._sequence == stream[-1]['sequence']
+
+@pytest.mark.parametrize('seed', [2, 3, 4])
+def test_level_sizes_match_recompute_other_feeds(seed, book_factory):
+    snapshot, stream = make_feed(seed=seed, orders=50, messages=1000)
+    book = book_factory(snapshot)
+    replay(book, stream)
+    book.verify_level_sizes()
+
+def test_verify_level_sizes_detects_drift(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    book = book_factory(snapshot)
+    replay(book, stream[:100])
+    price = book.get_bid()
+    book._bid_sizes[price] += Decimal('0.1')
+    with pytest.raises(AssertionError):
+        book.verify_level_sizes()
+
+def test_get_depth_uses_level_totals(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    book = book_factory(snapshot)
+    replay(book, stream)
+    ask_prices, ask_sizes, bid_prices, bid_sizes = book.get_depth(5, 5)
+    assert ask_prices == sorted(ask_prices)
+    assert bid_prices == sorted(bid_prices, reverse=True)
+    for price, size in zip(ask_prices, ask_sizes):
+        assert size == sum(o['size'] for o in book._asks[price])
+    for price, size in zip(bid_prices, bid_sizes):
+        assert size == sum(o['size'] for o in book._bids[price])
+
+def assert_same_depth(sorted_book, tick_book, levels=10):
+    expected = [[float(v) for v in values] for values in sorted_book.get_depth(levels, levels)]
+    assert [list(values) for values in tick_book.get_depth(levels, levels)] == expected
+
+@pytest.mark.parametrize('order_store', ['dict', 'compact'])
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_tick_engine_replays_like_sorted_engine(seed, order_store, book_factory):
+    snapshot, stream = make_feed(seed=seed, orders=100, messages=1500)
+    sorted_book = book_factory(snapshot)
+    tick_book = book_factory(snapshot, book_engine='tick', quote_increment='0.01', check_level_sizes=True,
+                             order_store=order_store)
+    for message in stream:
+        sorted_book.on_message(message)
+        tick_book.on_message(message)
+        assert_same_depth(sorted_book, tick_book)
+    assert tick_book.get_bid() == float(sorted_book.get_depth(1, 1)[2][0])
+    assert tick_book.get_ask() == float(sorted_book.get_depth(1, 1)[0][0])
+
+def test_tick_engine_recenters_small_window(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    sorted_book = book_factory(snapshot)
+    tick_book = book_factory(snapshot, book_engine='tick', quote_increment='0.01', check_level_sizes=True,
+                             tick_window=16)
+    for message in stream:
+        sorted_book.on_message(message)
+        tick_book.on_message(message)
+        assert_same_depth(sorted_book, tick_book, levels=30)
+
+def test_tick_engine_rejects_unknown_engine(book_factory):
+    with pytest.raises(ValueError):
+        book_factory({}, book_engine='btree')
+
+def test_tick_engine_looks_up_quote_increment(synthetic_feed, book_factory, monkeypatch):
+    snapshot, stream = synthetic_feed
+    book = book_factory(snapshot, book_engine='tick')
+    monkeypatch.setattr(book._client, 'get_products',
+                        lambda: [{'id': 'ETH-USD', 'quote_increment': '0.1'},
+                                 {'id': 'BTC-USD', 'quote_increment': '0.01'}])
+    book.on_message(stream[0])
+    assert book.quote_increment == '0.01'
+    assert book.tick_book.tick_size == 1
+
+@pytest.mark.parametrize('timestamp', ['2019-08-14T20:42:27.265Z', '2019-08-14T20:42:27.265123Z',
+                                       '2020-02-29T00:00:00.000001Z', '1999-12-31T23:59:59.9Z'])
+def test_parse_timestamp_ns_matches_strptime(timestamp):
+    expected = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
+    time_ns = pygo_order_book.parse_timestamp_ns(timestamp)
+    assert pygo_order_book.timestamp_ns_to_datetime(time_ns) == expected
+    assert time_ns == calendar.timegm(expected.timetuple()) * 10**9 + expected.microsecond * 1000
+
+def test_parse_timestamp_ns_without_fraction():
+    assert pygo_order_book.parse_timestamp_ns('1970-01-02T00:00:01Z') == 86401 * 10**9
+
+def test_exchange_message_from_match():
+    message = pygo_order_book.ExchangeMessage({
+        'type': 'match', 'trade_id': 10, 'sequence': 50, 'maker_order_id': 'a', 'taker_order_id': 'b',
+        'time': '2014-11-07T08:19:27.028459Z', 'product_id': 'BTC-USD', 'size': '5.23512',
+        'price': '400.23', 'side': 'sell'})
+    assert message.sequence == 50
+    assert message.price == 400.23
+    assert message.size == 5.23512
+    assert message.time == datetime.datetime(2014, 11, 7, 8, 19, 27, 28459)
+    assert message.order_id is None
+    assert not hasattr(message, '__dict__')
+    assert pickle.loads(pickle.dumps(message)).time_ns == message.time_ns
+
+def test_matches_go_to_match_buffer(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    buffer = shared_state.MatchRingBuffer(capacity=4096)
+    try:
+        book = book_factory(snapshot, match_buffer=buffer)
+        replay(book, stream)
+        expected = [m for m in stream if m['type'] == 'match']
+        window, cursor = buffer.since_cursor(0)
+        assert cursor == len(expected)
+        assert window.sequence.tolist() == [m['sequence'] for m in expected]
+        assert window.price.tolist() == [float(m['price']) for m in expected]
+        assert window.ts_ns[-1] == pygo_order_book.parse_timestamp_ns(expected[-1]['time'])
+        book.publish_state(force=True)
+        assert book.ns.last_match == float(expected[-1]['price'])
+    finally:
+        buffer.close()
+        buffer.unlink()
+
+def test_listen_applies_batches(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    frames = [json.dumps(m) for m in stream]
+    frames.insert(10, '{not json')
+    book = book_factory(snapshot)
+    book.shutdown_event = threading.Event()
+
+    async def run():
+        async with serve_frames(frames) as server:
+            port = server.sockets[0].getsockname()[1]
+            book.url = f'ws://127.0.0.1:{port}'
+            await book._listen({'type': 'subscribe'})
+
+    asyncio.run(run())
+    expected = book_factory(snapshot)
+    replay(expected, stream)
+    assert book.get_depth(10, 10) == expected.get_depth(10, 10)
+    assert book._sequence == stream[-1]['sequence']
+    assert book.stats.messages.total == len(stream)
+    assert book.stats.decode_errors == 1
+    assert book.stats.batch_sizes.count < len(stream)
+    assert book.ns.feed_stats['messages'] == len(stream)
+
+def test_gap_resyncs_from_snapshot(synthetic_feed, book_factory, monkeypatch):
+    snapshot, stream = synthetic_feed
+    reference = book_factory(snapshot)
+    replay(reference, stream[:600])
+    later = snapshot_of(reference)
+    replay(reference, stream[600:])
+
+    book = book_factory(snapshot, check_level_sizes=True)
+    replay(book, stream[:500])
+    monkeypatch.setattr(book._client, 'get_product_order_book', lambda product_id, level: later)
+    replay(book, stream[520:])
+    assert book.get_depth(10, 10) == reference.get_depth(10, 10)
+    assert book._sequence == stream[-1]['sequence']
+    assert book.stats.gaps == 1
+    assert book.stats.missed_messages == stream[520]['sequence'] - stream[499]['sequence'] - 1
+    assert book.stats.resyncs == 2   #the initial load counts as well
+    assert not book.resyncing
+
+def test_gap_resync_against_standins(synthetic_feed, book_factory, rest_standin):
+    api_url, responses = rest_standin
+    snapshot, stream = synthetic_feed
+    reference = book_factory(snapshot)
+    replay(reference, stream[:600])
+    later = snapshot_of(reference)
+    replay(reference, stream[600:])
+    #initial load, then a failed snapshot request that has to be retried
+    responses.extend([(200, snapshot), (500, {'message': 'Internal server error'}), (200, later)])
+    frames = [json.dumps(m) for m in stream[:500] + stream[520:]]
+
+    book = pygo_order_book.PygoOrderBook(types.SimpleNamespace(my_orders={}, highest_bid=0.0, last_match=0.0),
+                                         api_url=api_url, depth_interval=0.05, resync_retry=0.05)
+    book.shutdown_event = threading.Event()
+
+    async def run():
+        async with serve_frames(frames, hold_open=True) as server:
+            book.url = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+            listener = asyncio.ensure_future(book._listen({'type': 'subscribe'}))
+            for _ in range(200):
+                if book._sequence == stream[-1]['sequence']:
+                    break
+                await asyncio.sleep(0.05)
+            book.shutdown_event.set()
+            await asyncio.wait_for(listener, 5)
+
+    asyncio.run(run())
+    assert book._sequence == stream[-1]['sequence']
+    assert book.get_depth(10, 10) == reference.get_depth(10, 10)
+    assert responses.requests == ['/products/BTC-USD/book?level=3'] * 3
+    assert book.stats.resync_failures == 1
+    assert book.ns.feed_stats['resyncs'] == 2
+    assert book.ns.feed_stats['gaps'] == 1
+    assert book.ns.feed_stats['resync_seconds_total'] > 0
+
+
+class CountingDict(dict):
+    """Stands in for the Manager dict, counting the lookups that would be IPC"""
+    lookups = 0
+
+    def __contains__(self, key):
+        self.lookups += 1
+        return super().__contains__(key)
+
+    def __getitem__(self, key):
+        self.lookups += 1
+        return super().__getitem__(key)
+
+
+def test_own_orders_tracked_from_channel(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    opened = [m for m in stream if m['type'] == 'open']
+    mine = opened[5]['order_id']
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    book = book_factory(snapshot, order_id_channel=receiver)
+    book.ns.my_orders = CountingDict()
+    sender.send(('add', [mine]))
+    replay(book, stream)
+
+    assert book.my_order_ids == {mine}
+    assert mine in dict.keys(book.ns.my_orders)
+    touching = [m for m in stream if mine in (m.get('order_id'), m.get('maker_order_id'))]
+    assert book.ns.my_orders.lookups <= len(touching)
+
+    sender.send(('replace', []))
+    book.on_messages([])
+    assert book.my_order_ids == set()
+
+def test_own_order_recognized_by_client_oid(book_factory):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    book = book_factory({'sequence': 1, 'bids': [], 'asks': []}, order_id_channel=receiver)
+    sender.send(('expect', ['client-1']))
+    book.read_order_id_updates()
+    book.handle_my_order({'type': 'received', 'order_id': 'abc', 'client_oid': 'client-1',
+                          'side': 'buy', 'order_type': 'market'})
+    book.handle_my_order({'type': 'open', 'order_id': 'abc', 'side': 'buy', 'price': '100.00',
+                          'remaining_size': '1.0'})
+    assert book.ns.my_orders['abc']['size'] == '1.0'
+    book.handle_my_order({'type': 'open', 'order_id': 'xyz', 'side': 'buy', 'price': '100.00',
+                          'remaining_size': '1.0'})
+    assert 'xyz' not in book.ns.my_orders
+
+    sender.close()
+    book.read_order_id_updates()
+    assert book.order_id_channel is None
+
+def test_expected_client_oids_dont_pile_up(book_factory, monkeypatch):
+    book = book_factory({'sequence': 1, 'bids': [], 'asks': []})
+    level2 = book_factory(None, channel='level2')
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    book.update_my_order_ids('expect', ['rejected-1', 'rejected-2'])
+    now[0] += book.expect_timeout
+    book.update_my_order_ids('expect', ['client-3'])
+    assert list(book._expected_client_oids) == ['client-3']
+
+    level2.update_my_order_ids('expect', ['client-4'])
+    assert not level2._expected_client_oids
+
+def test_scalar_state_is_coalesced(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    book = book_factory(snapshot, publish_interval=60.0, significant_change=None)
+    replay(book, stream)
+    #the first values, then nothing until the interval is up
+    assert book.publisher.fields_written <= 5
+    book.publish_state(force=True)
+    assert book.ns.highest_bid == book.get_bid()
+    assert book.ns.lowest_ask == book.get_ask()
+    assert book.ns.spread == book.get_ask() - book.get_bid()
+    assert 'publisher' in book.ns.feed_stats
+
+
+def level2_stream(full_book, stream):
+    """Turn a full channel stream into what the level2 + matches channels 
+    would have sent, by diffing the full book's levels after each message"""
+    def levels():
+        return {('buy', p): s for p, s in full_book._bid_sizes.items() if s} | \
+               {('sell', p): s for p, s in full_book._ask_sizes.items() if s}
+
+    full_book.on_message(stream[0])
+    before = levels()
+    frames = [{'type': 'snapshot', 'product_id': 'BTC-USD',
+               'bids': [[str(p), str(s)] for (side, p), s in before.items() if side == 'buy'],
+               'asks': [[str(p), str(s)] for (side, p), s in before.items() if side == 'sell']}]
+    for message in stream[1:]:
+        full_book.on_message(message)
+        after = levels()
+        changes = [[side, str(p), str(after.get((side, p), 0))]
+                   for side, p in set(before) | set(after) if before.get((side, p)) != after.get((side, p))]
+        if message['type'] == 'match':
+            frames.append(message)
+        if changes:
+            frames.append({'type': 'l2update', 'product_id': 'BTC-USD', 'time': message['time'],
+                           'changes': changes})
+        before = after
+    return frames
+
+def test_level2_channel_tracks_full_book(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    full_book = book_factory(snapshot)
+    frames = level2_stream(full_book, stream)
+    buffer = shared_state.MatchRingBuffer(capacity=4096)
+    try:
+        book = book_factory(None, channel='level2', quote_increment='0.01', match_buffer=buffer)
+        assert book.channels == ['level2', 'matches']
+        for i, frame in enumerate(frames):
+            book.on_message(frame)
+            if i % 100 == 0:
+                book.verify_level_sizes()
+        book.verify_level_sizes()
+        expected = full_book.get_depth(10, 10)
+        assert book.get_depth(10, 10) == tuple([float(v) for v in column] for column in expected)
+        assert book.get_bid() == float(full_book.get_bid())
+        assert book.resyncing is False
+        assert buffer.since_cursor(0)[1] == sum(1 for m in stream if m['type'] == 'match')
+    finally:
+        buffer.close()
+        buffer.unlink()
+
+def test_level2_rejects_unknown_channel(book_factory):
+    with pytest.raises(ValueError):
+        book_factory(None, channel='level3')
+
+def test_batches_notify_update_signal(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    signal = shared_state.UpdateSignal()
+    reader = signal.reader()
+    book = book_factory(snapshot, update_signal=signal)
+    book.on_messages(stream[:100])
+    book.on_messages([])
+    book.on_messages(stream[100:200])
+    assert reader.consume()[0] == 2
+
+def test_market_snapshot_matches_the_book(synthetic_feed, book_factory):
+    snapshot, stream = synthetic_feed
+    buffer = shared_state.MatchRingBuffer(capacity=4096)
+    market = shared_state.SharedMarketSnapshot(levels=5)
+    try:
+        book = book_factory(snapshot, match_buffer=buffer, market_snapshot=market)
+        book.on_messages(stream[:300])
+        version = market.read().version
+        book.on_messages([])   #nothing changed, nothing published
+        assert market.read().version == version
+        book.on_messages(stream[300:])
+        read = market.read(buffer, window=1e9)
+        ask_prices, ask_sizes, bid_prices, bid_sizes = book.get_depth(5, 5)
+        assert read.asks.tolist() == [[float(p), float(s)] for p, s in zip(ask_prices, ask_sizes)]
+        assert read.bids.tolist() == [[float(p), float(s)] for p, s in zip(bid_prices, bid_sizes)]
+        assert read.sequence == book._sequence == stream[-1]['sequence']
+        assert read.match_cursor == buffer.cursor
+        assert read.last_price == read.matches.price[-1] == book.publisher.values['last_match']
+    finally:
+        for shared in (buffer, market):
+            shared.close()
+            shared.unlink()
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from pygotrader import reloader
+from pygotrader.reloader import AlgorithmReloader, FileWatcher
+
+
+@pytest.fixture(params=[True, False], ids=['inotify', 'poll'])
+def use_inotify(request):
+    if request.param and reloader._inotify() is None:
+        pytest.skip("inotify isn't available here")
+    return request.param
+
+
+def test_watcher_sees_writes_and_replacements(tmp_path, use_inotify):
+    path = tmp_path / 'algorithm.py'
+    path.write_text('a = 1\n')
+    watcher = FileWatcher(str(path), poll_interval=0.01, use_inotify=use_inotify)
+    try:
+        assert watcher.mode == ('inotify' if use_inotify else 'poll')
+        assert not watcher.wait(0.05)
+        (tmp_path / 'other.py').write_text('')
+        assert not watcher.wait(0.05)
+
+        path.write_text('a = 22\n')
+        assert watcher.wait(1.0)
+        while watcher.wait(0.05):
+            pass
+
+        (tmp_path / 'new.py').write_text('a = 333\n')
+        os.replace(tmp_path / 'new.py', path)
+        assert watcher.wait(1.0)
+    finally:
+        watcher.close()
+
+def test_watcher_waits_for_a_new_file_to_be_written(tmp_path):
+    if reloader._inotify() is None:
+        pytest.skip("inotify isn't available here")
+    path = tmp_path / 'algorithm.py'
+    watcher = FileWatcher(str(path), use_inotify=True)
+    try:
+        with open(path, 'w') as f:
+            f.write('def trading_algorithm(')
+            f.flush()
+            #created and half written, but not closed yet
+            assert not watcher.wait(0.05)
+            f.write('):\n    pass\n')
+        assert watcher.wait(1.0)
+    finally:
+        watcher.close()
+
+def test_load_checks_the_module(tmp_path):
+    path = tmp_path / 'algorithm.py'
+    path.write_text("calls = []\ndef trading_algorithm(ns, matches=None):\n    calls.append(ns)\n")
+    available = {'ns': 1, 'matches': 2, 'order_handler': 3}
+    loader = AlgorithmReloader(str(path), available, use_inotify=False)
+    try:
+        first = loader.load()
+        assert first.error is None
+        assert first.kwargs == {'ns': 1, 'matches': 2}
+        first.module.trading_algorithm(**first.kwargs)
+
+        second = loader.load()
+        assert second.module is not first.module
+        assert (first.module.calls, second.module.calls) == ([1], [])
+
+        path.write_text("def trading_algorithm(ns:\n")
+        assert 'SyntaxError' in loader.load().error
+        path.write_text("def something_else(ns):\n    pass\n")
+        assert 'no trading_algorithm' in loader.load().error
+        assert loader.stats.failures == 2
+        assert loader.stats.load_time.count == 2
+    finally:
+        loader.close()
+
+def test_changes_are_loaded_in_the_background(tmp_path, use_inotify):
+    path = tmp_path / 'algorithm.py'
+    path.write_text("def trading_algorithm(ns):\n    return 1\n")
+    loader = AlgorithmReloader(str(path), {'ns': None}, poll_interval=0.01, use_inotify=use_inotify).start()
+    try:
+        assert loader.take() is None
+        path.write_text("def trading_algorithm(ns):\n    return 2\n")
+        assert loader.ready.wait(2.0)
+        loaded = loader.take()
+        assert loaded.module.trading_algorithm(None) == 2
+        assert loader.take() is None
+    finally:
+        loader.close()
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import threading
+import types
+
+import pytest
+
+from conftest import serve_frames, snapshot_of
+from pygotrader import feed_recorder, pygo_order_book, replay
+
+
+def create_namespace():
+    return types.SimpleNamespace(highest_bid=0.0, last_match=0.0, lowest_ask=0.0, message='', my_orders={})
+
+@pytest.fixture
+def recording(tmp_path, synthetic_feed, book_factory, rest_standin):
+    """Record a live session (with a gap in it) against the stand-ins
+
+    Returns (path, reference book holding the expected final state, frames sent)
+    """
+    api_url, responses = rest_standin
+    snapshot, stream = synthetic_feed
+    reference = book_factory(snapshot)
+    for message in stream[:600]:
+        reference.on_message(message)
+    responses.extend([(200, snapshot), (200, snapshot_of(reference))])
+    for message in stream[600:]:
+        reference.on_message(message)
+    frames = [json.dumps(m) for m in stream[:500] + stream[520:]]
+
+    path = tmp_path / 'feed.gz'
+    recorder = feed_recorder.FeedRecorder(path)
+    book = pygo_order_book.PygoOrderBook(create_namespace(), api_url=api_url, depth_interval=0.05,
+                                         recorder=recorder)
+    book.shutdown_event = threading.Event()
+
+    async def run():
+        async with serve_frames(frames, hold_open=True) as server:
+            book.url = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+            listener = asyncio.ensure_future(book._listen({'type': 'subscribe'}))
+            for _ in range(200):
+                if book._sequence == stream[-1]['sequence']:
+                    break
+                await asyncio.sleep(0.05)
+            book.shutdown_event.set()
+            await asyncio.wait_for(listener, 5)
+
+    asyncio.run(run())
+    recorder.close()
+    assert book._sequence == stream[-1]['sequence']
+    return path, reference, len(frames)
+
+def test_recording_holds_frames_and_snapshots(recording):
+    path, reference, frames = recording
+    records = list(feed_recorder.read_feed(path))
+    kinds = [r.kind for r in records]
+    assert kinds.count(feed_recorder.FRAME) == frames
+    assert kinds.count(feed_recorder.SNAPSHOT) == 2
+    times = [r.recv_ns for r in records if r.kind == feed_recorder.FRAME]
+    assert times == sorted(times)
+
+def test_replay_direct_matches_live(recording):
+    path, reference, frames = recording
+    book = pygo_order_book.PygoOrderBook(create_namespace())
+    assert replay.replay_direct(book, path) == frames
+    assert book._sequence == reference._sequence
+    assert book.get_depth(10, 10) == reference.get_depth(10, 10)
+    assert book.stats.gaps == 1
+    assert book.stats.resyncs == 2
+
+def test_replay_direct_with_tick_engine(recording):
+    path, reference, frames = recording
+    book = pygo_order_book.PygoOrderBook(create_namespace(), book_engine='tick', quote_increment='0.01')
+    replay.replay_direct(book, path)
+    expected = [[float(v) for v in values] for values in reference.get_depth(10, 10)]
+    assert [list(values) for values in book.get_depth(10, 10)] == expected
+
+def test_replay_is_paced(recording):
+    path, reference, frames = recording
+    records = [r for r in feed_recorder.read_feed(path) if r.kind == feed_recorder.FRAME]
+    recorded = (records[-1].recv_ns - records[0].recv_ns) / 1e9
+    pacer = replay._Pacer(speed=0.5)
+    pacer.delay(records[0].recv_ns)
+    assert pacer.delay(records[-1].recv_ns) == pytest.approx(2 * recorded, abs=0.05)
+
+def test_replay_through_server_matches_live(recording):
+    path, reference, frames = recording
+    book = pygo_order_book.PygoOrderBook(create_namespace(), depth_interval=0.05)
+    assert asyncio.run(replay._replay_through_server(book, path, None)) == frames
+    assert book._sequence == reference._sequence
+    assert book.get_depth(10, 10) == reference.get_depth(10, 10)
@@ -0,0 +1,87 @@
+import random
+
+import numpy as np
+import pytest
+
+from pygotrader import rolling_stats, shared_state
+
+stats = pytest.importorskip('scipy.stats')
+
+
+def stream(n, seed=1):
+    rng = random.Random(seed)
+    t, price = 0.0, 10000.0
+    for i in range(n):
+        t += rng.expovariate(3.0)   #trades come in bursts
+        price += rng.gauss(0, 2.5)
+        yield t, price
+
+def test_rolling_ols_and_moments_match_scipy():
+    window = 250
+    ols = rolling_stats.RollingOLS()
+    moments = rolling_stats.RollingMoments()
+    high = rolling_stats.RollingMax()
+    low = rolling_stats.RollingMin()
+    points = list(stream(5000))
+    for i, (x, y) in enumerate(points):
+        ols.add(x, y)
+        moments.add(y)
+        high.add(i, y)
+        low.add(i, y)
+        if i >= window:
+            ols.remove(*points[i - window])
+            moments.remove(points[i - window][1])
+            high.evict(i - window + 1)
+            low.evict(i - window + 1)
+        if i % 499 == 0 and i > 2:
+            xs, ys = map(np.array, zip(*points[max(0, i - window + 1):i + 1]))
+            fit = stats.linregress(xs, ys)
+            assert ols.slope == pytest.approx(fit.slope, rel=1e-6)
+            assert ols.intercept == pytest.approx(fit.intercept, rel=1e-6)
+            assert ols.rvalue == pytest.approx(fit.rvalue, rel=1e-6, abs=1e-9)
+            assert moments.mean == pytest.approx(ys.mean(), rel=1e-9)
+            assert moments.variance() == pytest.approx(ys.var(ddof=1), rel=1e-6)
+            assert moments.zscore(ys[-1]) == pytest.approx(stats.zscore(ys, ddof=1)[-1], rel=1e-6)
+            assert (high.value, low.value) == (ys.max(), ys.min())
+
+def test_ewma_matches_pandas_style_recursion():
+    ewma = rolling_stats.EWMA(alpha=0.2)
+    values = [1.0, 2.0, 4.0, 3.0]
+    expected = values[0]
+    for value in values:
+        ewma.update(value)
+        expected = expected + 0.2 * (value - expected) if value is not values[0] else value
+    assert ewma.mean == pytest.approx(expected)
+
+def test_ewma_halflife_in_time():
+    ewma = rolling_stats.EWMA(halflife=10.0)
+    ewma.update(0.0, t=0.0)
+    ewma.update(1.0, t=10.0)
+    assert ewma.mean == pytest.approx(0.5)
+    ewma.update(1.0, t=10.0)   #no time passed, no weight
+    assert ewma.mean == pytest.approx(0.5)
+
+@pytest.mark.parametrize('capacity', [64, 4096])
+def test_match_stats_follow_buffer(capacity):
+    matches = shared_state.MatchRingBuffer(capacity=capacity)
+    try:
+        price_stats = rolling_stats.RollingMatchStats(matches, seconds=20, clock=lambda: 0)
+        second = 10**9
+        for i, (t, price) in enumerate(stream(600)):
+            matches.append(i, int(t * second), price, 0.5, shared_state.BUY)
+            if i % 7 == 0:
+                now_ns = int(t * second)
+                price_stats.update(now_ns)
+                window = matches.last(20, now_ns=now_ns, copy=True)
+                if window.count > 2:
+                    fit = stats.linregress((window.ts_ns - window.ts_ns[0]) / 1e9, window.price)
+                    assert price_stats.count == window.count
+                    assert price_stats.ols.slope == pytest.approx(fit.slope, rel=1e-6)
+                    assert price_stats.prices.mean == pytest.approx(window.price.mean(), rel=1e-9)
+                    assert price_stats.high.value == window.price.max()
+                    assert price_stats.volume == pytest.approx(0.5 * window.count)
+        #the small buffer wraps inside a window, so it has to start over now and then
+        assert (price_stats.rebuilds > 0) == (capacity < 600)
+    finally:
+        matches.close()
+        matches.unlink()
@@ -0,0 +1,243 @@
+import pickle
+import threading
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from pygotrader import shared_state
+
+
+@pytest.fixture
+def ladder():
+    ladder = shared_state.SharedDepthLadder(levels=20)
+    yield ladder
+    ladder.close()
+    ladder.unlink()
+
+def test_depth_ladder_starts_empty(ladder):
+    asks, bids = ladder.read()
+    assert asks.shape == (0, 2)
+    assert bids.shape == (0, 2)
+    assert ladder.sequence == 0
+
+def test_depth_ladder_publish_and_read(ladder):
+    ladder.publish([Decimal('100.01'), Decimal('100.02')], [Decimal('1.5'), Decimal('2')],
+                   [Decimal('100.00')], [Decimal('0.25')])
+    asks, bids = ladder.read()
+    assert asks.tolist() == [[100.01, 1.5], [100.02, 2.0]]
+    assert bids.tolist() == [[100.00, 0.25]]
+    assert ladder.sequence == 2
+    assert ladder.published_at > 0
+
+def test_depth_ladder_shrinking_publish_clears_old_levels(ladder):
+    ladder.publish(list(range(1, 21)), [1.0] * 20, list(range(1, 21)), [1.0] * 20)
+    ladder.publish([5.0], [1.0], [], [])
+    asks, bids = ladder.read()
+    assert asks.tolist() == [[5.0, 1.0]]
+    assert len(bids) == 0
+
+def test_depth_ladder_truncates_to_levels(ladder):
+    ladder.publish(np.arange(50.0), np.ones(50), np.arange(50.0), np.ones(50))
+    asks, bids = ladder.read()
+    assert len(asks) == ladder.levels
+    assert len(bids) == ladder.levels
+
+def test_depth_ladder_reattaches_when_unpickled(ladder):
+    ladder.publish([1.0], [2.0], [0.5], [3.0])
+    attached = pickle.loads(pickle.dumps(ladder))
+    asks, bids = attached.read()
+    assert asks.tolist() == [[1.0, 2.0]]
+    assert bids.tolist() == [[0.5, 3.0]]
+    attached.close()
+
+def test_depth_ladder_needs_a_level():
+    with pytest.raises(ValueError):
+        shared_state.SharedDepthLadder(levels=0)
+
+
+@pytest.fixture
+def matches():
+    buffer = shared_state.MatchRingBuffer(capacity=8)
+    yield buffer
+    buffer.close()
+    buffer.unlink()
+
+def fill(buffer, first, last):
+    for i in range(first, last):
+        buffer.append(100 + i, i * 10**9, 1000.0 + i, 0.5, shared_state.BUY if i % 2 else shared_state.SELL)
+
+def test_match_buffer_since_cursor(matches):
+    fill(matches, 0, 5)
+    window, cursor = matches.since_cursor(0)
+    assert window.price.tolist() == [1000.0, 1001.0, 1002.0, 1003.0, 1004.0]
+    assert cursor == 5
+    fill(matches, 5, 7)
+    window, cursor = matches.since_cursor(cursor)
+    assert window.sequence.tolist() == [105, 106]
+    assert cursor == 7
+
+def test_match_buffer_copy_skips_the_row_being_overwritten(matches):
+    fill(matches, 0, 8)
+    assert matches.since_cursor(0, copy=True)[0].count == 8
+    #the writer is halfway through lapping the buffer by one row: match 8 is
+    #going into row 0's slot, but the cursor hasn't moved yet
+    matches._header[2] = 9
+    matches._columns.sequence[0] = 108
+    window, cursor = matches.since_cursor(0, copy=True)
+    assert window.sequence.tolist() == list(range(101, 108))
+    assert window.price.tolist() == [1000.0 + i for i in range(1, 8)]
+    assert cursor == 8
+
+def test_match_buffer_wraps_and_drops_oldest(matches):
+    fill(matches, 0, 13)
+    window, cursor = matches.since_cursor(0)
+    assert window.sequence.tolist() == list(range(105, 113))
+    assert window.side.tolist() == [1, -1, 1, -1, 1, -1, 1, -1]
+    assert cursor == 13
+
+def test_match_buffer_views_without_wrapping(matches):
+    fill(matches, 0, 4)
+    window = matches.since(101)
+    assert window.sequence.tolist() == [102, 103]
+    assert np.shares_memory(window.price, matches._columns.price)
+    copied = matches.since(101, copy=True)
+    assert not np.shares_memory(copied.price, matches._columns.price)
+
+def test_match_buffer_since_sequence_across_wrap(matches):
+    fill(matches, 0, 11)
+    assert matches.since(104).sequence.tolist() == list(range(105, 111))
+    assert matches.since(108).sequence.tolist() == [109, 110]
+    assert matches.since(110).count == 0
+    assert matches.since(0).count == 8
+
+def test_match_buffer_last_seconds(matches):
+    fill(matches, 0, 11)
+    window = matches.last(3, now_ns=10 * 10**9)
+    assert window.ts_ns.tolist() == [7 * 10**9, 8 * 10**9, 9 * 10**9, 10 * 10**9]
+    assert matches.last(3, now_ns=100 * 10**9).count == 0
+
+def test_match_buffer_reattaches_when_unpickled(matches):
+    fill(matches, 0, 3)
+    attached = pickle.loads(pickle.dumps(matches))
+    assert attached.since_cursor(0)[0].price.tolist() == [1000.0, 1001.0, 1002.0]
+    attached.close()
+
+
+def test_record_publish_and_read():
+    record = shared_state.SharedRecord(('bid', 'ask'))
+    try:
+        assert all(np.isnan(v) for v in record.read().values())
+        record.publish([100.0, 100.5])
+        assert record.read() == {'bid': 100.0, 'ask': 100.5}
+        assert record.sequence == 2
+
+        attached = pickle.loads(pickle.dumps(record))
+        assert attached.fields == ('bid', 'ask')
+        assert attached.read_array().tolist() == [100.0, 100.5]
+        attached.close()
+    finally:
+        record.close()
+        record.unlink()
+
+def test_update_signal_coalesces_notifies():
+    signal = shared_state.UpdateSignal()
+    reader = signal.reader()
+    assert not reader.wait(0)
+    signal.notify()
+    first = reader.consume()[1]
+    signal.notify()
+    signal.notify()
+    assert reader.wait(0)
+    updates, oldest = reader.consume()
+    assert updates == 3
+    assert oldest >= first > 0
+    assert not reader.wait(0)
+    assert reader.consume() == (3, 0)
+
+def test_update_signal_wakes_every_reader():
+    signal = shared_state.UpdateSignal(history=4)
+    signal.notify()
+    late = signal.reader()
+    readers = [signal.reader(), signal.reader()]
+    signal.notify()
+    stamps = [reader.consume() for reader in readers]
+    assert stamps[0] == stamps[1] and stamps[0][0] == 2 and stamps[0][1] > 0
+    assert not readers[0].wait(0) and late.wait(0)
+    for _ in range(10):
+        signal.notify()
+    #fell further behind than the history, so the oldest update still kept is used
+    assert late.consume() == (12, signal._counters[1 + 9 % 4])
+
+def test_market_snapshot_alternates_slots():
+    snapshot = shared_state.SharedMarketSnapshot(levels=3)
+    try:
+        empty = snapshot.read()
+        assert empty.version == 0
+        assert np.isnan(empty.bid) and empty.asks.shape == (0, 2)
+
+        snapshot.publish([Decimal('101'), Decimal('102')], [Decimal('1'), Decimal('2')], [100.0], [3.0],
+                         sequence=7, last_price=100.5, match_cursor=4, time_ns=123)
+        snapshot.publish([101.0], [1.5], [100.0, 99.0, 98.0, 97.0], [3.0, 4.0, 5.0, 6.0], sequence=8)
+        latest = snapshot.read()
+        assert (latest.version, latest.sequence) == (2, 8)
+        assert (latest.bid, latest.bid_size, latest.ask, latest.ask_size) == (100.0, 3.0, 101.0, 1.5)
+        assert latest.bids.tolist() == [[100.0, 3.0], [99.0, 4.0], [98.0, 5.0]]
+        assert np.isnan(latest.last_price)
+        with pytest.raises(ValueError):
+            latest.asks[0, 0] = 1.0
+
+        attached = pickle.loads(pickle.dumps(snapshot))
+        attached_latest = attached.read()
+        assert attached_latest.version == 2
+        assert attached_latest.asks.tolist() == [[101.0, 1.5]]
+        attached.close()
+    finally:
+        snapshot.close()
+        snapshot.unlink()
+
+def test_market_snapshot_reads_are_never_torn():
+    snapshot = shared_state.SharedMarketSnapshot(levels=5)
+    done = threading.Event()
+
+    def writer():
+        i = 0
+        while not done.is_set():
+            i += 1
+            price = float(i)
+            snapshot.publish([price + 1] * 5, [price] * 5, [price] * 5, [price] * 5, sequence=i,
+                             last_price=price)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        last_version = 0
+        for _ in range(2000):
+            read = snapshot.read()
+            assert read.version >= last_version
+            last_version = read.version
+            if read.version:
+                #every field comes from the same publish
+                assert read.sequence == read.last_price == read.bid == read.ask - 1
+                assert read.asks[:, 1].tolist() == [read.last_price] * 5
+    finally:
+        done.set()
+        thread.join()
+        snapshot.close()
+        snapshot.unlink()
+
+def test_market_snapshot_carries_the_match_window():
+    matches = shared_state.MatchRingBuffer(capacity=16)
+    snapshot = shared_state.SharedMarketSnapshot(levels=2)
+    try:
+        for i in range(10):
+            matches.append(i, i * 1_000_000_000, 100.0 + i, 1.0, shared_state.BUY)
+        snapshot.publish([], [], [], [], match_cursor=matches.cursor, time_ns=9_000_000_000)
+        matches.append(10, 10_000_000_000, 110.0, 1.0, shared_state.BUY)   #after the snapshot
+        read = snapshot.read(matches, window=3)
+        assert read.match_cursor == 10
+        assert read.matches.price.tolist() == [106.0, 107.0, 108.0, 109.0]
+        assert matches.since_cursor(read.match_cursor)[0].price.tolist() == [110.0]
+    finally:
+        for shared in (matches, snapshot):
+            shared.close()
+            shared.unlink()
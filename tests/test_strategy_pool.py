@@ -0,0 +1,95 @@
+import multiprocessing
+import time
+import types
+
+import pytest
+
+from pygotrader import order_handler, shared_state
+from pygotrader.strategy_pool import StrategyPool, StrategySpec, parse_strategy
+
+
+def test_parse_strategy():
+    assert parse_strategy('trend.py') == StrategySpec('trend', 'trend.py', None)
+    assert parse_strategy('algos/trend.py@0.5') == StrategySpec('trend', 'algos/trend.py', 0.5)
+    assert parse_strategy('me@home/trend.py') == StrategySpec('trend', 'me@home/trend.py', None)
+    with pytest.raises(ValueError):
+        parse_strategy('trend.py@0')
+
+def test_strategies_run_in_parallel_and_tag_their_orders(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'slow.py').write_text(
+        "import time\n"
+        "def trading_algorithm(ns, order_handler):\n"
+        "    order_handler.create_buy_order(size=1, price=0, product_id='BTC-USD')\n"
+        "    time.sleep(5)\n")
+    (tmp_path / 'fast.py').write_text(
+        "def trading_algorithm(ns, order_handler):\n"
+        "    ns.runs.append(1)\n"
+        "    if len(ns.runs) == 1:\n"
+        "        order_handler.create_sell_order(size=2, price=0, product_id='BTC-USD')\n")
+    manager = multiprocessing.Manager()
+    try:
+        ns = manager.Namespace()
+        ns.message = ''
+        ns.runs = manager.list()
+        ns.buy_order_queue = manager.list()
+        ns.sell_order_queue = manager.list()
+        handler = order_handler.OrderHandler(None, ns)
+        strategies = [parse_strategy(str(tmp_path / 'slow.py')), parse_strategy(str(tmp_path / 'fast.py') + '@0.01')]
+        pool = StrategyPool(ns, None, handler, strategies, run_rate=1.0)
+        assert pool.handlers['fast'].algorithm_run_rate == 0.01
+        assert pool.handlers['slow'].algorithm_run_rate == 1.0
+        pool.start()
+        try:
+            deadline = time.monotonic() + 10
+            while len(ns.runs) < 5 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            #fast kept going while slow was stuck in its first run
+            assert len(ns.runs) >= 5
+            assert [o['strategy'] for o in ns.buy_order_queue] == ['slow']
+            assert [o['strategy'] for o in ns.sell_order_queue] == ['fast']
+        finally:
+            pool.close()
+    finally:
+        manager.shutdown()
+
+def test_duplicate_names_get_numbered():
+    ns = types.SimpleNamespace()
+    pool = StrategyPool(ns, None, None, [parse_strategy('a.py'), parse_strategy('x/a.py')])
+    assert list(pool.handlers) == ['a', 'a2']
+    assert pool.handlers['a2'].stats_attribute == 'algorithm_stats_a2'
+
+def test_single_strategy_keeps_the_usual_names():
+    pool = StrategyPool(types.SimpleNamespace(), None, None, [parse_strategy('a.py')])
+    assert pool.handlers['a'].stats_attribute == 'algorithm_stats'
+    assert pool.handlers['a'].error_file == 'algorithm_error.txt'
+
+def test_every_event_strategy_wakes_on_an_update(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ('a', 'b'):
+        (tmp_path / f'{name}.py').write_text(
+            "def trading_algorithm(ns):\n"
+            f"    ns.runs.append('{name}')\n")
+    signal = shared_state.UpdateSignal()
+    manager = multiprocessing.Manager()
+    try:
+        ns = manager.Namespace()
+        ns.message = ''
+        ns.runs = manager.list()
+        strategies = [parse_strategy(str(tmp_path / 'a.py')), parse_strategy(str(tmp_path / 'b.py'))]
+        pool = StrategyPool(ns, None, None, strategies, schedule='event', update_signal=signal)
+        pool.start()
+        try:
+            signal.notify()
+            deadline = time.monotonic() + 5
+            while len(ns.runs) < 2 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            time.sleep(0.2)
+            assert sorted(ns.runs) == ['a', 'b']
+            #and both saw when the update was published
+            for stats in pool.stats().values():
+                assert stats['feed_to_decision']['count'] == 1
+        finally:
+            pool.close()
+    finally:
+        manager.shutdown()
@@ -0,0 +1,47 @@
+import pytest
+
+from pygotrader import shared_state
+from pygotrader.windows import RollingWindows
+
+SECOND = 10**9
+
+
+@pytest.fixture
+def matches():
+    buffer = shared_state.MatchRingBuffer(capacity=64)
+    yield buffer
+    buffer.close()
+    buffer.unlink()
+
+def fill(buffer, first, last):
+    for i in range(first, last):
+        buffer.append(i, i * SECOND, 1000.0 + i, 0.5, shared_state.BUY)
+
+def test_windows_follow_time(matches):
+    windows = RollingWindows(matches, lengths=(3, 10))
+    fill(matches, 0, 20)
+    windows.update(now_ns=19 * SECOND)
+    assert windows.window(3).time.tolist() == [16 * SECOND, 17 * SECOND, 18 * SECOND, 19 * SECOND]
+    assert windows.window(10).count == 11
+    assert windows.window(10).price[0] == 1009.0
+
+    fill(matches, 20, 25)
+    windows.update(now_ns=30 * SECOND)
+    assert windows.window(3).count == 0
+    assert windows.window(10).price.tolist() == [1020.0, 1021.0, 1022.0, 1023.0, 1024.0]
+
+@pytest.mark.parametrize('now', [70, 100, 130])
+def test_windows_match_last_across_wrap(matches, now):
+    windows = RollingWindows(matches, lengths=(5, 30, 1000))
+    for step in range(0, now, 7):
+        fill(matches, step, min(step + 7, now))
+        windows.update(now_ns=step * SECOND)
+    windows.update(now_ns=now * SECOND)
+    for length in windows.lengths:
+        expected = matches.last(length, now_ns=now * SECOND, copy=True)
+        assert windows.window(length, copy=True).time.tolist() == expected.ts_ns.tolist()
+
+def test_unknown_window_length(matches):
+    windows = RollingWindows(matches, lengths=(10,))
+    with pytest.raises(ValueError):
+        windows.window(60)